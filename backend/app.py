@@ -1,13 +1,29 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.openapi.docs import get_swagger_ui_html
-from pydantic import BaseModel, Field
-from typing import List
-from system import get_os
+from fastapi.responses import JSONResponse, StreamingResponse, Response
+from pydantic import BaseModel, ConfigDict, Field, ValidationError
+from typing import List, AsyncIterator, Iterator, Dict, Any, Literal, Optional, Tuple, Union
+from system import get_os, executor, ExecutorBusy, accounts, login_index, dumps, watcher, registry, request_duration
 from system.users import Users
 from system.groups import Groups
 from system.member import Member
+from system.query import next_cursor
+from system.batch import Batch
+from system.jobs import jobs
+from system.profiling import RequestProfiler, FORMATS, EXTENSIONS
+from pathlib import Path
+from urllib.parse import parse_qs
 import uvicorn
 import argparse
+import asyncio
+import os
+import sqlite3
+import csv
+import json
+import hashlib
+import time
+from email.utils import formatdate
+from contextlib import asynccontextmanager
 
 
 class GroupInfo(BaseModel):
@@ -22,6 +38,12 @@ class MemberInfo(BaseModel):
     users: List[str] = Field(description="List of users", default=[])
 
 
+class PasswordInfo(BaseModel):
+    """The password of a user"""
+    username: str = Field(description="username of the user")
+    passwd: str = Field(description="new password of the user")
+
+
 class UserInfo(BaseModel):
     """The linux User information """
     fullname: str = Field(description="full name of the user")
@@ -31,7 +53,320 @@ class UserInfo(BaseModel):
     shell: str = Field(description="the shell of the user", default="/bin/bash")
 
 
+class StatusMessage(BaseModel):
+    """The status of an operation"""
+    status: Union[int, str] = Field(description="status code of the operation")
+    message: str = Field(description="message describing the status")
+
+
+class UserEntry(BaseModel):
+    """A user of the users listing, only the requested fields are set"""
+    username: Optional[str] = Field(description="username of the user", default=None)
+    uid: Optional[int] = Field(description="uid of the user", default=None)
+    gid: Optional[int] = Field(description="gid of the primary group", default=None)
+    full_name: Optional[str] = Field(description="GECOS field of the user", default=None)
+    home_dir: Optional[str] = Field(description="home directory of the user", default=None)
+    shell: Optional[str] = Field(description="login shell of the user", default=None)
+    login: Optional[bool] = Field(description="True if the user is logged in", default=None)
+    groups: Optional[List[str]] = Field(description="groups of the user, primary first", default=None)
+
+
+class UsersListing(BaseModel):
+    """A page of the users listing"""
+    status: int = Field(description="status code")
+    users: Dict[str, UserEntry] = Field(description="username -> user")
+    next_cursor: Optional[str] = Field(description="cursor of the next page, null on the last one", default=None)
+
+
+class Session(BaseModel):
+    """A login session"""
+    tty: str = Field(description="terminal of the session, empty for graphical sessions")
+    host: str = Field(description="remote host, empty for local sessions")
+    pid: int = Field(description="pid of the session leader")
+    started: Optional[int] = Field(description="login time (epoch seconds)", default=None)
+    source: str = Field(description="utmp or logind")
+
+
+class SessionState(BaseModel):
+    """The active sessions of a user"""
+    sessions: List[Session] = Field(description="active sessions of the user")
+    ttys: List[str] = Field(description="terminals of the user", default=[])
+    hosts: List[str] = Field(description="remote hosts of the user", default=[])
+    first_seen: Optional[int] = Field(description="login time of the oldest session", default=None)
+
+
+class LastLogin(BaseModel):
+    """The last login of a user, from wtmp"""
+    time: int = Field(description="login time (epoch seconds)")
+    tty: str = Field(description="terminal of the login")
+    host: str = Field(description="remote host, empty for local logins")
+
+
+class PasswordState(BaseModel):
+    """The password ageing metadata of a user, never the hash"""
+    model_config = ConfigDict(from_attributes=True)
+
+    has_password: bool = Field(description="True if a usable password is set")
+    locked: bool = Field(description="True if the password is locked")
+    last_change: str = Field(description="day of the last password change")
+    min_days: str = Field(description="minimum password age")
+    max_days: str = Field(description="maximum password age")
+    warn_days: str = Field(description="warning period")
+    inactive_days: str = Field(description="inactivity period")
+    expire: str = Field(description="account expiration day")
+
+
+class UserDetail(BaseModel):
+    """The information of a single user"""
+    username: str = Field(description="username of the user")
+    uid: int = Field(description="uid of the user")
+    gid: int = Field(description="gid of the primary group")
+    full_name: str = Field(description="full name of the user")
+    home_dir: str = Field(description="home directory of the user")
+    shell: str = Field(description="login shell of the user")
+    login: bool = Field(description="True if the user is logged in")
+    session: Optional[SessionState] = Field(description="active sessions, null if not logged in", default=None)
+    last_login: Optional[LastLogin] = Field(description="last login, null if unknown", default=None)
+    groups: List[str] = Field(description="groups of the user, primary first")
+    password: Optional[PasswordState] = Field(description="password metadata, null if unreadable", default=None)
+
+
+class UserGroups(BaseModel):
+    """The groups of a user"""
+    status: int = Field(description="status code")
+    username: str = Field(description="username of the user")
+    groups: List[str] = Field(description="groups of the user, primary first")
+
+
+class GroupEntry(BaseModel):
+    """A group of the groups listing, only the requested fields are set"""
+    Group_Name: Optional[str] = Field(description="name of the group", default=None)
+    GID: Optional[int] = Field(description="gid of the group", default=None)
+    Members: Optional[List[str]] = Field(description="supplementary members of the group", default=None)
+
+
+class GroupsListing(BaseModel):
+    """A page of the groups listing"""
+    status: int = Field(description="status code")
+    groups: Dict[str, GroupEntry] = Field(description="group name -> group")
+    next_cursor: Optional[str] = Field(description="cursor of the next page, null on the last one", default=None)
+
+
+class GroupDetail(BaseModel):
+    """The information of a single group"""
+    Name: str = Field(description="name of the group")
+    Description: str = Field(description="password field of the group")
+    GroupCategory: int = Field(description="gid of the group")
+    SID: str = Field(description="comma separated members of the group")
+    Members: List[str] = Field(description="supplementary members of the group")
+
+
+class MembershipChange(BaseModel):
+    """The result of a membership change"""
+    status: int = Field(description="200 if every user was handled, 500 otherwise")
+    message: str = Field(description="message describing the status")
+    success_users: List[str] = Field(description="users handled")
+    failed_users: List[str] = Field(description="users not handled")
+
+
+class BatchOperation(BaseModel):
+    """An operation of a batch"""
+    action: Literal["add_user", "update_user", "del_user", "add_group", "del_group", "add_members", "del_members"] = \
+        Field(description="what to do")
+    username: str = Field(description="user of update_user and del_user", default="")
+    user: Optional[UserInfo] = Field(description="user of add_user and update_user", default=None)
+    group: Optional[GroupInfo] = Field(description="group of add_group and del_group", default=None)
+    members: Optional[MemberInfo] = Field(description="group and users of add_members and del_members", default=None)
+
+
+class BatchStep(BaseModel):
+    """The result of an operation of a batch"""
+    position: int = Field(description="position of the operation in the batch")
+    action: str = Field(description="action of the operation")
+    name: str = Field(description="user or group of the operation")
+    status: int = Field(description="200 if applied, 409 if refused, 424 if not applied because of another one")
+    message: str = Field(description="error or warning", default="")
+
+
+class BatchResult(BaseModel):
+    """The result of a batch"""
+    status: int = Field(description="200 if every operation was applied, 409 otherwise")
+    message: str = Field(description="message describing the status")
+    failed: Optional[int] = Field(description="position of the refused operation")
+    rolled_back: bool = Field(description="true if the account files are as before the batch")
+    results: List[BatchStep] = Field(description="one result per operation")
+
+
+class JobAccepted(BaseModel):
+    """A job accepted for a background run"""
+    status: int = Field(description="202")
+    job_id: str = Field(description="id of the job")
+    location: str = Field(description="where to follow the job")
+
+
+class JobProgress(BaseModel):
+    """The advance of a job"""
+    done: int = Field(description="items processed")
+    total: int = Field(description="items to process, 0 if unknown")
+
+
+class JobStatus(BaseModel):
+    """The status of a background job"""
+    id: str = Field(description="id of the job")
+    kind: str = Field(description="operation run by the job")
+    status: Literal["queued", "running", "succeeded", "failed"] = Field(description="state of the job")
+    progress: JobProgress = Field(description="advance of the job")
+    result: Any = Field(description="response of the operation once finished", default=None)
+    error: Optional[str] = Field(description="why the job could not run", default=None)
+    created: float = Field(description="submission time (epoch)")
+    started: Optional[float] = Field(description="start time (epoch)", default=None)
+    finished: Optional[float] = Field(description="end time (epoch)", default=None)
+    queued: Optional[int] = Field(description="jobs waiting in the queue, while queued", default=None)
+
+
+class DuplexStreamingResponse(StreamingResponse):
+    """A StreamingResponse whose iterator is still reading the request body.
+
+    StreamingResponse listens for the client disconnect on receive(), which
+    would swallow the body chunks the iterator waits for; the body stream
+    already reports the disconnect itself.
+    """
+
+    async def __call__(self, scope, receive, send) -> None:
+        await self.stream_response(send)
+        if self.background is not None:
+            await self.background()
+
+
+class MetricsMiddleware:
+    """Record the latency of every API response per route template.
+
+    The time is taken when the response starts, so a streamed response is
+    measured up to its first byte.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        started = False
+
+        def record(status: int) -> None:
+            # The router stores the matched route in the scope
+            route = scope.get("route")
+            request_duration.observe(time.perf_counter() - start, scope["method"],
+                                     getattr(route, "path", "unmatched"), str(status))
+
+        async def send_and_record(message) -> None:
+            nonlocal started
+            if message["type"] == "http.response.start":
+                started = True
+                record(message["status"])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_and_record)
+        except Exception:
+            if not started:
+                record(500)
+            raise
+
+
+class ProfilingMiddleware:
+    """Profile the requests asking for it with a header or a query flag.
+
+    `X-Profile: <format>` or `?profile=<format>` ("html", "collapsed" or
+    "text", "1" meaning html) profiles the request. The profile replaces the
+    response, whose status is moved to X-Profile-Status, or is written to
+    `directory` and named in the X-Profile header of the normal response.
+    Profiled requests run one at a time, the profilers are not reentrant.
+    """
+
+    def __init__(self, app, directory: str = ""):
+        self.app = app
+        self.directory = directory
+        self._lock = asyncio.Lock()
+
+    @staticmethod
+    def _format(scope) -> Optional[str]:
+        headers = dict(scope["headers"])
+        value = headers.get(b"x-profile", b"").decode()
+        if not value:
+            value = parse_qs(scope.get("query_string", b"").decode()).get("profile", [""])[0]
+        if not value or b"text/event-stream" in headers.get(b"accept", b""):
+            return None
+        return "html" if value in ("1", "true") else value
+
+    async def __call__(self, scope, receive, send) -> None:
+        format = self._format(scope) if scope["type"] == "http" else None
+        if format is None:
+            await self.app(scope, receive, send)
+            return
+
+        if format not in FORMATS:
+            response = JSONResponse(status_code=400, content={
+                "status": 400, "message": f"Unknown profile format: {format}, use {', '.join(FORMATS)}"})
+            await response(scope, receive, send)
+            return
+
+        path = None
+        if self.directory:
+            name = f"{time.strftime('%Y%m%d-%H%M%S')}-{time.monotonic_ns() % 1_000_000:06d}-{scope['method']}" \
+                   f"{scope['path'].replace('/', '_')}.{EXTENSIONS[format]}"
+            path = os.path.join(self.directory, name)
+
+        status = 500
+
+        async def send_or_hold(message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if path is not None:
+                    message = {**message, "headers": [*message.get("headers", []), (b"x-profile", path.encode())]}
+            # Without a directory the response is replaced by its profile
+            if path is not None:
+                await send(message)
+
+        async with self._lock:
+            profiler = RequestProfiler()
+            profiler.start()
+            try:
+                await self.app(scope, receive, send_or_hold)
+            finally:
+                profiler.stop()
+
+        profile = await asyncio.to_thread(profiler.render, format)
+        if path is not None:
+            await asyncio.to_thread(Path(path).write_text, profile)
+            return
+
+        response = Response(profile, media_type=FORMATS[format],
+                            headers={"X-Profile-Status": str(status), "X-Profile-Engine": profiler.engine})
+        await response(scope, receive, send)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    """
+    Requeue the jobs left by a previous run at startup, stop the background tasks at shutdown.
+    """
+    try:
+        await jobs.start()
+    except (OSError, sqlite3.Error):
+        # Without a job store everything but the jobs still works
+        pass
+    yield
+    await jobs.stop()
+    await watcher.stop()
+
+
 app = FastAPI(
+    lifespan=lifespan,
     title="my backend API for all use.",
     description="This APi mange Users and Groups of a system",
     version="0.1",
@@ -41,10 +376,85 @@ app = FastAPI(
     },
 )
 
+app.add_middleware(MetricsMiddleware)
+
+# Opt-in: the profiling flag of a request is ignored unless enabled here
+if os.environ.get("SYSMANAGE_PROFILING", "") in ("1", "true"):
+    app.add_middleware(ProfilingMiddleware, directory=os.environ.get("SYSMANAGE_PROFILE_DIR", ""))
+
 os_name: str = get_os()
 users: Users = Users(os_name)
 groups: Groups = Groups(os_name)
 
+
+@app.exception_handler(ExecutorBusy)
+async def executor_busy_handler(request: Request, exc: ExecutorBusy) -> JSONResponse:
+    """
+    Turn a saturated command executor into 429/503 so clients back off.
+    """
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={"status": exc.status_code, "message": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+
+async def _validators(request: Request, files: tuple, login: bool = False) -> Dict[str, str]:
+    """
+    Build the ETag and Last-Modified headers of an account listing.
+
+    The ETag covers the generation of the account files, the query string and,
+    when the response carries login flags, the set of logged in users.
+    """
+    generation, mtime = await accounts.signature(*files)
+    sessions = await login_index.fingerprint() if login else ""
+    digest = hashlib.sha1(f"{generation}|{request.url.query}|{sessions}".encode()).hexdigest()
+
+    return {
+        "ETag": f'"{digest}"',
+        "Last-Modified": formatdate(mtime / 1e9, usegmt=True),
+        "Cache-Control": "no-cache"
+    }
+
+
+def _not_modified(request: Request, headers: Dict[str, str]) -> bool:
+    """Check the If-None-Match header of a request against an ETag."""
+    if_none_match = request.headers.get("if-none-match", "")
+    return if_none_match == "*" or headers["ETag"] in [tag.strip() for tag in if_none_match.split(",")]
+
+
+async def _ndjson(names: List[str], rows: Iterator[Tuple[int, str, Any]], key: str,
+                  limit: Optional[int], chunk_size: int = 65536) -> AsyncIterator[bytes]:
+    """
+    Serialize a listing one entry per line.
+
+    Every line carries the name of its entry under `key`. A last line holds the
+    next_cursor when the page is full. Lines are sent by chunks, so memory
+    stays flat whatever the size of the listing.
+    """
+    chunk = bytearray()
+    count = 0
+    position = len(names)
+
+    for position, name, item in rows:
+        if isinstance(item, dict) and key not in item:
+            item = {key: name, **item}
+        chunk += dumps(item)
+        chunk += b"\n"
+        count += 1
+
+        if len(chunk) >= chunk_size:
+            yield bytes(chunk)
+            chunk.clear()
+
+    cursor = next_cursor(names, position, limit, count)
+    if cursor is not None:
+        chunk += dumps({"next_cursor": cursor})
+        chunk += b"\n"
+
+    if chunk:
+        yield bytes(chunk)
+
 ######################
 ####    index     ####
 ######################
@@ -60,16 +470,44 @@ async def root():
 #### Users route #####
 ######################
 
-@app.get("/api/users")
-async def get_users() -> dict:
+@app.get("/api/users", response_model=UsersListing)
+async def get_users(request: Request, limit: Optional[int] = None, cursor: str = "", fields: str = "",
+                    uid_min: Optional[int] = None, uid_max: Optional[int] = None, shell: str = "",
+                    kind: str = "", member_of: str = "", logged_in: Optional[bool] = None,
+                    stream: str = "") -> Response:
     """
     Endpoint to retrieve information about users.
+
+    Without parameters every user is returned with the legacy fields. limit and
+    cursor paginate, fields projects (login and groups are only computed when
+    requested) and the other parameters filter. stream=ndjson sends one user
+    per line as they are selected.
     """
-    return await users.get_all()
+    if stream not in ("", "ndjson"):
+        raise HTTPException(status_code=400, detail="The stream format must be ndjson")
+
+    login: bool = not fields or "login" in fields or logged_in is not None
+    headers: Dict[str, str] = await _validators(request, ("passwd", "group"), login)
+
+    if _not_modified(request, headers):
+        return Response(status_code=304, headers=headers)
+
+    try:
+        if stream:
+            names, rows = await users.select(limit, cursor, fields, uid_min, uid_max, shell, kind, member_of, logged_in)
+            return StreamingResponse(_ndjson(names, rows, "username", limit),
+                                     media_type="application/x-ndjson", headers=headers)
+
+        data = await users.query(limit, cursor, fields, uid_min, uid_max, shell, kind, member_of, logged_in)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # The records are serialized by orjson as they are
+    return Response(dumps(data), media_type="application/json", headers=headers)
 
 
 @app.get("/api/user/{user}")
-async def get_user(user: str) -> dict:
+async def get_user(user: str) -> Union[UserDetail, StatusMessage]:
     """
     Endpoint to retrieve information about users.
     """
@@ -80,10 +518,26 @@ async def get_user(user: str) -> dict:
     
 
 
+@app.get("/api/user/{user}/groups")
+async def get_user_groups(user: str) -> UserGroups:
+    """
+    Endpoint to retrieve the groups of a user, primary group first.
+    """
+    user_groups: Optional[List[str]] = await Member.get_user_groups(user)
+
+    if user_groups is None:
+        raise HTTPException(status_code=404, detail=f"User {user} not found.")
+
+    return {"status": 200, "username": user, "groups": user_groups}
+
+
 @app.post("/api/user/add")
-async def add_user(user_info: UserInfo) -> dict:
+async def add_user(user_info: UserInfo, job: bool = False) -> dict:
     """
     Endpoint to add a new user.
+
+    With job=true the user is created in the background: the answer is a 202
+    with the id of the job.
     """
     full_name: str = user_info.fullname
     username: str = user_info.username
@@ -94,6 +548,10 @@ async def add_user(user_info: UserInfo) -> dict:
     if not username:
         raise HTTPException(status_code=400, detail="Please provide a username for the user.")
 
+    if job:
+        return await _submit("add_user", user_info.model_dump(exclude={"passwd"}),
+                             {"passwd": passwd} if passwd else None)
+
     if not homedir:
         homedir = f"/home/{username}"
 
@@ -101,10 +559,10 @@ async def add_user(user_info: UserInfo) -> dict:
     created: dict = await users.add_user(username, full_name, homedir, shell)
 
     # password
-    if passwd:
-        rcode: bool = await Users.assign_password(username, passwd)
+    if passwd and created.get("status", False) == 200:
+        rcode: dict = await Users.assign_password(username, passwd)
         
-        if rcode and created.get("status", False) == 200:
+        if rcode.get("status") == 200:
             return {
                 "status": 200,
                 "message": f"L'utilisateur {username}: full_name: {full_name}, homedir: {homedir}, shell: {shell} a été créé",
@@ -114,24 +572,160 @@ async def add_user(user_info: UserInfo) -> dict:
             }
         else:
             return {
-                "status": created.get("status", 505),
-                "message": f"L'utilisateur {username}: full_name: {full_name}, homedir: {homedir}, shell: {shell} n'a pas été créé",
+                "status": rcode.get("status", 505),
+                "message": f"L'utilisateur {username}: full_name: {full_name}, homedir: {homedir}, shell: {shell} a été créé sans mot de passe",
                 "stdout": created.get("stdout", ""),
-                "error": created.get("error", ""),
-                "password": True
+                "error": rcode.get("error", rcode.get("message", "")),
+                "password": False
             }
     else:
         return created
 
 
+@app.post("/api/users/bulk")
+async def add_users_bulk(request: Request, format: str = "", batch_size: int = 500,
+                         job: bool = False) -> DuplexStreamingResponse:
+    """
+    Endpoint to create many users from a streamed NDJSON or CSV body.
+
+    Rows are validated against UserInfo as they arrive and created by batches
+    of batch_size. The response streams one NDJSON line per row, a progress
+    line after each batch and a final summary. With job=true the body is
+    read whole and the users are created in the background.
+    """
+    if not format:
+        format = "csv" if "csv" in request.headers.get("content-type", "") else "ndjson"
+
+    if format not in ("csv", "ndjson"):
+        raise HTTPException(status_code=400, detail="The format must be csv or ndjson.")
+
+    if batch_size < 1:
+        raise HTTPException(status_code=400, detail="The batch size must be positive.")
+
+    if job:
+        lines = [line async for line in _iter_lines(request)]
+        # The rows may hold passwords: the body is only kept in memory
+        return await _submit("bulk_add_users", {"format": format, "batch_size": batch_size}, {"lines": lines})
+
+    return DuplexStreamingResponse(_bulk_add_users(_iter_lines(request), format, batch_size),
+                                   media_type="application/x-ndjson")
+
+
+async def _iter_lines(request: Request) -> AsyncIterator[str]:
+    """Yield the lines of the request body as they are received."""
+    buffer = b""
+    async for chunk in request.stream():
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield line.decode("utf-8", errors="replace")
+    if buffer:
+        yield buffer.decode("utf-8", errors="replace")
+
+
+def _parse_bulk_row(line: str, format: str, header: List[str]) -> Dict[str, str]:
+    """Validate a row of the bulk body and turn it into a users.add_users row."""
+    data = dict(zip(header, next(csv.reader([line])))) if format == "csv" else json.loads(line)
+    user_info = UserInfo(**data)
+
+    if not user_info.username:
+        raise ValueError("Please provide a username for the user.")
+
+    fields = [user_info.username, user_info.fullname, user_info.passwd, user_info.homedir, user_info.shell]
+    if any(":" in field or "\n" in field for field in fields):
+        raise ValueError("Fields can not contain ':' or new lines.")
+
+    return {
+        "username": user_info.username,
+        "full_name": user_info.fullname,
+        "passwd": user_info.passwd,
+        "homedir": user_info.homedir or f"/home/{user_info.username}",
+        "shell": user_info.shell
+    }
+
+
+async def _bulk_add_users(lines: AsyncIterator[str], format: str, batch_size: int) -> AsyncIterator[bytes]:
+    """Create the users of the bulk body batch by batch, streaming the results."""
+    header: List[str] = []
+    batch: List[Dict[str, str]] = []
+    batch_rows: List[int] = []
+    row: int = 0
+    processed: int = 0
+    failed: int = 0
+
+    async def flush() -> AsyncIterator[bytes]:
+        nonlocal processed, failed
+        try:
+            results = await users.add_users(batch)
+        except ExecutorBusy as e:
+            # Too late for a 429, the response has started: report it per row
+            results = [{"username": entry["username"], "status": e.status_code, "message": str(e)} for entry in batch]
+
+        for number, result in zip(batch_rows, results):
+            processed += 1
+            failed += result["status"] != 200
+            yield json.dumps({"row": number, **result}).encode() + b"\n"
+        yield json.dumps({"progress": {"processed": processed, "failed": failed}}).encode() + b"\n"
+        batch.clear()
+        batch_rows.clear()
+
+    async for line in lines:
+        if not line.strip():
+            continue
+
+        if format == "csv" and not header:
+            header = next(csv.reader([line]))
+            continue
+
+        row += 1
+        try:
+            batch.append(_parse_bulk_row(line, format, header))
+            batch_rows.append(row)
+        except (ValueError, ValidationError) as e:
+            processed += 1
+            failed += 1
+            yield json.dumps({"row": row, "status": 400, "message": str(e)}).encode() + b"\n"
+            continue
+
+        if len(batch) >= batch_size:
+            async for chunk in flush():
+                yield chunk
+
+    if batch:
+        async for chunk in flush():
+            yield chunk
+
+    yield json.dumps({"status": 200 if not failed else 500, "processed": processed, "failed": failed}).encode() + b"\n"
+
+
+@app.put("/api/users/passwords")
+async def update_passwords(passwords: List[PasswordInfo]) -> dict:
+    """
+    Endpoint to assign the passwords of many users at once.
+    """
+    results: List[dict] = await Users.assign_passwords([(info.username, info.passwd) for info in passwords])
+    failed_users: List[str] = [result["username"] for result in results if result["status"] != 200]
+
+    return {
+        "status": 200 if not failed_users else 500,
+        "message": "All passwords were updated" if not failed_users else "Not all passwords were updated",
+        "results": results
+    }
+
+
 @app.delete("/api/user/{user}")
-async def del_user(user: str) -> dict:
+async def del_user(user: str, job: bool = False) -> dict:
     """
     Endpoint to delete a user.
+
+    With job=true the user is deleted in the background.
     """
     if not user:
         raise HTTPException(status_code=500, detail="Please provide a username for this user.")
 
+    if job:
+        return await _submit("del_user", {"username": user})
+
     return await users.del_user(user)
 
 
@@ -157,23 +751,57 @@ async def update_user(user: str, user_info: UserInfo) -> dict:
 #### Groups route #####
 #######################
 
-@app.get("/api/groups")
-async def get_groups() -> dict:
+@app.get("/api/groups", response_model=GroupsListing)
+async def get_groups(request: Request, limit: Optional[int] = None, cursor: str = "", fields: str = "",
+                     gid_min: Optional[int] = None, gid_max: Optional[int] = None, kind: str = "",
+                     member: str = "", stream: str = "") -> Response:
     """
     Endpoint to retrieve information about groups.
+
+    Without parameters every group is returned. limit and cursor paginate,
+    fields projects and the other parameters filter. stream=ndjson sends one
+    group per line as they are selected.
     """
-    return await groups.get_all()
+    if stream not in ("", "ndjson"):
+        raise HTTPException(status_code=400, detail="The stream format must be ndjson")
 
+    headers: Dict[str, str] = await _validators(request, ("group",))
 
-@app.get("/api/group/{groupname}")
-async def get_group(groupname: str) -> dict:
+    if _not_modified(request, headers):
+        return Response(status_code=304, headers=headers)
+
+    try:
+        if stream:
+            names, rows = await groups.select(limit, cursor, fields, gid_min, gid_max, kind, member)
+            return StreamingResponse(_ndjson(names, rows, "Group_Name", limit),
+                                     media_type="application/x-ndjson", headers=headers)
+
+        data = await groups.query(limit, cursor, fields, gid_min, gid_max, kind, member)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    # The records are serialized by orjson as they are
+    return Response(dumps(data), media_type="application/json", headers=headers)
+
+
+@app.get("/api/group/{groupname}", response_model=Union[GroupDetail, Dict[str, Any]])
+async def get_group(request: Request, groupname: str) -> Response:
     """
     Endpoint to retrieve information about groups.
     """
     if not groupname:
         raise HTTPException(status_code=500, detail="Please provide a groupname")
 
-    return await groups.get_group(groupname)
+    # Only the local groups can be validated against the group file
+    if await accounts.group(groupname) is None:
+        return await groups.get_group(groupname)
+
+    headers: Dict[str, str] = await _validators(request, ("group",))
+
+    if _not_modified(request, headers):
+        return Response(status_code=304, headers=headers)
+
+    return JSONResponse(await groups.get_group(groupname), headers=headers)
 
 
 @app.post("/api/group/add")
@@ -206,7 +834,7 @@ async def del_groups(group: GroupInfo) -> dict:
 #############################
 
 @app.get("/api/member")
-async def get_members(memberinfo: GroupInfo) -> dict:
+async def get_members(memberinfo: GroupInfo) -> List[str]:
     groupname: str = memberinfo.groupname
 
     if not groupname:
@@ -216,7 +844,7 @@ async def get_members(memberinfo: GroupInfo) -> dict:
 
 
 @app.post("/api/member/add")
-async def add_members(memberinfo: MemberInfo) -> dict:
+async def add_members(memberinfo: MemberInfo) -> MembershipChange:
     """
     Endpoint to add members to a group.
     """
@@ -226,15 +854,10 @@ async def add_members(memberinfo: MemberInfo) -> dict:
     if not groupname:
         raise HTTPException(status_code=500, detail="Please provide a groupname for this group.")
 
-    success_users = []
-    failed_users = []
-
-    for user in users:
-        response = await Member.add_member_to_group(groupname, user)
-        if response["status"] == 200:
-            success_users.append(user)
-        else:
-            failed_users.append(user)
+    # One rewrite of the group file for the whole list
+    response = await Member.add_members_to_group(groupname, users)
+    success_users = response["success_users"]
+    failed_users = response["failed_users"]
 
     message = f"All users were successfully added to group {groupname}" if not failed_users else f"Not all users were added to group {groupname}"
 
@@ -246,7 +869,7 @@ async def add_members(memberinfo: MemberInfo) -> dict:
     }
 
 @app.delete("/api/member/del")
-async def del_members(memberinfo: MemberInfo) -> dict:
+async def del_members(memberinfo: MemberInfo) -> MembershipChange:
     """
     Endpoint to remove members from a group.
     """
@@ -256,15 +879,10 @@ async def del_members(memberinfo: MemberInfo) -> dict:
     if not groupname:
         raise HTTPException(status_code=500, detail="Please provide a groupname for this group.")
 
-    success_users = []
-    failed_users = []
-
-    for user in users:
-        response = await Member.remove_member_from_group(groupname, user)
-        if response["status"] == 200:
-            success_users.append(user)
-        else:
-            failed_users.append(user)
+    # One rewrite of the group file for the whole list
+    response = await Member.remove_members_from_group(groupname, users)
+    success_users = response["success_users"]
+    failed_users = response["failed_users"]
 
     message = f"All users were successfully removed from group {groupname}" if not failed_users else f"Not all users were removed from group {groupname}"
 
@@ -275,6 +893,199 @@ async def del_members(memberinfo: MemberInfo) -> dict:
         "failed_users": failed_users
     }
 
+#######################
+#### Batch route ######
+#######################
+
+def _batch_operation(position: int, operation: BatchOperation) -> Dict[str, Any]:
+    """
+    Turn an operation of a batch into the fields of system.batch, checking it carries what its action needs.
+    """
+    def missing(what: str) -> HTTPException:
+        return HTTPException(status_code=400, detail=f"Operation {position} ({operation.action}) needs {what}")
+
+    if operation.action in ("add_user", "update_user"):
+        user = operation.user
+        username = operation.username or (user.username if user else "")
+        if user is None or not username:
+            raise missing("a user with a username")
+        return {"action": operation.action, "username": username, "full_name": user.fullname,
+                "homedir": user.homedir, "shell": user.shell, "passwd": user.passwd}
+
+    if operation.action == "del_user":
+        username = operation.username or (operation.user.username if operation.user else "")
+        if not username:
+            raise missing("a username")
+        return {"action": "del_user", "username": username}
+
+    if operation.action in ("add_group", "del_group"):
+        if operation.group is None or not operation.group.groupname:
+            raise missing("a group with a groupname")
+        return {"action": operation.action, "groupname": operation.group.groupname}
+
+    if operation.members is None or not operation.members.groupname:
+        raise missing("members with a groupname")
+    return {"action": operation.action, "groupname": operation.members.groupname, "users": operation.members.users}
+
+
+@app.post("/api/batch")
+async def run_batch(operations: List[BatchOperation], job: bool = False) -> BatchResult:
+    """
+    Endpoint to apply an ordered list of user, group and member operations, all or nothing.
+
+    With the native account backend the whole batch takes the account lock
+    once and rewrites every account file at most once. With job=true the
+    batch is checked, then applied in the background.
+    """
+    if not operations:
+        raise HTTPException(status_code=400, detail="Please provide at least one operation.")
+
+    planned = [_batch_operation(position, operation) for position, operation in enumerate(operations)]
+    if job:
+        passwords = {position: operation.pop("passwd") for position, operation in enumerate(planned)
+                     if operation.get("passwd")}
+        return await _submit("batch", {"operations": planned}, {"passwords": passwords} if passwords else None)
+
+    return await Batch(planned).run()
+
+#######################
+#### Jobs route #######
+#######################
+
+async def _submit(kind: str, payload: Dict[str, Any], secrets: Optional[Dict[str, Any]] = None) -> JSONResponse:
+    """
+    Queue a job and answer 202 with where to follow it. The secrets (passwords)
+    are kept in memory, never in the job store.
+    """
+    try:
+        job_id = await jobs.submit(kind, payload, secrets)
+    except (OSError, sqlite3.Error) as e:
+        raise HTTPException(status_code=503, detail=f"The job store is unavailable: {e}")
+
+    location = f"/api/jobs/{job_id}"
+    return JSONResponse(status_code=202, headers={"Location": location},
+                        content=JobAccepted(status=202, job_id=job_id, location=location).model_dump())
+
+
+async def _add_user_job(payload: Dict[str, Any], progress) -> dict:
+    return await add_user(UserInfo(**payload))
+
+
+async def _del_user_job(payload: Dict[str, Any], progress) -> dict:
+    return await del_user(payload["username"])
+
+
+async def _batch_job(payload: Dict[str, Any], progress) -> dict:
+    for position, passwd in payload.get("passwords", {}).items():
+        payload["operations"][position]["passwd"] = passwd
+    await progress(0, len(payload["operations"]))
+    result = await Batch(payload["operations"]).run()
+    await progress(len(payload["operations"]), len(payload["operations"]))
+    return result
+
+
+async def _bulk_add_users_job(payload: Dict[str, Any], progress) -> dict:
+    """Create the users of a bulk body, keeping the summary and the failed rows only."""
+    lines = payload["lines"]
+    total = sum(1 for line in lines if line.strip()) - (payload["format"] == "csv")
+    failures: List[Dict[str, Any]] = []
+    summary: Dict[str, Any] = {}
+
+    async def source() -> AsyncIterator[str]:
+        for line in lines:
+            yield line
+
+    async for chunk in _bulk_add_users(source(), payload["format"], payload["batch_size"]):
+        for line in chunk.splitlines():
+            entry = json.loads(line)
+            if "progress" in entry:
+                await progress(entry["progress"]["processed"], total)
+            elif "row" in entry:
+                if entry["status"] != 200:
+                    failures.append(entry)
+            else:
+                summary = entry
+
+    return {**summary, "failures": failures}
+
+
+jobs.register("add_user", _add_user_job)
+jobs.register("del_user", _del_user_job)
+jobs.register("batch", _batch_job)
+jobs.register("bulk_add_users", _bulk_add_users_job)
+
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str) -> JobStatus:
+    """
+    Endpoint to follow a background job: its state, progress and, once finished, its result.
+    """
+    try:
+        job = await jobs.get(job_id)
+    except (OSError, sqlite3.Error) as e:
+        raise HTTPException(status_code=503, detail=f"The job store is unavailable: {e}")
+
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job {job_id}")
+    return job
+
+#######################
+#### Events route #####
+#######################
+
+@app.get("/api/events")
+async def get_events(request: Request) -> StreamingResponse:
+    """
+    Endpoint publishing the changes of the users, groups, passwords and
+    sessions as server-sent events.
+
+    A client reconnecting with Last-Event-ID gets the events it missed, or a
+    "resync" event when it has to fetch the listings again.
+    """
+    last_event_id: Optional[int] = None
+    try:
+        last_event_id = int(request.headers.get("last-event-id", ""))
+    except ValueError:
+        pass
+
+    subscription = await watcher.subscribe(last_event_id)
+
+    async def stream() -> AsyncIterator[bytes]:
+        try:
+            # Ask the browser to wait 3 seconds before reconnecting
+            yield b"retry: 3000\n\n"
+            while True:
+                event = await subscription.get(timeout=15)
+                if event is None:
+                    # Keep the connection (and the proxies) alive
+                    yield b": keep-alive\n\n"
+                    continue
+                yield b"id: %d\nevent: %s\ndata: %s\n\n" % (event["id"], event["type"].encode(), dumps(event))
+        finally:
+            watcher.unsubscribe(subscription)
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+#######################
+#### System route #####
+#######################
+
+@app.get("/metrics")
+async def get_metrics() -> Response:
+    """
+    Endpoint exposing the metrics in the Prometheus text format.
+    """
+    return Response(registry.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.get("/api/executor")
+async def get_executor_stats() -> dict:
+    """
+    Endpoint to retrieve the command executor queue and wait time metrics.
+    """
+    return executor.stats()
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="FastAPI Server")
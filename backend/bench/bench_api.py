@@ -0,0 +1,226 @@
+####################################################################################
+# Author: Djetic Alexandre
+# Description: Load test of the API routes against a generated account
+#              database, in process: no root access and no network needed
+####################################################################################
+
+import argparse
+import asyncio
+import itertools
+import json
+import math
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from bench_records import make_passwd, make_group
+from system.query import encode_cursor
+
+# name, method, path, JSON body; {user} and {group} are drawn from the fixture,
+# {user_cursor} and {group_cursor} resume a listing after them and {n} counts
+# the requests of a route. /api/events (an endless stream) is not driven.
+ROUTES: List[Tuple[str, str, str, Optional[Callable[[str, str, int], Any]]]] = [
+    ("users", "GET", "/api/users", None),
+    ("users page", "GET", "/api/users?limit=100&cursor={user_cursor}", None),
+    ("users fields", "GET", "/api/users?fields=username,uid", None),
+    ("users filter", "GET", "/api/users?uid_min=10000&uid_max=10100", None),
+    ("users ndjson", "GET", "/api/users?stream=ndjson", None),
+    ("user", "GET", "/api/user/{user}", None),
+    ("user missing", "GET", "/api/user/missing-{user}", None),
+    ("user groups", "GET", "/api/user/{user}/groups", None),
+    ("groups", "GET", "/api/groups", None),
+    ("groups page", "GET", "/api/groups?limit=100&cursor={group_cursor}", None),
+    ("groups member", "GET", "/api/groups?member={user}", None),
+    ("groups ndjson", "GET", "/api/groups?stream=ndjson", None),
+    ("group", "GET", "/api/group/{group}", None),
+    ("members", "GET", "/api/member", lambda user, group, n: {"groupname": group}),
+    ("executor", "GET", "/api/executor", None),
+    ("metrics", "GET", "/metrics", None),
+]
+
+# The mutations, applied to the fixture by the native account backend
+WRITE_ROUTES: List[Tuple[str, str, str, Optional[Callable[[str, str, int], Any]]]] = [
+    ("user add", "POST", "/api/user/add",
+     lambda user, group, n: {"fullname": f"Bench {n}", "username": f"bench{n}", "homedir": f"{HOMES}/bench{n}"}),
+    ("user update", "PUT", "/api/user/{user}", lambda user, group, n: {"fullname": f"Updated {n}"}),
+    ("passwords", "PUT", "/api/users/passwords", lambda user, group, n: [{"username": user, "passwd": f"pass{n}"}]),
+    ("group add", "POST", "/api/group/add", lambda user, group, n: {"groupname": f"benchgroup{n}"}),
+    ("member add", "POST", "/api/member/add", lambda user, group, n: {"groupname": group, "users": [user]}),
+    ("member del", "DELETE", "/api/member/del",
+     lambda user, group, n: {"groupname": f"group{member_of(n)}", "users": [f"user{member_of(n)}"]}),
+    ("user del", "DELETE", "/api/user/user{n}", None),
+    ("group del", "DELETE", "/api/group/del", lambda user, group, n: {"groupname": f"benchgroup{n}"}),
+]
+HOMES: str = os.environ.get("SYSMANAGE_BENCH_HOMES", "/tmp")
+
+
+def member_of(n: int) -> int:
+    """The n-th i such that user<i> is a member of group<i> (i % 9 != 0, see make_group)."""
+    return n + n // 8 + 1
+
+
+def make_shadow(entries: int) -> str:
+    """Build a fake shadow file, one account out of ten is locked."""
+    return "".join(
+        f"user{i}:{'!' if i % 10 == 0 else ''}$6$salt$hash:19000:0:99999:7:::\n"
+        for i in range(entries)
+    )
+
+
+def make_utmp(entries: int, every: int = 100) -> bytes:
+    """Build a fake utmp file where one user out of ``every`` is logged in."""
+    from system.sessions import UTMP_RECORD, USER_PROCESS
+
+    return b"".join(
+        UTMP_RECORD.pack(USER_PROCESS, 0, f"pts/{i}".encode(), b"", f"user{i}".encode(), b"10.0.0.1",
+                         0, 0, 0, 1_700_000_000 + i, 0, b"")
+        for i in range(0, entries, every)
+    )
+
+
+def write_fixture(root: str, entries: int) -> None:
+    """Write the account files and the login records of a fake system."""
+    os.makedirs(os.path.join(root, "etc", "skel"), exist_ok=True)
+    os.makedirs(os.path.join(root, "home"), exist_ok=True)
+    with open(os.path.join(root, "etc", "skel", ".profile"), "w") as file:
+        file.write("# ~/.profile\n")
+    for name, content in (("passwd", make_passwd(entries)), ("group", make_group(entries)),
+                          ("shadow", make_shadow(entries))):
+        with open(os.path.join(root, "etc", name), "w") as file:
+            file.write(content)
+
+    utmp = make_utmp(entries)
+    for name in ("utmp", "wtmp"):
+        with open(os.path.join(root, name), "wb") as file:
+            file.write(utmp)
+
+
+def percentile(latencies: List[float], rank: float) -> float:
+    """Nearest-rank percentile of sorted latencies."""
+    return latencies[max(0, math.ceil(rank * len(latencies)) - 1)]
+
+
+def rss() -> Tuple[float, float]:
+    """Current and peak resident memory of the process, in MiB."""
+    with open("/proc/self/statm") as file:
+        current = int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    return current, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+async def drive(client, method: str, path: str, body: Optional[Callable[[str, str, int], Any]], entries: int,
+                requests: int, concurrency: int, sequence: Iterator[int]) -> Dict[str, Any]:
+    """Send ``requests`` requests to a route from ``concurrency`` concurrent clients."""
+    draw = random.Random(entries)
+    latencies: List[float] = []
+    errors = 0
+    remaining = requests
+
+    async def client_loop() -> None:
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            user_id, group_id = draw.randrange(entries), draw.randrange(entries)
+            user, group, n = f"user{user_id}", f"group{group_id}", next(sequence)
+            url = path.format(user=user, group=group, n=n, user_cursor=encode_cursor(user_id + 1, user),
+                              group_cursor=encode_cursor(group_id + 1, group))
+            start = time.perf_counter()
+            response = await client.request(method, url, json=body(user, group, n) if body else None)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code >= 400:
+                errors += 1
+            elif method != "GET" and response.json().get("status", 200) != 200:
+                # The account routes report their failures in the body
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client_loop() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "p50": percentile(latencies, 0.50) * 1000,
+        "p95": percentile(latencies, 0.95) * 1000,
+        "p99": percentile(latencies, 0.99) * 1000,
+        "throughput": len(latencies) / elapsed,
+        "errors": errors,
+    }
+
+
+async def worker(root: str, entries: int, requests: int, concurrency: int, writes: bool) -> Dict[str, Any]:
+    """Drive every route of the app, in a process started on the fixture."""
+    import httpx
+    from app import app
+
+    results: Dict[str, Any] = {"entries": entries, "routes": {}}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for name, method, path, body in ROUTES + (WRITE_ROUTES if writes else []):
+            sequence = itertools.count()
+            # Warm the caches first, the cold load is measured by bench_passwd_read
+            await drive(client, method, path, body, entries, concurrency, concurrency, sequence)
+            results["routes"][name] = await drive(client, method, path, body, entries, requests, concurrency,
+                                                  sequence)
+
+    results["rss"], results["peak_rss"] = rss()
+    return results
+
+
+def main(sizes: List[int], requests: int, concurrency: int, writes: bool, output: str) -> None:
+    print(f"{'route':>15} {'entries':>8} {'p50 (ms)':>9} {'p95 (ms)':>9} {'p99 (ms)':>9} "
+          f"{'req/s':>9} {'errors':>7}")
+    report = []
+
+    for size in sizes:
+        with tempfile.TemporaryDirectory(prefix="sysmanage-bench-") as root:
+            write_fixture(root, size)
+            # One process per size, so the memory of a size does not leak in the next one.
+            # The account database and the login index read their paths at import.
+            environment = {
+                **os.environ,
+                "SYSMANAGE_ETC_DIR": os.path.join(root, "etc"),
+                "SYSMANAGE_ACCOUNT_SOURCE": "files",
+                "SYSMANAGE_UTMP": os.path.join(root, "utmp"),
+                "SYSMANAGE_WTMP": os.path.join(root, "wtmp"),
+                "SYSMANAGE_LOGIND_SESSIONS": os.path.join(root, "sessions"),
+                "SYSMANAGE_ACCOUNT_BACKEND": "native",
+                "SYSMANAGE_BENCH_HOMES": os.path.join(root, "home"),
+            }
+            completed = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--worker", root, "--sizes", str(size),
+                 "--requests", str(requests), "--concurrency", str(concurrency)] + (["--writes"] if writes else []),
+                stdout=subprocess.PIPE, check=True, text=True, env=environment
+            )
+        results = json.loads(completed.stdout.splitlines()[-1])
+        report.append(results)
+
+        for name, route in results["routes"].items():
+            print(f"{name:>15} {size:>8} {route['p50']:>9.2f} {route['p95']:>9.2f} {route['p99']:>9.2f} "
+                  f"{route['throughput']:>9.0f} {route['errors']:>7}")
+        print(f"{'rss (MiB)':>15} {size:>8} {results['rss']:>9.1f} peak {results['peak_rss']:.1f}")
+
+    if output:
+        with open(output, "w") as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="API load benchmark")
+    parser.add_argument('--sizes', type=int, nargs="+", default=[1_000, 10_000, 100_000], help="Number of accounts")
+    parser.add_argument('--requests', type=int, default=200, help="Requests per route (default: 200)")
+    parser.add_argument('--concurrency', type=int, default=8, help="Concurrent clients (default: 8)")
+    parser.add_argument('--writes', action='store_true', help="Drive the account mutations too")
+    parser.add_argument('--output', default="", help="Write the results as JSON to this file")
+    parser.add_argument('--worker', default="", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        print(json.dumps(asyncio.run(worker(args.worker, args.sizes[0], args.requests, args.concurrency, args.writes))))
+    else:
+        main(args.sizes, args.requests, args.concurrency, args.writes, args.output)
@@ -0,0 +1,69 @@
+####################################################################################
+# Author: Djetic Alexandre
+# Description: Benchmark of the passwd read path: `cat` subprocess against the
+#              native file reader of system.accounts
+####################################################################################
+
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from system.system import execute
+from system.accounts import AccountFile, parse_passwd
+
+
+def write_passwd(path: str, entries: int) -> None:
+    """Write a fake passwd file with the given number of entries."""
+    with open(path, "w") as file:
+        for i in range(entries):
+            file.write(f"user{i}:x:{10000 + i}:{10000 + i}:User {i},,,:/home/user{i}:/bin/bash\n")
+
+
+async def bench_cat(path: str, rounds: int) -> float:
+    """Average time of `cat` + parse, in milliseconds."""
+    start = time.perf_counter()
+    for _ in range(rounds):
+        output, error, status = await execute(f"cat {path}")
+        parse_passwd(output)
+    return (time.perf_counter() - start) * 1000 / rounds
+
+
+async def bench_native(path: str, rounds: int, cached: bool) -> float:
+    """Average time of the native reader, in milliseconds."""
+    account_file = AccountFile(path, parse_passwd)
+    await account_file.load()
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        if not cached:
+            account_file.invalidate()
+        await account_file.load()
+    return (time.perf_counter() - start) * 1000 / rounds
+
+
+async def main(sizes: list, rounds: int) -> None:
+    print(f"{'entries':>8} {'cat (ms)':>10} {'native (ms)':>12} {'cached (ms)':>12}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for size in sizes:
+            path = os.path.join(tmp, f"passwd.{size}")
+            write_passwd(path, size)
+
+            cat = await bench_cat(path, rounds)
+            native = await bench_native(path, rounds, cached=False)
+            cached = await bench_native(path, rounds, cached=True)
+            print(f"{size:>8} {cat:>10.3f} {native:>12.3f} {cached:>12.4f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="passwd read path benchmark")
+    parser.add_argument('--sizes', type=int, nargs="+", default=[100, 10_000, 100_000], help="Number of passwd entries")
+    parser.add_argument('--rounds', type=int, default=20, help="Rounds per measure (default: 20)")
+    args = parser.parse_args()
+
+    asyncio.run(main(args.sizes, args.rounds))
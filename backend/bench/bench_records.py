@@ -0,0 +1,117 @@
+####################################################################################
+# Author: Djetic Alexandre
+# Description: Benchmark of the account records: per-entry dicts with string
+#              ids against the slotted records of system.records
+####################################################################################
+
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, Any
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from system.accounts import parse_passwd, parse_group
+from system.records import dumps
+
+
+def legacy_parse_passwd(content: str) -> Dict[str, Dict[str, Any]]:
+    """The passwd parser building one dict per entry, as before the records."""
+    users: Dict[str, Dict[str, Any]] = {}
+    for line in content.splitlines():
+        parts = line.split(':')
+        if len(parts) >= 7:
+            users[parts[0]] = {
+                "username": parts[0],
+                "uid": parts[2],
+                "gid": parts[3],
+                "full_name": parts[4],
+                "home_dir": parts[5],
+                "shell": parts[6]
+            }
+    return users
+
+
+def legacy_parse_group(content: str) -> Dict[str, Dict[str, Any]]:
+    """The group parser building one dict per entry, as before the records."""
+    groups: Dict[str, Dict[str, Any]] = {}
+    for line in content.splitlines():
+        parts = line.split(':')
+        if len(parts) >= 4:
+            groups[parts[0]] = {
+                "name": parts[0],
+                "passwd": parts[1],
+                "gid": parts[2],
+                "members": [member for member in parts[3].split(',') if member]
+            }
+    return groups
+
+
+def make_passwd(entries: int) -> str:
+    """Build a fake passwd file with the given number of entries."""
+    shells = ("/bin/bash", "/bin/sh", "/usr/sbin/nologin")
+    return "".join(
+        f"user{i}:x:{10000 + i}:{10000 + i}:User {i},,,:/home/user{i}:{shells[i % 3]}\n"
+        for i in range(entries)
+    )
+
+
+def make_group(entries: int) -> str:
+    """Build a fake group file, every group has up to 8 members."""
+    return "".join(
+        f"group{i}:x:{10000 + i}:{','.join(f'user{(i + j) % entries}' for j in range(i % 9))}\n"
+        for i in range(entries)
+    )
+
+
+def measure(parser: Callable[[str], dict], content: str, rounds: int) -> tuple:
+    """Parse time in milliseconds and retained memory in KiB of a parser."""
+    start = time.perf_counter()
+    for _ in range(rounds):
+        parser(content)
+    elapsed = (time.perf_counter() - start) * 1000 / rounds
+
+    tracemalloc.start()
+    parsed = parser(content)
+    retained = tracemalloc.get_traced_memory()[0] / 1024
+    tracemalloc.stop()
+
+    return elapsed, retained, parsed
+
+
+def serialize(encode: Callable[[Any], Any], data: dict, rounds: int) -> float:
+    """Serialization time in milliseconds."""
+    start = time.perf_counter()
+    for _ in range(rounds):
+        encode(data)
+    return (time.perf_counter() - start) * 1000 / rounds
+
+
+def main(sizes: list, rounds: int) -> None:
+    print(f"{'file':>6} {'entries':>8} {'dict (ms)':>10} {'record (ms)':>12} {'dict (KiB)':>11} "
+          f"{'record (KiB)':>13} {'json (ms)':>10} {'orjson (ms)':>12}")
+
+    for size in sizes:
+        for name, make, legacy, parser in (("passwd", make_passwd, legacy_parse_passwd, parse_passwd),
+                                           ("group", make_group, legacy_parse_group, parse_group)):
+            content = make(size)
+
+            dict_time, dict_memory, dicts = measure(legacy, content, rounds)
+            record_time, record_memory, records = measure(parser, content, rounds)
+            json_time = serialize(lambda data: json.dumps(data).encode(), dicts, rounds)
+            orjson_time = serialize(dumps, records, rounds)
+
+            print(f"{name:>6} {size:>8} {dict_time:>10.2f} {record_time:>12.2f} {dict_memory:>11.0f} "
+                  f"{record_memory:>13.0f} {json_time:>10.2f} {orjson_time:>12.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Account records benchmark")
+    parser.add_argument('--sizes', type=int, nargs="+", default=[1_000, 10_000, 100_000], help="Number of entries")
+    parser.add_argument('--rounds', type=int, default=5, help="Rounds per measure (default: 5)")
+    args = parser.parse_args()
+
+    main(args.sizes, args.rounds)
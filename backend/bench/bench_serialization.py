@@ -0,0 +1,92 @@
+####################################################################################
+# Author: Djetic Alexandre
+# Description: Benchmark of the per-request serialization of the users and
+#              groups listings
+####################################################################################
+
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Any, Callable
+
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from app import UsersListing, GroupsListing
+from system.accounts import parse_passwd, parse_group
+from system.records import dumps
+from bench_records import make_passwd, make_group
+
+
+def users_listing(size: int, records: bool) -> dict:
+    """Build the users listing as served without a projection, or the records themselves."""
+    entries = parse_passwd(make_passwd(size))
+    if records:
+        return {"status": 200, "users": entries, "next_cursor": None}
+    return {
+        "status": 200,
+        "users": {
+            username: {"username": username, "uid": entry.uid, "gid": entry.gid, "full_name": entry.full_name,
+                       "home_dir": entry.home_dir, "shell": entry.shell, "login": False}
+            for username, entry in entries.items()
+        },
+        "next_cursor": None
+    }
+
+
+def groups_listing(size: int) -> dict:
+    """Build the groups listing as served without a projection."""
+    return {
+        "status": 0,
+        "groups": {
+            name: {"Group_Name": name, "GID": entry.gid, "Members": entry.members}
+            for name, entry in parse_group(make_group(size)).items()
+        },
+        "next_cursor": None
+    }
+
+
+def measure(encode: Callable[[Any], bytes], data: Any, rounds: int) -> float:
+    """Serialization time in milliseconds."""
+    start = time.perf_counter()
+    for _ in range(rounds):
+        encode(data)
+    return (time.perf_counter() - start) * 1000 / rounds
+
+
+def main(sizes: list, rounds: int) -> None:
+    users_adapter = TypeAdapter(UsersListing)
+    groups_adapter = TypeAdapter(GroupsListing)
+
+    encoders = {
+        # What a route returning a plain dict without a response model costs
+        "jsonable+json": lambda data: json.dumps(jsonable_encoder(data)).encode(),
+        # The response model path: validation then Pydantic's JSON serializer
+        "model": None,
+        "orjson": dumps,
+    }
+
+    print(f"{'listing':>8} {'entries':>8} " + " ".join(f"{name + ' (ms)':>18}" for name in encoders)
+          + f" {'orjson records (ms)':>20}")
+
+    for size in sizes:
+        for name, data, adapter in (("users", users_listing(size, False), users_adapter),
+                                    ("groups", groups_listing(size), groups_adapter)):
+            encoders["model"] = lambda data, adapter=adapter: adapter.dump_json(adapter.validate_python(data))
+            times = [measure(encode, data, rounds) for encode in encoders.values()]
+            records = measure(dumps, users_listing(size, True), rounds) if name == "users" else float("nan")
+
+            print(f"{name:>8} {size:>8} " + " ".join(f"{elapsed:>18.2f}" for elapsed in times) + f" {records:>20.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Listing serialization benchmark")
+    parser.add_argument('--sizes', type=int, nargs="+", default=[1_000, 10_000, 100_000], help="Number of accounts")
+    parser.add_argument('--rounds', type=int, default=5, help="Rounds per measure (default: 5)")
+    args = parser.parse_args()
+
+    main(args.sizes, args.rounds)
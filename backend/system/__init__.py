@@ -7,3 +7,9 @@ from .system import *
 from .groups import *
 from .users import *
 from .system_property import *
+from .sessions import *
+from .accounts import *
+from .backends import *
+from .records import *
+from .events import *
+from .metrics import *
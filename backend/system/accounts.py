@@ -0,0 +1,428 @@
+####################################################################################
+# Author: Djetic Alexandre
+# Description: This module keeps the local account database (passwd, group,
+#              shadow) parsed in memory
+####################################################################################
+
+import asyncio
+import os
+import sys
+from array import array
+from typing import Dict, Any, List, Optional, Tuple, Callable, Union
+from .records import UserRecord, GroupRecord, ShadowRecord, names, to_int
+from .nss import NssSnapshot, enumerate_users, enumerate_groups
+from .metrics import cache_lookups
+
+
+def parse_passwd(content: str) -> Dict[str, UserRecord]:
+    """Parse the content of a passwd file.
+
+    Args:
+        content (str): The content of the passwd file.
+
+    Returns:
+        dict: username -> user record.
+    """
+    users: Dict[str, UserRecord] = {}
+    intern = sys.intern
+
+    for line in content.splitlines():
+        parts = line.split(':')
+
+        if len(parts) >= 7:
+            uid, gid = parts[2], parts[3]
+            users[parts[0]] = UserRecord(
+                parts[0],
+                int(uid) if uid.isdigit() else to_int(uid),
+                int(gid) if gid.isdigit() else to_int(gid),
+                parts[4], parts[5], intern(parts[6])
+            )
+
+    return users
+
+
+def parse_group(content: str) -> Dict[str, GroupRecord]:
+    """Parse the content of a group file.
+
+    Args:
+        content (str): The content of the group file.
+
+    Returns:
+        dict: groupname -> group record.
+    """
+    groups: Dict[str, GroupRecord] = {}
+    intern = sys.intern
+    name_id = names.id
+
+    for line in content.splitlines():
+        parts = line.split(':')
+
+        if len(parts) >= 4:
+            gid = parts[2]
+            members = array("I", [name_id(member) for member in parts[3].split(',') if member] if parts[3] else ())
+            groups[parts[0]] = GroupRecord(
+                parts[0], intern(parts[1]), int(gid) if gid.isdigit() else to_int(gid), members
+            )
+
+    return groups
+
+
+def parse_shadow(content: str) -> Dict[str, ShadowRecord]:
+    """Parse the content of a shadow file.
+
+    Only the password ageing metadata is kept, never the password hash.
+
+    Args:
+        content (str): The content of the shadow file.
+
+    Returns:
+        dict: username -> password metadata.
+    """
+    shadow: Dict[str, ShadowRecord] = {}
+
+    for line in content.splitlines():
+        parts = line.split(':')
+
+        if len(parts) >= 8:
+            password = parts[1]
+            shadow[sys.intern(parts[0])] = ShadowRecord(
+                bool(password) and password[0] not in "!*", password.startswith("!"), *parts[2:8]
+            )
+
+    return shadow
+
+
+class AccountFile:
+    """A flat account file kept parsed in memory.
+
+    The file is only read again when its inode, mtime or size changed since the
+    last read, or after an explicit invalidation.
+
+    Functions (Methods):
+        - __init__: Initialize the AccountFile class.
+        - load: Get the parsed entries, re-reading the file if it changed.
+        - adopt: Accept the current file as matching the cached entries.
+        - invalidate: Force the next load to re-read the file.
+    """
+
+    def __init__(self, path: str, parser: Callable[[str], Dict[str, Any]]):
+        """Initialize AccountFile class.
+
+        Args:
+            path (str): The path of the file.
+            parser (callable): Function turning the file content into entries.
+        """
+        self.path: str = path
+        self._name: str = os.path.basename(path)
+        self._parser = parser
+        self._signature: Optional[Tuple[int, int, int]] = None
+        self._entries: Dict[str, Any] = {}
+        self.generation: int = 0
+        self._lock: asyncio.Lock = asyncio.Lock()
+
+    def _stat(self) -> Optional[Tuple[int, int, int]]:
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return st.st_ino, st.st_mtime_ns, st.st_size
+
+    def _read(self) -> Dict[str, Any]:
+        """Read and parse the file, meant to run in a worker thread."""
+        try:
+            with open(self.path, "rb") as file:
+                content = file.read()
+        except OSError:
+            return {}
+
+        # Decode the whole buffer once, the parser then only slices str objects
+        return self._parser(content.decode("utf-8", errors="replace"))
+
+    async def load(self) -> Dict[str, Any]:
+        """Get the parsed entries, re-reading the file if it changed.
+
+        The file is read and parsed in a worker thread so a large file never
+        blocks the event loop, and concurrent callers share a single read.
+
+        Returns:
+            dict: The parsed entries (empty if the file can not be read).
+        """
+        signature = self._stat()
+
+        if signature is None or signature != self._signature:
+            async with self._lock:
+                signature = self._stat()
+                if signature is None or signature != self._signature:
+                    cache_lookups.inc(self._name, "miss")
+                    self._entries = await asyncio.to_thread(self._read)
+                    self._signature = signature
+                    self.generation += 1
+                    return self._entries
+
+        cache_lookups.inc(self._name, "hit")
+        return self._entries
+
+    @property
+    def cached(self) -> Dict[str, Any]:
+        """The entries of the last read, without checking the file."""
+        return self._entries
+
+    @property
+    def signature(self) -> Optional[Tuple[int, int, int]]:
+        """The (inode, mtime, size) of the file when it was last read."""
+        return self._signature
+
+    def adopt(self) -> bool:
+        """Accept the current file as matching the cached entries.
+
+        Used after an in-place update of the entries that mirrors the change
+        just made to the file, so it is not parsed again.
+
+        Returns:
+            bool: False if there was nothing loaded to adopt.
+        """
+        if self._signature is None:
+            return False
+        self._signature = self._stat()
+        self.generation += 1
+        return True
+
+    def invalidate(self) -> None:
+        """Force the next load to re-read the file."""
+        self._signature = None
+
+
+class MembershipIndex:
+    """Bidirectional user <-> group membership index.
+
+    Both the supplementary memberships of the group file and the primary
+    group of every passwd entry are indexed.
+
+    Functions (Methods):
+        - __init__: Build the index from the passwd and group entries.
+        - groups_of: Get the groups of a user, primary group first.
+        - users_of: Get the users of a group, members first.
+        - add: Record a supplementary membership.
+        - remove: Forget a supplementary membership.
+    """
+
+    def __init__(self, users: Dict[str, UserRecord], groups: Dict[str, GroupRecord]):
+        """Build the index from the passwd and group entries.
+
+        Args:
+            users (dict): The parsed passwd entries.
+            groups (dict): The parsed group entries.
+        """
+        # dicts are used as insertion-ordered sets
+        self._user_groups: Dict[str, Dict[str, None]] = {}
+        self._group_users: Dict[str, Dict[str, None]] = {}
+        self._primary: Dict[str, str] = {}
+        self._primary_users: Dict[str, Dict[str, None]] = {}
+
+        gid_names: Dict[int, str] = {}
+        for groupname, group in groups.items():
+            gid_names.setdefault(group.gid, groupname)
+            for member in group.members:
+                self.add(groupname, member)
+
+        for username, user in users.items():
+            groupname = gid_names.get(user.gid)
+            if groupname is not None:
+                self._primary[username] = groupname
+                self._primary_users.setdefault(groupname, {})[username] = None
+
+    def groups_of(self, username: str) -> List[str]:
+        """Get the groups of a user, primary group first."""
+        primary = self._primary.get(username)
+        groups = [primary] if primary else []
+        return groups + [group for group in self._user_groups.get(username, ()) if group != primary]
+
+    def users_of(self, groupname: str) -> List[str]:
+        """Get the users of a group, members first then the users having it as primary group."""
+        users = list(self._group_users.get(groupname, ()))
+        return users + [user for user in self._primary_users.get(groupname, ()) if user not in users]
+
+    def add(self, groupname: str, username: str) -> None:
+        """Record a supplementary membership."""
+        self._user_groups.setdefault(username, {})[groupname] = None
+        self._group_users.setdefault(groupname, {})[username] = None
+
+    def remove(self, groupname: str, username: str) -> None:
+        """Forget a supplementary membership."""
+        self._user_groups.get(username, {}).pop(groupname, None)
+        self._group_users.get(groupname, {}).pop(username, None)
+
+
+class AccountDatabase:
+    """In-memory view of the local account database.
+
+    Listings and lookups of users and groups are served from the parsed
+    /etc/passwd, /etc/group and /etc/shadow files without spawning any process,
+    or from a snapshot of the NSS enumeration when the source is "nss".
+
+    Functions (Methods):
+        - __init__: Initialize the AccountDatabase class.
+        - users: Get all the users of the passwd file.
+        - user: Get a single user.
+        - groups: Get all the groups of the group file.
+        - group: Get a single group.
+        - memberships: Get the user <-> group membership index.
+        - update_members: Apply a successful membership change to the cache.
+        - set_members: Apply a successful replacement of a member list to the cache.
+        - password_info: Get the password metadata of a user.
+        - signature: Get the generation of some files, for cache validation.
+        - invalidate: Drop the cached content of some files.
+    """
+
+    def __init__(self, etc_dir: str = "/etc", source: str = "files", nss_ttl: float = 60.0):
+        """Initialize AccountDatabase class.
+
+        Args:
+            etc_dir (str): The directory holding the account files (default is /etc).
+            source (str): "files" to read passwd and group from etc_dir, "nss" to
+                          enumerate them through NSS (default is files).
+            nss_ttl (float): Lifetime of an NSS snapshot in seconds (default is 60 seconds).
+
+        Raises:
+            ValueError: When the source is unknown.
+        """
+        if source not in ("files", "nss"):
+            raise ValueError(f"Unknown account source: {source}")
+
+        self.source: str = source
+        self.files: Dict[str, Union[AccountFile, NssSnapshot]] = {
+            "passwd": AccountFile(os.path.join(etc_dir, "passwd"), parse_passwd),
+            "group": AccountFile(os.path.join(etc_dir, "group"), parse_group),
+            "shadow": AccountFile(os.path.join(etc_dir, "shadow"), parse_shadow),
+        }
+
+        if source == "nss":
+            # Directory accounts are listed too, the password metadata stays local
+            self.files["passwd"] = NssSnapshot(enumerate_users, nss_ttl, "nss_passwd")
+            self.files["group"] = NssSnapshot(enumerate_groups, nss_ttl, "nss_group")
+        self._memberships: Optional[MembershipIndex] = None
+        self._memberships_generation: Tuple[int, int] = (0, 0)
+
+    async def users(self) -> Dict[str, UserRecord]:
+        """Get all the users of the passwd file."""
+        return await self.files["passwd"].load()
+
+    async def user(self, username: str) -> Optional[UserRecord]:
+        """Get a single user, None if it is not in the passwd file."""
+        return (await self.users()).get(username)
+
+    async def groups(self) -> Dict[str, GroupRecord]:
+        """Get all the groups of the group file."""
+        return await self.files["group"].load()
+
+    async def group(self, groupname: str) -> Optional[GroupRecord]:
+        """Get a single group, None if it is not in the group file."""
+        return (await self.groups()).get(groupname)
+
+    async def memberships(self) -> MembershipIndex:
+        """Get the membership index, rebuilt only when passwd or group was re-read."""
+        users = await self.users()
+        groups = await self.groups()
+        generation = (self.files["passwd"].generation, self.files["group"].generation)
+
+        if self._memberships is None or generation != self._memberships_generation:
+            cache_lookups.inc("memberships", "miss")
+            self._memberships = MembershipIndex(users, groups)
+            self._memberships_generation = generation
+        else:
+            cache_lookups.inc("memberships", "hit")
+
+        return self._memberships
+
+    def update_members(self, groupname: str, added: List[str] = (), removed: List[str] = ()) -> None:
+        """Apply a successful membership change to the cache without re-reading.
+
+        The cached group entry and the membership index are updated in place
+        and the group file, just rewritten by the change, is adopted as is.
+        If anything is not cached the group file is simply invalidated.
+
+        Args:
+            groupname (str): The name of the group.
+            added (list): The users added to the group.
+            removed (list): The users removed from the group.
+        """
+        group_file = self.files["group"]
+        # The cached entries: loading would re-read the file we just changed
+        entry = group_file.cached.get(groupname)
+        up_to_date = self._memberships is not None and \
+            self._memberships_generation == (self.files["passwd"].generation, group_file.generation)
+
+        if entry is None or not up_to_date or not group_file.adopt():
+            group_file.invalidate()
+            return
+
+        members = [member for member in entry.members if member not in removed]
+        members += [member for member in dict.fromkeys(added) if member not in members]
+        entry.members = members
+
+        for username in removed:
+            self._memberships.remove(groupname, username)
+        for username in added:
+            self._memberships.add(groupname, username)
+
+        self._memberships_generation = (self.files["passwd"].generation, group_file.generation)
+
+    def set_members(self, groupname: str, members: List[str]) -> None:
+        """Apply a successful replacement of the member list of a group to the cache.
+
+        Args:
+            groupname (str): The name of the group.
+            members (list): The new member list.
+        """
+        entry = self.files["group"].cached.get(groupname)
+        previous = entry.members if entry else []
+        self.update_members(
+            groupname,
+            added=[member for member in members if member not in previous],
+            removed=[member for member in previous if member not in members]
+        )
+
+    async def password_info(self, username: str) -> Optional[ShadowRecord]:
+        """Get the password metadata of a user, None if unknown or unreadable."""
+        return (await self.files["shadow"].load()).get(username)
+
+    async def signature(self, *names: str) -> Tuple[str, int]:
+        """Get the generation of some files, for cache validation.
+
+        The files are reloaded first if they changed, so the generation always
+        matches what the next read returns. It is built from the inode, mtime
+        and size of each file, so it is the same in every worker process.
+
+        Args:
+            *names (str): The files to include ("passwd", "group", "shadow"), all if empty.
+
+        Returns:
+            tuple: An opaque generation string and the latest mtime in nanoseconds.
+        """
+        parts: List[str] = []
+        mtime: int = 0
+
+        for name in names or self.files:
+            account_file = self.files[name]
+            await account_file.load()
+            signature = account_file.signature or (0, 0, 0)
+            parts.append("{}:{}:{}".format(*signature))
+            mtime = max(mtime, signature[1])
+
+        return "|".join(parts), mtime
+
+    def invalidate(self, *names: str) -> None:
+        """Drop the cached content of some files.
+
+        Args:
+            *names (str): The files to invalidate ("passwd", "group", "shadow"), all if empty.
+        """
+        for name in names or self.files:
+            self.files[name].invalidate()
+
+
+accounts: AccountDatabase = AccountDatabase(
+    etc_dir=os.environ.get("SYSMANAGE_ETC_DIR", "/etc"),
+    source=os.environ.get("SYSMANAGE_ACCOUNT_SOURCE", "files"),
+    nss_ttl=float(os.environ.get("SYSMANAGE_NSS_TTL", 60)),
+)
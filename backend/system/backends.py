@@ -0,0 +1,931 @@
+####################################################################################
+# Author: Djetic Alexandre
+# Description: This module contains the engines applying the account changes:
+#              the shadow-utils commands, or a direct edition of the account files
+####################################################################################
+
+import asyncio
+import errno
+import fcntl
+import os
+import pwd
+import re
+import secrets
+import threading
+import time
+import warnings
+from typing import Any, Callable, Dict, List, Optional, Protocol, Set, Tuple, TypeVar
+from .system import execute
+from .homes import home_provisioner
+
+try:
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", DeprecationWarning)
+        import crypt
+except ImportError:
+    crypt = None
+
+# Written in this order, so a new user never refers to a group that is not there yet
+ACCOUNT_FILES: Tuple[str, ...] = ("group", "gshadow", "shadow", "passwd")
+# NAME_REGEX of shadow-utils
+NAME_PATTERN = re.compile(r"^[a-z_][a-z0-9_.-]{0,30}\$?$")
+
+# (stdout, error, status), as returned by execute
+Result = Tuple[str, str, int]
+T = TypeVar("T")
+
+
+class AccountError(Exception):
+    """Raised when an account change is refused, nothing was written."""
+
+
+async def hash_passwords(passwords: List[str]) -> List[str]:
+    """Hash passwords with SHA-512 crypt for the shadow file.
+
+    The crypt module is used when available, a single `openssl passwd`
+    process hashes them all otherwise.
+
+    Args:
+        passwords (list): The clear text passwords.
+
+    Returns:
+        list: The hashes, in order.
+
+    Raises:
+        AccountError: When the passwords could not be hashed.
+    """
+    if not passwords:
+        return []
+
+    if crypt is not None:
+        return await asyncio.to_thread(
+            lambda: [crypt.crypt(password, crypt.mksalt(crypt.METHOD_SHA512)) for password in passwords]
+        )
+
+    output, error, status = await execute("openssl passwd -6 -stdin", input="".join(f"{p}\n" for p in passwords))
+    hashes = output.split()
+    if status != 0 or len(hashes) != len(passwords):
+        raise AccountError(error or "The passwords could not be hashed")
+    return hashes
+
+
+def read_login_defs(etc_dir: str = "/etc") -> Dict[str, str]:
+    """Read the settings of login.defs.
+
+    Args:
+        etc_dir (str): The directory holding login.defs (default is /etc).
+
+    Returns:
+        dict: Setting -> value, empty when the file can not be read.
+    """
+    settings: Dict[str, str] = {}
+    try:
+        with open(os.path.join(etc_dir, "login.defs")) as file:
+            for line in file:
+                parts = line.split()
+                if len(parts) >= 2 and not parts[0].startswith("#"):
+                    settings[parts[0]] = parts[1]
+    except OSError:
+        pass
+    return settings
+
+
+def home_mode(settings: Dict[str, str]) -> int:
+    """The mode of a new home directory: HOME_MODE, or 0777 without UMASK, as useradd."""
+    if "HOME_MODE" in settings:
+        return int(settings["HOME_MODE"], 8)
+    return 0o777 & ~int(settings.get("UMASK", "022"), 8)
+
+
+class AccountBackend(Protocol):
+    """The account changes an engine applies.
+
+    Single changes return (stdout, error, status) as execute does, status 0
+    meaning success. Batches return the position of every failed entry ->
+    error message.
+    """
+
+    async def add_user(self, username: str, full_name: str, homedir: str, shell: str) -> Result: ...
+
+    async def add_users(self, rows: List[Dict[str, str]]) -> Tuple[Dict[int, str], Dict[int, str]]: ...
+
+    async def del_user(self, username: str) -> Result: ...
+
+    async def modify_user(self, username: str, full_name: str, homedir: str, shell: str) -> Result: ...
+
+    async def set_passwords(self, passwords: List[Tuple[str, str]]) -> Dict[int, str]: ...
+
+    async def add_group(self, groupname: str) -> Result: ...
+
+    async def del_group(self, groupname: str) -> Result: ...
+
+    async def add_member(self, groupname: str, username: str) -> Result: ...
+
+    async def remove_member(self, groupname: str, username: str) -> Result: ...
+
+    async def set_members(self, groupname: str, usernames: List[str]) -> Result: ...
+
+    async def change_members(self, groupname: str, added: List[str], removed: List[str]) -> Result: ...
+
+
+class ShadowUtilsBackend:
+    """Engine running the shadow-utils commands (useradd, usermod, gpasswd, ...).
+
+    Every change is one process, the batches use newusers and chpasswd. The
+    home directories are populated from /etc/skel by the home provisioner
+    rather than by the commands, one file at a time.
+
+    Functions (Methods):
+        - add_user, add_users, del_user, modify_user, set_passwords: Change the users.
+        - add_group, del_group: Change the groups.
+        - add_member, remove_member, set_members, change_members: Change the members of a group.
+    """
+
+    name: str = "shadow"
+
+    @staticmethod
+    async def _create_homes(rows: List[Tuple[str, str]]) -> Dict[int, str]:
+        """Populate the home directories of new users, (username, home directory) pairs.
+
+        Returns:
+            dict: Position -> error, for the homes that could not be created.
+        """
+        def lookup() -> List[Tuple[str, int, int]]:
+            homes = []
+            for username, homedir in rows:
+                entry = pwd.getpwnam(username)
+                homes.append((homedir or entry.pw_dir, entry.pw_uid, entry.pw_gid))
+            return homes
+
+        try:
+            homes = await asyncio.to_thread(lookup)
+        except KeyError as e:
+            return {i: f"home directory not created: unknown user {e}" for i in range(len(rows))}
+
+        errors = await home_provisioner.create("/etc/skel", homes, home_mode(read_login_defs()))
+        return {i: errors[home] for i, (home, _, _) in enumerate(homes) if home in errors}
+
+    async def add_user(self, username: str, full_name: str, homedir: str, shell: str) -> Result:
+        output, error, status = await execute(f"useradd -M -s {shell} -c {full_name} -d {homedir} {username}")
+        if status == 0:
+            # As with useradd -m, a home that could not be created leaves the account in place
+            error = "; ".join((await self._create_homes([(username, homedir)])).values())
+        return output, error, status
+
+    @staticmethod
+    async def _run_batch(cmd: str, lines: List[str]) -> Dict[int, str]:
+        """Feed lines to a shadow-utils batch tool (newusers, chpasswd).
+
+        These tools drop the whole batch when one line is invalid, so the
+        lines they report are set aside and the rest is submitted once more.
+
+        Args:
+            cmd (str): The batch command.
+            lines (list): The input lines, without line terminator.
+
+        Returns:
+            dict: The position of every failed line -> error message.
+        """
+        failed: Dict[int, str] = {}
+        pending: List[int] = list(range(len(lines)))
+
+        for attempt in range(2):
+            if not pending:
+                break
+
+            content = "".join(f"{lines[i]}\n" for i in pending)
+            output, error, status = await execute(cmd, timeout=15 + len(pending) // 10, input=content)
+
+            if status == 0:
+                break
+
+            # The faulty lines are reported as "line N: ..."
+            bad_lines = {int(n) - 1 for n in re.findall(r"line (\d+)", error)} & set(range(len(pending)))
+            if not bad_lines or attempt == 1:
+                bad_lines = set(range(len(pending)))
+
+            for position in bad_lines:
+                failed[pending[position]] = error or f"{cmd} failed with status {status}"
+
+            pending = [i for position, i in enumerate(pending) if position not in bad_lines]
+
+        return failed
+
+    async def add_users(self, rows: List[Dict[str, str]]) -> Tuple[Dict[int, str], Dict[int, str]]:
+        """Create many users with a single newusers process.
+
+        Users without a password get a random one that is then replaced by a
+        locked hash in a single `chpasswd -e` call, the same state `useradd`
+        leaves them in.
+
+        Returns:
+            tuple: The failed rows and the rows created with a warning, position -> message.
+        """
+        lines = [
+            ":".join([row["username"], row["passwd"] or secrets.token_urlsafe(24), "", "",
+                      row["full_name"], row["homedir"], row["shell"]])
+            for row in rows
+        ]
+        failed = await self._run_batch("newusers", lines)
+        notes: Dict[int, str] = {}
+
+        # newusers creates the homes empty, the skeleton is copied in them
+        created = [i for i in range(len(rows)) if i not in failed]
+        errors = await self._create_homes([(rows[i]["username"], rows[i]["homedir"]) for i in created])
+        for position, error in errors.items():
+            notes[created[position]] = error
+
+        locked = [i for i, row in enumerate(rows) if not row["passwd"] and i not in failed]
+        if locked:
+            not_locked = await self._run_batch("chpasswd -e", [f"{rows[i]['username']}:!" for i in locked])
+            for position, error in not_locked.items():
+                notes[locked[position]] = f"password not locked: {error}"
+
+        return failed, notes
+
+    async def del_user(self, username: str) -> Result:
+        return await execute(f"userdel {username}")
+
+    async def modify_user(self, username: str, full_name: str, homedir: str, shell: str) -> Result:
+        command = f"usermod -c '{full_name}'"
+        if homedir:
+            command += f" -d '{homedir}'"
+        if shell:
+            command += f" -s '{shell}'"
+        return await execute(f"{command} {username}")
+
+    async def set_passwords(self, passwords: List[Tuple[str, str]]) -> Dict[int, str]:
+        # The passwords go through the standard input, never on a command line
+        return await self._run_batch("chpasswd", [f"{username}:{passwd}" for username, passwd in passwords])
+
+    async def add_group(self, groupname: str) -> Result:
+        return await execute(f"groupadd {groupname}")
+
+    async def del_group(self, groupname: str) -> Result:
+        return await execute(f"groupdel {groupname}")
+
+    async def add_member(self, groupname: str, username: str) -> Result:
+        return await execute(f"usermod -aG {groupname} {username}")
+
+    async def remove_member(self, groupname: str, username: str) -> Result:
+        return await execute(f"gpasswd -d {username} {groupname}")
+
+    async def set_members(self, groupname: str, usernames: List[str]) -> Result:
+        return await execute(f"gpasswd -M '{','.join(usernames)}' {groupname}")
+
+    async def change_members(self, groupname: str, added: List[str], removed: List[str]) -> Result:
+        """Add and remove members of a group with a single gpasswd -M.
+
+        shadow-utils has no locked read-modify-write of a member list: the
+        list is read from the group file right before gpasswd rewrites it,
+        and the callers serialize the changes of a group.
+        """
+        def read() -> Optional[List[str]]:
+            group = AccountTable(os.path.join("/etc", "group")).get(groupname)
+            if group is None:
+                return None
+            return AccountTransaction._split(group[3]) if len(group) > 3 else []
+
+        members = await asyncio.to_thread(read)
+        if members is None:
+            return "", f"The group {groupname} does not exist", 1
+
+        members = [member for member in members if member not in removed]
+        members += [username for username in dict.fromkeys(added) if username not in members]
+        return await self.set_members(groupname, members)
+
+
+class AccountLock:
+    """The lock of the account files, compatible with lckpwdf(3).
+
+    It is a write lock (fcntl) on the .pwd.lock file of the account
+    directory, the one shadow-utils and glibc take. fcntl locks belong to the
+    process, so the threads of the backend are serialized by a thread lock
+    first.
+    """
+
+    def __init__(self, etc_dir: str, timeout: float = 15.0):
+        """Initialize AccountLock class.
+
+        Args:
+            etc_dir (str): The directory holding the account files.
+            timeout (float): Seconds to wait for the lock (default is 15 seconds, as lckpwdf).
+        """
+        self.path: str = os.path.join(etc_dir, ".pwd.lock")
+        self.timeout: float = timeout
+        self._thread_lock: threading.Lock = threading.Lock()
+        self._fd: int = -1
+
+    def __enter__(self) -> "AccountLock":
+        deadline = time.monotonic() + self.timeout
+        if not self._thread_lock.acquire(timeout=self.timeout):
+            raise AccountError("The account files are locked")
+
+        try:
+            self._fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_CLOEXEC, 0o600)
+            while True:
+                try:
+                    fcntl.lockf(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    return self
+                except OSError as e:
+                    if e.errno not in (errno.EACCES, errno.EAGAIN) or time.monotonic() > deadline:
+                        raise AccountError("The account files are locked by another process") from e
+                    time.sleep(0.05)
+        except BaseException:
+            if self._fd >= 0:
+                os.close(self._fd)
+                self._fd = -1
+            self._thread_lock.release()
+            raise
+
+    def __exit__(self, *exc_info) -> None:
+        os.close(self._fd)
+        self._fd = -1
+        self._thread_lock.release()
+
+
+class AccountTable:
+    """The lines of an account file, edited in memory.
+
+    Entries are kept in file order, with their fields split. Other lines
+    (comments, NIS "+" entries) are written back as they were read.
+
+    Functions (Methods):
+        - __init__: Initialize the AccountTable class.
+        - get: Get the fields of an entry.
+        - entries: Iterate over the entries.
+        - add: Append an entry.
+        - set: Change a field of an entry.
+        - remove: Remove an entry.
+        - render: Get the content of the file.
+    """
+
+    def __init__(self, path: str):
+        """Initialize AccountTable class.
+
+        Args:
+            path (str): The path of the account file, that may not exist (gshadow).
+        """
+        self.path: str = path
+        self.exists: bool = os.path.exists(path)
+        self.changed: bool = False
+        self._lines: List[Optional[List[str]]] = []
+        self._index: Dict[str, int] = {}
+
+        if self.exists:
+            with open(path) as file:
+                for line in file.read().splitlines():
+                    fields = line.split(":")
+                    if fields[0] and fields[0][0] not in "#+-" and fields[0] not in self._index:
+                        self._index[fields[0]] = len(self._lines)
+                    self._lines.append(fields)
+
+    def get(self, name: str) -> Optional[List[str]]:
+        """Get the fields of an entry, None if there is none."""
+        position = self._index.get(name)
+        return None if position is None else self._lines[position]
+
+    def entries(self):
+        """Iterate over the (name, fields) of the entries."""
+        for name, position in self._index.items():
+            yield name, self._lines[position]
+
+    def add(self, fields: List[str]) -> None:
+        """Append an entry."""
+        self._index[fields[0]] = len(self._lines)
+        self._lines.append(fields)
+        self.changed = True
+
+    def set(self, name: str, position: int, value: str) -> None:
+        """Change a field of an entry, a short entry is padded with empty fields."""
+        fields = self._lines[self._index[name]]
+        if len(fields) <= position:
+            fields.extend([""] * (position + 1 - len(fields)))
+        fields[position] = value
+        self.changed = True
+
+    def remove(self, name: str) -> None:
+        """Remove an entry, if there is one."""
+        position = self._index.pop(name, None)
+        if position is not None:
+            self._lines[position] = None
+            self.changed = True
+
+    def render(self) -> str:
+        """Get the content of the file."""
+        return "".join(":".join(fields) + "\n" for fields in self._lines if fields is not None)
+
+
+class AccountTransaction:
+    """A set of account changes applied in memory, then written at once.
+
+    Every change checks everything it needs before touching the tables, so
+    a refused change leaves nothing behind and the others can still be
+    committed.
+
+    Functions (Methods):
+        - __init__: Initialize the AccountTransaction class.
+        - add_user, del_user, modify_user, set_password: Change the users.
+        - add_group, del_group: Change the groups.
+        - add_member, remove_member, set_members, change_members: Change the members of a group.
+        - commit: Write the changed files.
+    """
+
+    def __init__(self, etc_dir: str, settings: Dict[str, str]):
+        """Initialize AccountTransaction class.
+
+        Args:
+            etc_dir (str): The directory holding the account files.
+            settings (dict): The settings of login.defs.
+        """
+        self.etc_dir: str = etc_dir
+        self.settings: Dict[str, str] = settings
+        self.tables: Dict[str, AccountTable] = {
+            name: AccountTable(os.path.join(etc_dir, name)) for name in ACCOUNT_FILES
+        }
+        # (home, uid, gid) of the users created with a home directory
+        self.homes: List[Tuple[str, int, int]] = []
+        self._used: Dict[str, Set[int]] = {}
+
+    # Checks
+
+    @staticmethod
+    def _check_fields(*values: str) -> None:
+        for value in values:
+            if ":" in value or "\n" in value:
+                raise AccountError(f"Invalid value: {value!r}")
+
+    @staticmethod
+    def _check_name(name: str) -> None:
+        if not NAME_PATTERN.match(name):
+            raise AccountError(f"Invalid name: {name!r}")
+
+    def _user(self, username: str) -> List[str]:
+        entry = self.tables["passwd"].get(username)
+        if entry is None:
+            raise AccountError(f"The user {username} does not exist")
+        return entry
+
+    def _group(self, groupname: str) -> List[str]:
+        entry = self.tables["group"].get(groupname)
+        if entry is None:
+            raise AccountError(f"The group {groupname} does not exist")
+        return entry
+
+    def _setting(self, key: str, default: int) -> int:
+        try:
+            return int(self.settings.get(key, default))
+        except ValueError:
+            return default
+
+    def _allocate(self, table: str, low: str, high: str, preferred: Optional[int] = None) -> int:
+        """Pick a free id in the range of login.defs, after the highest used one as useradd does."""
+        used = self._used.get(table)
+        if used is None:
+            used = self._used[table] = {int(entry[2]) for _, entry in self.tables[table].entries()
+                                        if len(entry) > 2 and entry[2].isdigit()}
+
+        minimum, maximum = self._setting(low, 1000), self._setting(high, 60000)
+        if preferred is not None and preferred not in used:
+            return preferred
+
+        in_range = [value for value in used if minimum <= value <= maximum]
+        candidate = max(in_range) + 1 if in_range else minimum
+        if candidate > maximum:
+            candidate = next((value for value in range(minimum, maximum + 1) if value not in used), None)
+            if candidate is None:
+                raise AccountError(f"No free id left between {minimum} and {maximum}")
+        return candidate
+
+    def _use(self, table: str, value: int) -> None:
+        if table in self._used:
+            self._used[table].add(value)
+
+    @staticmethod
+    def _today() -> str:
+        return str(int(time.time() // 86400))
+
+    @staticmethod
+    def _split(members: str) -> List[str]:
+        return [member for member in members.split(",") if member]
+
+    def _set_group_members(self, groupname: str, members: List[str]) -> None:
+        self.tables["group"].set(groupname, 3, ",".join(members))
+        gshadow = self.tables["gshadow"]
+        if gshadow.get(groupname) is not None:
+            gshadow.set(groupname, 3, ",".join(members))
+
+    # Users
+
+    def add_user(self, username: str, full_name: str = "", homedir: str = "", shell: str = "/bin/bash",
+                 password: str = "!", create_home: bool = True) -> int:
+        """Add a user and its private group.
+
+        Args:
+            username (str): The username.
+            full_name (str): The full name (GECOS).
+            homedir (str): The home directory, /home/<username> when empty.
+            shell (str): The login shell.
+            password (str): The password hash, "!" locks the account (default).
+            create_home (bool): Create the home directory after the commit (default is True).
+
+        Returns:
+            int: The uid of the user.
+        """
+        homedir = homedir or os.path.join("/home", username)
+        self._check_name(username)
+        self._check_fields(full_name, homedir, shell, password)
+        if self.tables["passwd"].get(username) is not None:
+            raise AccountError(f"The user {username} already exists")
+
+        private_group = self.settings.get("USERGROUPS_ENAB", "yes").lower() == "yes"
+        if private_group and self.tables["group"].get(username) is not None:
+            raise AccountError(f"The group {username} exists, it can not be the private group of the user")
+
+        uid = self._allocate("passwd", "UID_MIN", "UID_MAX")
+        if private_group:
+            # The private group takes the uid as gid when it is free
+            gid = self._allocate("group", "GID_MIN", "GID_MAX", preferred=uid)
+            self.tables["group"].add([username, "x", str(gid), ""])
+            if self.tables["gshadow"].exists:
+                self.tables["gshadow"].add([username, "!", "", ""])
+            self._use("group", gid)
+        else:
+            gid = self._setting("USERS_GID", 100)
+
+        self.tables["passwd"].add([username, "x", str(uid), str(gid), full_name, homedir, shell])
+        self.tables["shadow"].add([username, password, self._today(), "0", "99999", "7", "", "", ""])
+        self._use("passwd", uid)
+
+        if create_home:
+            self.homes.append((homedir, uid, gid))
+        return uid
+
+    def del_user(self, username: str) -> None:
+        """Delete a user, its memberships and its private group, the home directory is kept."""
+        entry = self._user(username)
+        gid = entry[3] if len(entry) > 3 else ""
+
+        self.tables["passwd"].remove(username)
+        self.tables["shadow"].remove(username)
+
+        gshadow = self.tables["gshadow"]
+        for groupname, group in list(self.tables["group"].entries()):
+            members = self._split(group[3]) if len(group) > 3 else []
+            if username in members:
+                self._set_group_members(groupname, [member for member in members if member != username])
+            entry = gshadow.get(groupname)
+            administrators = self._split(entry[2]) if entry is not None and len(entry) > 2 else []
+            if username in administrators:
+                gshadow.set(groupname, 2, ",".join(a for a in administrators if a != username))
+
+        # The private group goes with the user, unless someone else still uses it
+        group = self.tables["group"].get(username)
+        if group is not None and group[2] == gid and not (len(group) > 3 and group[3]) and \
+                not any(user[3] == gid for _, user in self.tables["passwd"].entries() if len(user) > 3):
+            self.tables["group"].remove(username)
+            gshadow.remove(username)
+
+    def modify_user(self, username: str, full_name: Optional[str] = None, homedir: str = "", shell: str = "") -> None:
+        """Change the full name, home directory (not moved) or shell of a user."""
+        self._user(username)
+        self._check_fields(full_name or "", homedir, shell)
+
+        if full_name is not None:
+            self.tables["passwd"].set(username, 4, full_name)
+        if homedir:
+            self.tables["passwd"].set(username, 5, homedir)
+        if shell:
+            self.tables["passwd"].set(username, 6, shell)
+
+    def set_password(self, username: str, password: str) -> None:
+        """Set the password hash of a user."""
+        self._user(username)
+        self._check_fields(password)
+        if self.tables["shadow"].get(username) is None:
+            raise AccountError(f"The user {username} has no shadow entry")
+
+        self.tables["shadow"].set(username, 1, password)
+        self.tables["shadow"].set(username, 2, self._today())
+
+    # Groups
+
+    def add_group(self, groupname: str) -> int:
+        """Add a group.
+
+        Returns:
+            int: The gid of the group.
+        """
+        self._check_name(groupname)
+        if self.tables["group"].get(groupname) is not None:
+            raise AccountError(f"The group {groupname} already exists")
+
+        gid = self._allocate("group", "GID_MIN", "GID_MAX")
+        self.tables["group"].add([groupname, "x", str(gid), ""])
+        if self.tables["gshadow"].exists:
+            self.tables["gshadow"].add([groupname, "!", "", ""])
+        self._use("group", gid)
+        return gid
+
+    def del_group(self, groupname: str) -> None:
+        """Delete a group, refused when it is the primary group of a user."""
+        gid = self._group(groupname)[2]
+        for username, user in self.tables["passwd"].entries():
+            if len(user) > 3 and user[3] == gid:
+                raise AccountError(f"The group {groupname} is the primary group of the user {username}")
+
+        self.tables["group"].remove(groupname)
+        self.tables["gshadow"].remove(groupname)
+
+    def set_members(self, groupname: str, usernames: List[str]) -> None:
+        """Replace the member list of a group."""
+        self._group(groupname)
+        for username in usernames:
+            self._user(username)
+        self._set_group_members(groupname, list(dict.fromkeys(usernames)))
+
+    def change_members(self, groupname: str, added: List[str], removed: List[str]) -> None:
+        """Add and remove members of a group, the users not in it are not removed."""
+        group = self._group(groupname)
+        for username in added:
+            self._user(username)
+        members = [member for member in (self._split(group[3]) if len(group) > 3 else []) if member not in removed]
+        members += [username for username in dict.fromkeys(added) if username not in members]
+        self._set_group_members(groupname, members)
+
+    def add_member(self, groupname: str, username: str) -> None:
+        """Add a user to a group."""
+        group = self._group(groupname)
+        self._user(username)
+        members = self._split(group[3]) if len(group) > 3 else []
+        if username not in members:
+            self._set_group_members(groupname, members + [username])
+
+    def remove_member(self, groupname: str, username: str) -> None:
+        """Remove a user from a group."""
+        group = self._group(groupname)
+        members = self._split(group[3]) if len(group) > 3 else []
+        if username not in members:
+            raise AccountError(f"The user {username} is not a member of the group {groupname}")
+        self._set_group_members(groupname, [member for member in members if member != username])
+
+    # Commit
+
+    def _write(self, table: AccountTable, name: str, temporary: str) -> None:
+        """Write the new content of a file next to it, with the same owner and mode."""
+        mode = 0o640 if name in ("shadow", "gshadow") else 0o644
+        fd = os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_CLOEXEC, mode)
+
+        with os.fdopen(fd, "w") as file:
+            if table.exists:
+                stat = os.stat(table.path)
+                os.fchmod(file.fileno(), stat.st_mode & 0o7777)
+                try:
+                    os.fchown(file.fileno(), stat.st_uid, stat.st_gid)
+                except PermissionError:
+                    pass
+            file.write(table.render())
+            file.flush()
+            os.fsync(file.fileno())
+
+    @staticmethod
+    def _discard(paths: List[str]) -> None:
+        for path in paths:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+
+    def _restore(self, replaced: List[str]) -> None:
+        """Put back the previous content of the files already replaced, from their <file>- backup."""
+        for name in reversed(replaced):
+            table = self.tables[name]
+            try:
+                if table.exists:
+                    os.replace(f"{table.path}-", table.path)
+                else:
+                    os.unlink(table.path)
+            except OSError:
+                # Nothing more can be done, the error of the commit is raised
+                pass
+
+    def commit(self) -> List[str]:
+        """Write the changed files.
+
+        Every file is written to a temporary file first, then they are renamed
+        over the old ones; the previous content is kept as <file>- like
+        shadow-utils does. If a rename fails, the files already replaced are
+        put back from their backup, so the files stay consistent with each
+        other. The renames are not atomic as a whole: a crash between two of
+        them leaves the first ones changed, as with shadow-utils.
+
+        Returns:
+            list: The names of the files written.
+        """
+        changed = [name for name in ACCOUNT_FILES if self.tables[name].changed]
+        temporaries: Dict[str, str] = {}
+
+        try:
+            for name in changed:
+                # Known before it is created, so a failed write is cleaned up too
+                temporaries[name] = f"{self.tables[name].path}+"
+                self._write(self.tables[name], name, temporaries[name])
+        except BaseException:
+            self._discard(list(temporaries.values()))
+            raise
+
+        replaced: List[str] = []
+        try:
+            for name in changed:
+                path = self.tables[name].path
+                if self.tables[name].exists:
+                    try:
+                        os.unlink(f"{path}-")
+                    except FileNotFoundError:
+                        pass
+                    os.link(path, f"{path}-")
+                os.replace(temporaries[name], path)
+                replaced.append(name)
+        except BaseException:
+            self._restore(replaced)
+            self._discard([temporaries[name] for name in changed if name not in replaced])
+            raise
+
+        if changed:
+            directory = os.open(self.etc_dir, os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(directory)
+            finally:
+                os.close(directory)
+
+        return changed
+
+
+class NativeBackend:
+    """Engine editing passwd, shadow, group and gshadow directly.
+
+    The files are loaded under the account lock, changed in memory and
+    written back with write-temp-then-rename, so any number of changes costs
+    one lock and one rewrite per file, and no process is spawned. Pointed at
+    another directory than /etc, it changes a copy of the account files.
+
+    Functions (Methods):
+        - __init__: Initialize the NativeBackend class.
+        - transaction: Apply a function to the account files under the lock, then commit.
+        - add_user, add_users, del_user, modify_user, set_passwords: Change the users.
+        - add_group, del_group: Change the groups.
+        - add_member, remove_member, set_members, change_members: Change the members of a group.
+    """
+
+    name: str = "native"
+
+    def __init__(self, etc_dir: str = "/etc", lock_timeout: float = 15.0):
+        """Initialize NativeBackend class.
+
+        Args:
+            etc_dir (str): The directory holding the account files (default is /etc).
+            lock_timeout (float): Seconds to wait for the account lock (default is 15 seconds).
+        """
+        self.etc_dir: str = etc_dir
+        self.lock: AccountLock = AccountLock(etc_dir, lock_timeout)
+
+    def _settings(self) -> Dict[str, str]:
+        """Read the settings of login.defs."""
+        return read_login_defs(self.etc_dir)
+
+    async def transaction(self, change: Callable[[AccountTransaction], T]) -> Tuple[T, Dict[str, str]]:
+        """Apply a function to the account files under the lock, then commit.
+
+        Nothing is written when the function raises. The home directories of
+        the new users are created after the commit, in parallel; as with
+        useradd, a home that could not be created leaves the account in place.
+
+        Args:
+            change (callable): Receives the AccountTransaction to change.
+
+        Returns:
+            tuple: What the function returned, and home directory -> error for the homes not created.
+        """
+        def run() -> Tuple[T, AccountTransaction]:
+            with self.lock:
+                transaction = AccountTransaction(self.etc_dir, self._settings())
+                result = change(transaction)
+                transaction.commit()
+                return result, transaction
+
+        result, transaction = await asyncio.to_thread(run)
+
+        errors = await home_provisioner.create(os.path.join(self.etc_dir, "skel"), transaction.homes,
+                                               home_mode(transaction.settings))
+        return result, errors
+
+    async def _apply(self, change: Callable[[AccountTransaction], Any]) -> Result:
+        try:
+            _, errors = await self.transaction(change)
+        except (AccountError, OSError) as e:
+            return "", str(e), 1
+        return "", "; ".join(errors.values()), 0
+
+    async def add_user(self, username: str, full_name: str, homedir: str, shell: str) -> Result:
+        return await self._apply(lambda t: t.add_user(username, full_name, homedir, shell or "/bin/bash"))
+
+    async def add_users(self, rows: List[Dict[str, str]]) -> Tuple[Dict[int, str], Dict[int, str]]:
+        """Create many users with one lock and one rewrite of the account files.
+
+        Returns:
+            tuple: The failed rows and the rows created with a warning, position -> message.
+        """
+        failed: Dict[int, str] = {}
+        with_password = [i for i, row in enumerate(rows) if row["passwd"]]
+        try:
+            hashes = dict(zip(with_password, await hash_passwords([rows[i]["passwd"] for i in with_password])))
+        except AccountError as e:
+            return {i: str(e) for i in range(len(rows))}, {}
+
+        def change(transaction: AccountTransaction) -> None:
+            for i, row in enumerate(rows):
+                try:
+                    transaction.add_user(row["username"], row["full_name"], row["homedir"],
+                                         row["shell"] or "/bin/bash", hashes.get(i, "!"))
+                except AccountError as e:
+                    failed[i] = str(e)
+
+        try:
+            _, errors = await self.transaction(change)
+        except (AccountError, OSError) as e:
+            return {i: str(e) for i in range(len(rows))}, {}
+
+        notes: Dict[int, str] = {}
+        for i, row in enumerate(rows):
+            error = errors.get(row["homedir"] or os.path.join("/home", row["username"]))
+            if error is not None and i not in failed:
+                notes[i] = error
+        return failed, notes
+
+    async def del_user(self, username: str) -> Result:
+        return await self._apply(lambda t: t.del_user(username))
+
+    async def modify_user(self, username: str, full_name: str, homedir: str, shell: str) -> Result:
+        return await self._apply(lambda t: t.modify_user(username, full_name, homedir, shell))
+
+    async def set_passwords(self, passwords: List[Tuple[str, str]]) -> Dict[int, str]:
+        failed: Dict[int, str] = {}
+        try:
+            hashes = await hash_passwords([passwd for _, passwd in passwords])
+        except AccountError as e:
+            return {i: str(e) for i in range(len(passwords))}
+
+        def change(transaction: AccountTransaction) -> None:
+            for i, ((username, _), hashed) in enumerate(zip(passwords, hashes)):
+                try:
+                    transaction.set_password(username, hashed)
+                except AccountError as e:
+                    failed[i] = str(e)
+
+        try:
+            await self.transaction(change)
+        except (AccountError, OSError) as e:
+            return {i: str(e) for i in range(len(passwords))}
+        return failed
+
+    async def add_group(self, groupname: str) -> Result:
+        return await self._apply(lambda t: t.add_group(groupname))
+
+    async def del_group(self, groupname: str) -> Result:
+        return await self._apply(lambda t: t.del_group(groupname))
+
+    async def add_member(self, groupname: str, username: str) -> Result:
+        return await self._apply(lambda t: t.add_member(groupname, username))
+
+    async def remove_member(self, groupname: str, username: str) -> Result:
+        return await self._apply(lambda t: t.remove_member(groupname, username))
+
+    async def set_members(self, groupname: str, usernames: List[str]) -> Result:
+        return await self._apply(lambda t: t.set_members(groupname, usernames))
+
+    async def change_members(self, groupname: str, added: List[str], removed: List[str]) -> Result:
+        # Read and rewritten under the account lock, no change of another tool is lost
+        return await self._apply(lambda t: t.change_members(groupname, added, removed))
+
+
+def create_backend(name: str, etc_dir: str = "/etc") -> AccountBackend:
+    """Create the account engine of a name.
+
+    Args:
+        name (str): "shadow" for the shadow-utils commands, "native" to edit the files directly.
+        etc_dir (str): The directory holding the account files (default is /etc).
+
+    Raises:
+        ValueError: When the name is unknown.
+    """
+    if name == "shadow":
+        return ShadowUtilsBackend()
+    if name == "native":
+        return NativeBackend(etc_dir)
+    raise ValueError(f"Unknown account backend: {name}")
+
+
+account_backend: AccountBackend = create_backend(
+    os.environ.get("SYSMANAGE_ACCOUNT_BACKEND", "shadow"),
+    os.environ.get("SYSMANAGE_ETC_DIR", "/etc"),
+)
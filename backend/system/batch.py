@@ -0,0 +1,282 @@
+####################################################################################
+# Author: Djetic Alexandre
+# Description: This module applies an ordered list of account operations as a
+#              single all-or-nothing change
+####################################################################################
+
+import asyncio
+import os
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from .accounts import accounts
+from .member import _group_lock
+from .system import ExecutorBusy
+from .backends import AccountBackend, AccountError, AccountTransaction, NativeBackend, account_backend, hash_passwords
+
+BATCH_ACTIONS: Tuple[str, ...] = (
+    "add_user", "update_user", "del_user", "add_group", "del_group", "add_members", "del_members"
+)
+
+
+class BatchError(Exception):
+    """Raised when an operation of a batch is refused.
+
+    Attributes:
+        position (int): The position of the operation in the batch.
+    """
+
+    def __init__(self, position: int, message: str):
+        super().__init__(message)
+        self.position: int = position
+
+
+class _PartialBatch(BatchError):
+    """A failed batch whose previous operations could not all be undone."""
+
+
+def _name(operation: Dict[str, Any]) -> str:
+    return operation.get("username") or operation.get("groupname", "")
+
+
+class Batch:
+    """An ordered list of account operations applied all or nothing.
+
+    Every operation is a dict with an "action" (see BATCH_ACTIONS) and the
+    fields of that action: username, full_name, homedir, shell and passwd
+    for the users, groupname for the groups, groupname and users for the
+    members.
+
+    With a transactional engine (the native one) the operations are applied
+    in memory under a single account lock, in order, then every changed file
+    is written once: a refused operation leaves the files untouched.
+
+    With the shadow-utils engine the batch is first played on an in-memory
+    copy of the account files, which refuses most invalid batches before any
+    command runs. The commands are then run in order and, if one fails, the
+    operations already done are undone in reverse order. Deleted users and
+    groups can not be brought back, so a batch failing after a deletion is
+    only partially undone.
+
+    Functions (Methods):
+        - __init__: Initialize the Batch class.
+        - run: Apply the batch.
+    """
+
+    def __init__(self, operations: List[Dict[str, Any]], backend: Optional[AccountBackend] = None,
+                 etc_dir: str = ""):
+        """Initialize Batch class.
+
+        Args:
+            operations (list): The operations, in order.
+            backend (AccountBackend, optional): The engine applying them (default is the configured one).
+            etc_dir (str): The directory of the account files the plan is checked against
+                           (default is SYSMANAGE_ETC_DIR or /etc).
+        """
+        self.operations: List[Dict[str, Any]] = operations
+        self.backend: AccountBackend = backend or account_backend
+        self.etc_dir: str = etc_dir or os.environ.get("SYSMANAGE_ETC_DIR", "/etc")
+
+    @staticmethod
+    def _apply(transaction: AccountTransaction, operation: Dict[str, Any], password: str) -> None:
+        """Apply one operation to the account files in memory."""
+        action = operation["action"]
+
+        if action == "add_user":
+            transaction.add_user(operation["username"], operation.get("full_name", ""), operation.get("homedir", ""),
+                                 operation.get("shell") or "/bin/bash", password or "!")
+        elif action == "update_user":
+            transaction.modify_user(operation["username"], operation.get("full_name"),
+                                    operation.get("homedir", ""), operation.get("shell", ""))
+            if password:
+                transaction.set_password(operation["username"], password)
+        elif action == "del_user":
+            transaction.del_user(operation["username"])
+        elif action == "add_group":
+            transaction.add_group(operation["groupname"])
+        elif action == "del_group":
+            transaction.del_group(operation["groupname"])
+        elif action == "add_members":
+            for username in operation["users"]:
+                transaction.add_member(operation["groupname"], username)
+        elif action == "del_members":
+            for username in operation["users"]:
+                transaction.remove_member(operation["groupname"], username)
+        else:
+            raise AccountError(f"Unknown action: {action}")
+
+    def _play(self, transaction: AccountTransaction, passwords: Dict[int, str]) -> None:
+        """Apply every operation in order, the first refused one stops the batch."""
+        for position, operation in enumerate(self.operations):
+            try:
+                self._apply(transaction, operation, passwords.get(position, ""))
+            except AccountError as e:
+                raise BatchError(position, str(e)) from e
+
+    async def _run_native(self, backend: NativeBackend, passwords: Dict[int, str]) -> Dict[str, str]:
+        _, errors = await backend.transaction(lambda transaction: self._play(transaction, passwords))
+        return errors
+
+    def _dry_run(self) -> None:
+        """Play the batch on the current account files without writing anything."""
+        transaction = AccountTransaction(self.etc_dir, NativeBackend(self.etc_dir)._settings())
+        self._play(transaction, {position: "!" for position, operation in enumerate(self.operations)
+                                 if operation.get("passwd")})
+
+    async def _change_members(self, name: str, added: List[str], removed: List[str]) -> Tuple[str, int]:
+        """Apply a member delta to a group, serialized with the member routes."""
+        async with _group_lock(name):
+            _, error, status = await self.backend.change_members(name, added, removed)
+            if status == 0:
+                accounts.update_members(name, added=added, removed=removed)
+            else:
+                accounts.invalidate("group")
+        return error, status
+
+    async def _run_command(self, operation: Dict[str, Any], undo: List[Optional[Callable[[], Awaitable[Any]]]]
+                           ) -> Tuple[str, int]:
+        """Run one operation, appending how to undo it (None when it can not be undone) to undo.
+
+        Returns:
+            tuple: The error and the status of the operation, 0 on success.
+        """
+        action, name = operation["action"], _name(operation)
+        backend = self.backend
+        error = ""
+
+        if action == "add_user":
+            _, error, status = await backend.add_user(name, operation.get("full_name", ""),
+                                                      operation.get("homedir") or f"/home/{name}",
+                                                      operation.get("shell") or "/bin/bash")
+            if status == 0:
+                undo.append(lambda name=name: backend.del_user(name))
+                if operation.get("passwd"):
+                    failed = await backend.set_passwords([(name, operation["passwd"])])
+                    error, status = failed.get(0, ""), 1 if failed else 0
+        elif action == "update_user":
+            previous = await accounts.user(name)
+            _, error, status = await backend.modify_user(name, operation.get("full_name", ""),
+                                                         operation.get("homedir", ""), operation.get("shell", ""))
+            if status == 0 and previous is not None:
+                undo.append(lambda name=name, previous=previous: backend.modify_user(
+                    name, previous.full_name, previous.home_dir, previous.shell))
+            if status == 0 and operation.get("passwd"):
+                failed = await backend.set_passwords([(name, operation["passwd"])])
+                error, status = failed.get(0, ""), 1 if failed else 0
+                if status == 0:
+                    # The previous password can not be restored
+                    undo.append(None)
+        elif action == "del_user":
+            _, error, status = await backend.del_user(name)
+            if status == 0:
+                # A deletion can not be undone
+                undo.append(None)
+        elif action == "add_group":
+            _, error, status = await backend.add_group(name)
+            if status == 0:
+                undo.append(lambda name=name: backend.del_group(name))
+        elif action == "del_group":
+            _, error, status = await backend.del_group(name)
+            if status == 0:
+                undo.append(None)
+        else:
+            # Only the delta is applied, and undone, so concurrent changes of the group are kept
+            group = await accounts.group(name)
+            before = group.members if group is not None else []
+            users = list(dict.fromkeys(operation["users"]))
+            if action == "add_members":
+                added, removed = [user for user in users if user not in before], []
+            else:
+                added, removed = [], [user for user in users if user in before]
+            error, status = await self._change_members(name, added, removed)
+            if status == 0:
+                async def restore(name=name, added=added, removed=removed) -> Tuple[str, str, int]:
+                    error, status = await self._change_members(name, removed, added)
+                    return "", error, status
+                undo.append(restore)
+
+        return error, status
+
+    async def _run_commands(self) -> Tuple[Optional[BatchError], bool]:
+        """Run the operations one command at a time, undoing them on failure.
+
+        Returns:
+            tuple: The error of the failed operation (None on success), and
+                   whether everything done before it was undone.
+        """
+        undo: List[Optional[Callable[[], Awaitable[Any]]]] = []
+
+        for position, operation in enumerate(self.operations):
+            try:
+                error, status = await self._run_command(operation, undo)
+            except ExecutorBusy as e:
+                # The operations before it are applied: undo them as for any failure
+                error, status = str(e), 1
+
+            if status != 0:
+                accounts.invalidate()
+                complete = True
+                for step in reversed(undo):
+                    try:
+                        if step is None or (await step())[2] != 0:
+                            complete = False
+                    except ExecutorBusy:
+                        complete = False
+                accounts.invalidate()
+                return BatchError(position, error or f"{operation['action']} {_name(operation)} failed"), complete
+
+        accounts.invalidate()
+        return None, False
+
+    async def run(self) -> Dict[str, Any]:
+        """Apply the batch.
+
+        Returns:
+            dict: status, message and one result per operation. On failure,
+                  failed is the position of the refused operation and
+                  rolled_back tells if the account files are as before.
+        """
+        results = [{"position": position, "action": operation["action"], "name": _name(operation), "status": 200}
+                   for position, operation in enumerate(self.operations)]
+
+        try:
+            positions = [position for position, operation in enumerate(self.operations) if operation.get("passwd")]
+            if isinstance(self.backend, NativeBackend):
+                hashes = await hash_passwords([self.operations[position]["passwd"] for position in positions])
+                warnings = await self._run_native(self.backend, dict(zip(positions, hashes)))
+                accounts.invalidate()
+                for result, operation in zip(results, self.operations):
+                    home = operation.get("homedir") or f"/home/{operation.get('username', '')}"
+                    if operation["action"] == "add_user" and home in warnings:
+                        result["message"] = warnings[home]
+            else:
+                # Reads the account files, off the event loop
+                await asyncio.to_thread(self._dry_run)
+                error, rolled_back = await self._run_commands()
+                if error is not None:
+                    raise BatchError(error.position, str(error)) if rolled_back else \
+                        _PartialBatch(error.position, str(error))
+        except _PartialBatch as e:
+            return self._failed(results, e, rolled_back=False)
+        except BatchError as e:
+            return self._failed(results, e, rolled_back=True)
+        except (AccountError, OSError) as e:
+            return {"status": 500, "message": str(e), "failed": None, "rolled_back": True, "results": []}
+
+        return {"status": 200, "message": f"{len(results)} operations applied", "failed": None,
+                "rolled_back": False, "results": results}
+
+    @staticmethod
+    def _failed(results: List[Dict[str, Any]], error: BatchError, rolled_back: bool) -> Dict[str, Any]:
+        for result in results:
+            if result["position"] == error.position:
+                result.update(status=409, message=str(error))
+            elif rolled_back or result["position"] > error.position:
+                result.update(status=424, message="Not applied")
+        return {
+            "status": 409,
+            "message": f"Operation {error.position} failed: {error}"
+                       + ("" if rolled_back else ", the operations before it could not all be undone"),
+            "failed": error.position,
+            "rolled_back": rolled_back,
+            "results": results,
+        }
+
@@ -0,0 +1,290 @@
+####################################################################################
+# Author: Djetic Alexandre
+# Description: This module watches the account database and publishes the
+#              changes as events
+####################################################################################
+
+import asyncio
+import os
+from collections import deque
+from typing import Dict, Any, Optional, Set, Tuple
+from .accounts import AccountDatabase, accounts
+from .sessions import LoginIndex, login_index
+
+
+class Subscription:
+    """The queue of events of a subscriber.
+
+    Functions (Methods):
+        - __init__: Initialize the Subscription class.
+        - get: Wait for the next event.
+    """
+
+    def __init__(self, size: int):
+        """Initialize Subscription class.
+
+        Args:
+            size (int): Maximum number of pending events.
+        """
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=size)
+
+    async def get(self, timeout: float) -> Optional[Dict[str, Any]]:
+        """Wait for the next event.
+
+        Args:
+            timeout (float): Seconds to wait.
+
+        Returns:
+            dict: The event or None if none came in time.
+        """
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class EventBroker:
+    """Fan out of the events to the subscribers.
+
+    The last events are kept so a subscriber reconnecting with the id of the
+    last event it received gets the ones it missed. A subscriber too slow to
+    keep up, or reconnecting after the kept history, receives a single
+    "resync" event telling it to fetch everything again.
+
+    Functions (Methods):
+        - __init__: Initialize the EventBroker class.
+        - subscribe: Register a subscriber.
+        - unsubscribe: Forget a subscriber.
+        - publish: Send an event to every subscriber.
+        - subscribers: Number of registered subscribers.
+    """
+
+    def __init__(self, history: int = 1024, queue_size: int = 1024):
+        """Initialize EventBroker class.
+
+        Args:
+            history (int): Number of events kept for the reconnections (default is 1024).
+            queue_size (int): Maximum number of pending events per subscriber (default is 1024).
+        """
+        self._history: deque = deque(maxlen=history)
+        self._queue_size: int = queue_size
+        self._subscriptions: Set[Subscription] = set()
+        self._next_id: int = 1
+
+    def _resync(self) -> Dict[str, Any]:
+        return {"id": self._next_id - 1, "type": "resync", "action": "", "name": "", "data": None}
+
+    def subscribe(self, last_event_id: Optional[int] = None) -> Subscription:
+        """Register a subscriber.
+
+        Args:
+            last_event_id (int, optional): The id of the last event received before a reconnection.
+
+        Returns:
+            Subscription: The subscription to read the events from.
+        """
+        subscription = Subscription(self._queue_size)
+
+        if last_event_id is not None and last_event_id >= self._next_id:
+            # An id of a previous run of the backend: the changes since are unknown
+            subscription.queue.put_nowait(self._resync())
+        elif last_event_id is not None and last_event_id < self._next_id - 1:
+            missed = [event for event in self._history if event["id"] > last_event_id]
+            first = self._history[0]["id"] if self._history else self._next_id
+
+            if last_event_id < first - 1 or len(missed) > self._queue_size:
+                subscription.queue.put_nowait(self._resync())
+            else:
+                for event in missed:
+                    subscription.queue.put_nowait(event)
+
+        self._subscriptions.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        """Forget a subscriber."""
+        self._subscriptions.discard(subscription)
+
+    @property
+    def subscribers(self) -> int:
+        """Number of registered subscribers."""
+        return len(self._subscriptions)
+
+    def publish(self, type: str, action: str, name: str, data: Any = None) -> Dict[str, Any]:
+        """Send an event to every subscriber.
+
+        Args:
+            type (str): What changed ("user", "group", "password", "session").
+            action (str): "added", "changed" or "removed".
+            name (str): The name of the user or group.
+            data (any): The new state, None when removed.
+
+        Returns:
+            dict: The event.
+        """
+        event = {"id": self._next_id, "type": type, "action": action, "name": name, "data": data}
+        self._next_id += 1
+        self._history.append(event)
+
+        for subscription in self._subscriptions:
+            try:
+                subscription.queue.put_nowait(event)
+            except asyncio.QueueFull:
+                # Too far behind: drop what is pending and ask for a full reload
+                while not subscription.queue.empty():
+                    subscription.queue.get_nowait()
+                subscription.queue.put_nowait(self._resync())
+
+        return event
+
+
+class AccountWatcher:
+    """Publish the changes of the account database as events.
+
+    A background task compares the generation of the account files every
+    ``interval`` seconds (a few stat calls) and the set of logged in users.
+    When something changed, the new entries are diffed against the previous
+    snapshot and one event is published per added, changed or removed entry.
+    The task is started by the first subscriber and stopped when the last
+    one leaves, or at the shutdown of the app.
+
+    Functions (Methods):
+        - __init__: Initialize the AccountWatcher class.
+        - subscribe: Register a subscriber, starting the watcher if needed.
+        - unsubscribe: Forget a subscriber, stopping the watcher after the last one.
+        - poll: Compare the account database with the previous snapshot once.
+        - stop: Stop the background task.
+    """
+
+    def __init__(self, database: AccountDatabase, sessions: LoginIndex, broker: EventBroker,
+                 interval: float = 1.0):
+        """Initialize AccountWatcher class.
+
+        Args:
+            database (AccountDatabase): The account database to watch.
+            sessions (LoginIndex): The login index to watch.
+            broker (EventBroker): Where to publish the events.
+            interval (float): Seconds between two checks (default is 1 second).
+        """
+        self.database: AccountDatabase = database
+        self.sessions: LoginIndex = sessions
+        self.broker: EventBroker = broker
+        self.interval: float = interval
+        self._signature: Optional[str] = None
+        self._state: Optional[Dict[str, Dict[str, tuple]]] = None
+        self._logins: Set[str] = set()
+        self._task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def _user(record) -> Dict[str, Any]:
+        return {"username": record.username, "uid": record.uid, "gid": record.gid,
+                "full_name": record.full_name, "home_dir": record.home_dir, "shell": record.shell}
+
+    @staticmethod
+    def _group(record) -> Dict[str, Any]:
+        return {"Group_Name": record.name, "GID": record.gid, "Members": record.members}
+
+    @staticmethod
+    def _password(record) -> Dict[str, Any]:
+        return {field: getattr(record, field) for field in record.__slots__}
+
+    async def _take(self) -> Tuple[Dict[str, Dict[str, tuple]], Dict[str, Dict[str, Any]]]:
+        """Copy the comparable state of the entries, and keep the records to describe them."""
+        records = {
+            "user": await self.database.users(),
+            "group": await self.database.groups(),
+            "password": await self.database.files["shadow"].load(),
+        }
+        # Records are updated in place (member lists), so compare copies of their values
+        state = {
+            "user": {name: (r.uid, r.gid, r.full_name, r.home_dir, r.shell) for name, r in records["user"].items()},
+            "group": {name: (r.gid, r.member_ids.tobytes()) for name, r in records["group"].items()},
+            "password": {name: tuple(getattr(r, f) for f in r.__slots__) for name, r in records["password"].items()},
+        }
+        return state, records
+
+    def _diff(self, type: str, old: Dict[str, tuple], new: Dict[str, tuple], records: Dict[str, Any]) -> None:
+        describe = {"user": self._user, "group": self._group, "password": self._password}[type]
+
+        for name in old.keys() - new.keys():
+            self.broker.publish(type, "removed", name)
+        for name, value in new.items():
+            previous = old.get(name)
+            if previous is None:
+                self.broker.publish(type, "added", name, describe(records[name]))
+            elif previous != value:
+                self.broker.publish(type, "changed", name, describe(records[name]))
+
+    async def poll(self) -> None:
+        """Compare the account database with the previous snapshot once."""
+        signature, _ = await self.database.signature()
+
+        if signature != self._signature:
+            state, records = await self._take()
+            if self._state is not None:
+                for type in ("user", "group", "password"):
+                    self._diff(type, self._state[type], state[type], records[type])
+            self._state = state
+            self._signature = signature
+
+        logins = set(await self.sessions.refresh())
+        for name in sorted(logins - self._logins):
+            self.broker.publish("session", "added", name, self.sessions.get(name))
+        for name in sorted(self._logins - logins):
+            self.broker.publish("session", "removed", name)
+        self._logins = logins
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.poll()
+            except Exception:
+                # A failed check is retried at the next interval
+                pass
+            await asyncio.sleep(self.interval)
+
+    async def subscribe(self, last_event_id: Optional[int] = None) -> Subscription:
+        """Register a subscriber, starting the watcher if needed.
+
+        Args:
+            last_event_id (int, optional): The id of the last event received before a reconnection.
+
+        Returns:
+            Subscription: The subscription to read the events from.
+        """
+        if self._task is None or self._task.done():
+            # The first snapshot is the baseline, it publishes nothing
+            if self._state is None:
+                self._logins = set(await self.sessions.refresh())
+                await self.poll()
+            # Another subscriber may have started it in the meantime
+            if self._task is None or self._task.done():
+                self._task = asyncio.create_task(self._run())
+
+        return self.broker.subscribe(last_event_id)
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        """Forget a subscriber, stopping the watcher after the last one.
+
+        The snapshot is kept: the next subscriber gets the changes made in
+        between as events.
+        """
+        self.broker.unsubscribe(subscription)
+        if self.broker.subscribers == 0 and self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def stop(self) -> None:
+        """Stop the background task."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+watcher: AccountWatcher = AccountWatcher(
+    accounts, login_index, EventBroker(), interval=float(os.environ.get("SYSMANAGE_EVENTS_INTERVAL", 1))
+)
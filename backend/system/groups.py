@@ -1,7 +1,13 @@
-from typing import Dict, Any
-from .system import execute, exec_powershell
+from typing import Dict, Any, Iterator, List, Optional, Tuple
+from .system import execute, exec_powershell, ExecutorBusy
 from .system_property import SystemProperty
 from .member import Member
+from .accounts import accounts, parse_group
+from .query import resume_position, next_cursor, parse_fields, in_range, id_kind
+from .records import GroupRecord, names as record_names
+from .backends import account_backend
+
+GROUP_FIELDS = ("Group_Name", "GID", "Members")
 
 class Groups(SystemProperty):
     """Module for managing system groups.
@@ -16,7 +22,9 @@ class Groups(SystemProperty):
         - __init__: Initialize Groups class.
         - _get_all_linux: Retrieve information about all groups on a Linux system.
         - _get_all_win: Retrieve information about all groups on a Windows system.
-        - _parse_group_entry: Parse a single entry of group information.
+        - _format_group_entry: Format a parsed group entry for the groups listing.
+        - select: Filter and project the groups lazily, one group at a time.
+        - query: Paginated, filtered and projected listing of the groups.
         - _parse_windows_group_entry: Parse a single entry of group information from a Windows system.
         - del_group: Delete a group from the system.
         - add_group: Add a new group to the system.
@@ -38,42 +46,116 @@ class Groups(SystemProperty):
         Returns:
             dict: A dictionary containing information about all groups.
         """
-        output, error, status = await execute("cat /etc/group")
-        data: dict = {"status": status, "groups": {}}
+        groups: dict = {}
 
-        if status == 0:
-            groups: dict = {}
+        for groupname, entry in (await accounts.groups()).items():
+            groups[groupname] = self._format_group_entry(entry)
 
-            for line in output.split("\n"):
-                group_info: dict = self._parse_group_entry(line)
-                if group_info:
-                    groups[group_info["Group_Name"]] = group_info
+        return {"status": 0, "groups": groups}
 
-            data["groups"] = groups
-        else:
-            data["groups"] = None
+    @staticmethod
+    def _format_group_entry(entry: GroupRecord) -> Dict[str, Any]:
+        """Format a parsed group entry for the groups listing.
 
-        return data
+        Args:
+            entry (GroupRecord): A parsed entry of the group file.
+
+        Returns:
+            dict: A dictionary containing the group information.
+        """
+        return {
+            "Group_Name": entry.name,
+            "GID": entry.gid,
+            "Members": entry.members,
+        }
 
-    def _parse_group_entry(self, entry: str) -> Dict[str, Any]:
-        """Parse a single entry of group information.
+    async def select(self, limit: Optional[int] = None, cursor: str = "", fields: str = "",
+                     gid_min: Optional[int] = None, gid_max: Optional[int] = None, kind: str = "",
+                     member: str = "") -> Tuple[List[str], Iterator[Tuple[int, str, Dict[str, Any]]]]:
+        """Filter and project the groups lazily, one group at a time.
 
         Args:
-            entry (str): A single line containing group information.
+            limit (int, optional): Maximum number of groups to return, all if None.
+            cursor (str): Cursor returned by the previous page, empty for the first one.
+            fields (str): Comma separated fields to return, all if empty.
+            gid_min (int, optional): Minimum gid.
+            gid_max (int, optional): Maximum gid.
+            kind (str): "system" or "human" groups only.
+            member (str): Only the groups listing this user as a member.
 
         Returns:
-            dict: A dictionary containing parsed group information.
+            tuple: The ordered group names and an iterator of (next position, name, group).
+
+        Raises:
+            ValueError: When a parameter is invalid.
         """
-        parts = entry.split(":")
+        selected = parse_fields(fields, GROUP_FIELDS, GROUP_FIELDS)
 
-        if len(parts) >= 4:
-            return {
-                "Group_Name": parts[0],
-                "GID": parts[2],
-                "Members": parts[3].split(","),
-            }
+        if limit is not None and limit < 1:
+            raise ValueError("The limit must be positive")
+        if kind not in ("", "system", "human"):
+            raise ValueError("The kind must be system or human")
 
-        return {}
+        entries = await accounts.groups()
+        names = list(entries)
+        position = resume_position(names, cursor)
+        # Compare the member ids, not the names
+        member_id = record_names.find(member)
+
+        def rows(position: int) -> Iterator[Tuple[int, str, Dict[str, Any]]]:
+            count = 0
+
+            while position < len(names) and (limit is None or count < limit):
+                entry = entries[names[position]]
+                position += 1
+
+                gid = entry.gid if entry.gid >= 0 else None
+                if not in_range(gid, gid_min, gid_max):
+                    continue
+                if kind and id_kind(gid) != kind:
+                    continue
+                if member and member_id not in entry.member_ids:
+                    continue
+
+                count += 1
+                group = self._format_group_entry(entry)
+                yield position, entry.name, {field: group[field] for field in selected}
+
+        return names, rows(position)
+
+    async def query(self, limit: Optional[int] = None, cursor: str = "", fields: str = "",
+                    gid_min: Optional[int] = None, gid_max: Optional[int] = None, kind: str = "",
+                    member: str = "") -> Dict[str, Any]:
+        """Paginated, filtered and projected listing of the groups.
+
+        Args:
+            limit (int, optional): Maximum number of groups to return, all if None.
+            cursor (str): Cursor returned by the previous page, empty for the first one.
+            fields (str): Comma separated fields to return, all if empty.
+            gid_min (int, optional): Minimum gid.
+            gid_max (int, optional): Maximum gid.
+            kind (str): "system" or "human" groups only.
+            member (str): Only the groups listing this user as a member.
+
+        Returns:
+            dict: status, groups and next_cursor (None on the last page).
+
+        Raises:
+            ValueError: When a parameter is invalid.
+        """
+        names, rows = await self.select(limit, cursor, fields, gid_min, gid_max, kind, member)
+
+        groups: Dict[str, Dict[str, Any]] = {}
+        position = len(names)
+
+        for position, name, group in rows:
+            groups[name] = group
+
+        return {
+            "status": 0,
+            "groups": groups,
+            "next_cursor": next_cursor(names, position, limit, len(groups))
+        }
 
     async def _get_all_win(self) -> Dict[str, Any]:
         """Retrieve information about all groups on a Windows system.
@@ -126,7 +208,8 @@ class Groups(SystemProperty):
             dict: A dictionary containing status and message.
         """
         try:
-            output, error, status = await execute(f"groupdel {groupname}")
+            output, error, status = await account_backend.del_group(groupname)
+            accounts.invalidate("group")
             if status == 0:
                 return {
                     "status": 200,
@@ -141,6 +224,8 @@ class Groups(SystemProperty):
                     "error": error,
                     "stdout": output
                 }
+        except ExecutorBusy:
+            raise
         except Exception as e:
             return {"status": 501, "message": str(e)}
 
@@ -154,7 +239,8 @@ class Groups(SystemProperty):
             dict: A dictionary containing status and message.
         """
         try:
-            output, error, status = await execute(f"groupadd {groupname}")
+            output, error, status = await account_backend.add_group(groupname)
+            accounts.invalidate("group")
             if status == 0:
                 return {
                     "status": 200,
@@ -169,6 +255,8 @@ class Groups(SystemProperty):
                     "error": error,
                     "stdout": output
                 }
+        except ExecutorBusy:
+            raise
         except Exception as e:
             return {"status": 501, "message": str(e)}
 
@@ -176,18 +264,26 @@ class Groups(SystemProperty):
     async def get_group(groupname: str) -> Dict[str, Any]:
         """Get information about a specific group."""
         try:
-            output, error, status = await execute(f"getent group {groupname}")
-            if status == 0:
-                parts = output.strip().split(":")
-                if len(parts) >= 4:
-                    return {
-                        "Name": parts[0],
-                        "Description": parts[1],
-                        "GroupCategory": parts[2],
-                        "SID": parts[3],
-                        "Members": await Member.get_group_members(groupname)
-                    }
-            return {}
+            entry = await accounts.group(groupname)
+
+            if entry is None:
+                # Not a local group, ask NSS (LDAP, SSSD, ...)
+                output, error, status = await execute(f"getent group {groupname}")
+                if status != 0:
+                    return {}
+                entry = parse_group(output).get(groupname)
+                if entry is None:
+                    return {}
+
+            return {
+                "Name": entry.name,
+                "Description": entry.passwd,
+                "GroupCategory": entry.gid,
+                "SID": ",".join(entry.members),
+                "Members": entry.members
+            }
+        except ExecutorBusy:
+            raise
         except Exception as e:
             return {"error": str(e)}
 
@@ -0,0 +1,215 @@
+####################################################################################
+# Author: Djetic Alexandre
+# Description: This module creates the home directories of new users from the
+#              skeleton directory, in a pool of threads
+####################################################################################
+
+import asyncio
+import errno
+import fcntl
+import os
+import stat
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Set, Tuple
+from .metrics import home_files_copied
+
+# ioctl cloning a whole file (reflink) on btrfs, XFS, bcachefs...: _IOW(0x94, 9, int)
+FICLONE: int = 0x40049409
+# Copy offloads a filesystem pair may not support, the next method is then tried
+UNSUPPORTED: Set[int] = {errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.EPERM}
+DIRECTORY_FLAGS: int = os.O_RDONLY | os.O_DIRECTORY | os.O_NOFOLLOW
+
+# name, kind ("d", "f" or "l"), mode, then the entries of a directory,
+# the size of a file or the target of a link
+Entry = Tuple[str, str, int, Any]
+
+
+class HomeProvisioner:
+    """Creates home directories from a skeleton directory, as `useradd -m` does.
+
+    The skeleton is read once per call, then every home is populated by a
+    thread of the pool. A file is cloned (reflink) when the filesystem
+    shares extents, copied in the kernel with copy_file_range otherwise, and
+    with read/write as a last resort. Every entry is created relative to the
+    descriptor of its directory, without following links, and given its
+    owner and mode through its own descriptor while it is open: the tree is
+    never walked a second time to set the ownership.
+
+    As useradd, an existing home directory that is not empty is left as is.
+
+    Functions (Methods):
+        - __init__: Initialize the HomeProvisioner class.
+        - create: Create home directories from a skeleton.
+        - close: Stop the threads.
+    """
+
+    def __init__(self, workers: int = 8):
+        """Initialize HomeProvisioner class.
+
+        Args:
+            workers (int): Number of homes populated at the same time (default is 8).
+        """
+        self.workers: int = workers
+        self._pool: Optional[ThreadPoolExecutor] = None
+        # (source device, target device) pairs that can not clone or copy_file_range
+        self._no_reflink: Set[Tuple[int, int]] = set()
+        self._no_copy_range: Set[Tuple[int, int]] = set()
+
+    @staticmethod
+    def _scan(path: str) -> List[Entry]:
+        """Read a skeleton tree; sockets, fifos and devices are skipped."""
+        entries: List[Entry] = []
+        with os.scandir(path) as iterator:
+            for entry in iterator:
+                info = entry.stat(follow_symlinks=False)
+                mode = stat.S_IMODE(info.st_mode)
+                if stat.S_ISLNK(info.st_mode):
+                    entries.append((entry.name, "l", mode, os.readlink(entry.path)))
+                elif stat.S_ISDIR(info.st_mode):
+                    entries.append((entry.name, "d", mode, HomeProvisioner._scan(entry.path)))
+                elif stat.S_ISREG(info.st_mode):
+                    entries.append((entry.name, "f", mode, info.st_size))
+        return entries
+
+    def _copy_file(self, source: int, target: int, size: int, devices: Tuple[int, int]) -> str:
+        """Copy the content of a file, the cheapest way the filesystems allow.
+
+        Returns:
+            str: The method used: "reflink", "copy_file_range" or "read_write".
+        """
+        if devices not in self._no_reflink:
+            try:
+                fcntl.ioctl(target, FICLONE, source)
+                return "reflink"
+            except OSError as e:
+                if e.errno not in UNSUPPORTED:
+                    raise
+                self._no_reflink.add(devices)
+
+        if hasattr(os, "copy_file_range") and devices not in self._no_copy_range:
+            try:
+                # Both offsets move on, read/write would resume where it stopped
+                while os.copy_file_range(source, target, max(size, 1 << 20)):
+                    pass
+                return "copy_file_range"
+            except OSError as e:
+                if e.errno not in UNSUPPORTED:
+                    raise
+                self._no_copy_range.add(devices)
+
+        while True:
+            chunk = os.read(source, 1 << 20)
+            if not chunk:
+                return "read_write"
+            os.write(target, chunk)
+
+    def _populate(self, skeleton: str, entries: List[Entry], directory: int, uid: int, gid: int,
+                  devices: Tuple[int, int], copied: Dict[str, int]) -> None:
+        """Create the entries of a skeleton directory in an open directory."""
+        chown = os.geteuid() == 0
+
+        for name, kind, mode, content in entries:
+            if kind == "l":
+                os.symlink(content, name, dir_fd=directory)
+                if chown:
+                    os.chown(name, uid, gid, dir_fd=directory, follow_symlinks=False)
+                continue
+
+            if kind == "d":
+                os.mkdir(name, 0o700, dir_fd=directory)
+                target = os.open(name, DIRECTORY_FLAGS, dir_fd=directory)
+            else:
+                target = os.open(name, os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_NOFOLLOW, 0o600,
+                                 dir_fd=directory)
+            try:
+                if kind == "d":
+                    self._populate(os.path.join(skeleton, name), content, target, uid, gid, devices, copied)
+                else:
+                    source = os.open(os.path.join(skeleton, name), os.O_RDONLY | os.O_NOFOLLOW)
+                    try:
+                        method = self._copy_file(source, target, content, devices)
+                    finally:
+                        os.close(source)
+                    copied[method] = copied.get(method, 0) + 1
+                # chown clears the setuid bits, the mode comes last
+                if chown:
+                    os.fchown(target, uid, gid)
+                os.fchmod(target, mode)
+            finally:
+                os.close(target)
+
+    def _create_home(self, skeleton: str, entries: List[Entry], home: str, uid: int, gid: int,
+                     mode: int) -> Dict[str, int]:
+        """Create one home directory and copy the skeleton in it.
+
+        Returns:
+            dict: The number of files copied by each method.
+        """
+        copied: Dict[str, int] = {}
+        os.makedirs(os.path.dirname(os.path.abspath(home)), mode=0o755, exist_ok=True)
+        try:
+            # Private while it is populated
+            os.mkdir(home, 0o700)
+        except FileExistsError:
+            pass
+
+        directory = os.open(home, DIRECTORY_FLAGS)
+        try:
+            if os.listdir(directory):
+                return copied
+            if entries:
+                devices = (os.stat(skeleton).st_dev, os.fstat(directory).st_dev)
+                self._populate(skeleton, entries, directory, uid, gid, devices, copied)
+            if os.geteuid() == 0:
+                os.fchown(directory, uid, gid)
+            os.fchmod(directory, mode)
+        finally:
+            os.close(directory)
+        return copied
+
+    async def create(self, skeleton: str, homes: List[Tuple[str, int, int]], mode: int = 0o755) -> Dict[str, str]:
+        """Create home directories from a skeleton.
+
+        Args:
+            skeleton (str): The skeleton directory, a missing one gives empty homes.
+            homes (list): The (home directory, uid, gid) to create.
+            mode (int): The mode of the home directories (default is 0755).
+
+        Returns:
+            dict: Home directory -> error, for the homes that could not be created.
+        """
+        if not homes:
+            return {}
+
+        try:
+            entries = await asyncio.to_thread(self._scan, skeleton)
+        except (FileNotFoundError, NotADirectoryError):
+            entries = []
+
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="homes")
+        loop = asyncio.get_running_loop()
+        outcomes = await asyncio.gather(*(
+            loop.run_in_executor(self._pool, self._create_home, skeleton, entries, home, uid, gid, mode)
+            for home, uid, gid in homes
+        ), return_exceptions=True)
+
+        errors: Dict[str, str] = {}
+        for (home, _, _), outcome in zip(homes, outcomes):
+            if isinstance(outcome, OSError):
+                errors[home] = f"home directory {home} not created: {outcome.strerror or outcome}"
+            elif isinstance(outcome, BaseException):
+                raise outcome
+            else:
+                for method, count in outcome.items():
+                    home_files_copied.inc(method, amount=count)
+        return errors
+
+    def close(self) -> None:
+        """Stop the threads."""
+        if self._pool is not None:
+            self._pool.shutdown(wait=True)
+            self._pool = None
+
+
+home_provisioner: HomeProvisioner = HomeProvisioner(int(os.environ.get("SYSMANAGE_HOME_WORKERS", 8)))
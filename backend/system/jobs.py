@@ -0,0 +1,312 @@
+####################################################################################
+# Author: Djetic Alexandre
+# Description: This module runs the long account operations in the background
+#              and keeps their status in a small SQLite database
+####################################################################################
+
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+from .system import ExecutorBusy
+from .metrics import jobs_finished
+
+# handler(payload, progress) -> result, progress(done, total) reports the advance
+Handler = Callable[[Dict[str, Any], Callable[[int, int], Awaitable[None]]], Awaitable[Any]]
+
+SCHEMA: str = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    status TEXT NOT NULL,
+    payload TEXT,
+    secret INTEGER NOT NULL DEFAULT 0,
+    result TEXT,
+    error TEXT,
+    done INTEGER NOT NULL DEFAULT 0,
+    total INTEGER NOT NULL DEFAULT 0,
+    created REAL NOT NULL,
+    started REAL,
+    finished REAL
+);
+CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created);
+"""
+
+
+class JobStore:
+    """The jobs and their status, in a SQLite database.
+
+    The database is opened on first use. The secrets of a job (passwords)
+    are never written to it, only the rest of its payload. The file is
+    still only readable by its owner, erased data is overwritten
+    (secure_delete) and a payload is erased, with the WAL checkpointed, as
+    soon as its job is finished.
+
+    Functions (Methods):
+        - __init__: Initialize the JobStore class.
+        - create: Record a new queued job.
+        - update: Change some columns of a job.
+        - get: Get a job.
+        - recover: Get the queued jobs and fail the interrupted ones, after a restart.
+        - prune: Delete the jobs finished before a time.
+        - checkpoint: Copy the WAL into the database and truncate it.
+    """
+
+    def __init__(self, path: str):
+        """Initialize JobStore class.
+
+        Args:
+            path (str): The path of the database file.
+        """
+        self.path: str = path
+        self._connection: Optional[sqlite3.Connection] = None
+        self._lock: threading.Lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+            # Created private, it may hold passwords until the jobs run
+            os.close(os.open(self.path, os.O_WRONLY | os.O_CREAT, 0o600))
+
+            connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            connection.row_factory = sqlite3.Row
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("PRAGMA secure_delete=ON")
+            connection.executescript(SCHEMA)
+            self._connection = connection
+        return self._connection
+
+    def _execute(self, query: str, parameters: tuple = ()) -> List[sqlite3.Row]:
+        with self._lock:
+            return self._connect().execute(query, parameters).fetchall()
+
+    def create(self, job_id: str, kind: str, payload: Dict[str, Any], secret: bool = False) -> None:
+        """Record a new queued job, secret tells it has secrets kept out of the database."""
+        self._execute("INSERT INTO jobs (id, kind, status, payload, secret, created) VALUES (?, ?, 'queued', ?, ?, ?)",
+                      (job_id, kind, json.dumps(payload), int(secret), time.time()))
+
+    def update(self, job_id: str, **columns: Any) -> None:
+        """Change some columns of a job."""
+        assignments = ", ".join(f"{column} = ?" for column in columns)
+        self._execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*columns.values(), job_id))
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Get a job.
+
+        Returns:
+            dict: id, kind, status, progress, result, error and the times, None if unknown.
+        """
+        rows = self._execute("SELECT id, kind, status, result, error, done, total, created, started, finished "
+                             "FROM jobs WHERE id = ?", (job_id,))
+        if not rows:
+            return None
+
+        row = rows[0]
+        return {
+            "id": row["id"],
+            "kind": row["kind"],
+            "status": row["status"],
+            "progress": {"done": row["done"], "total": row["total"]},
+            "result": json.loads(row["result"]) if row["result"] else None,
+            "error": row["error"],
+            "created": row["created"],
+            "started": row["started"],
+            "finished": row["finished"],
+        }
+
+    def recover(self) -> List[Tuple[str, str, Dict[str, Any], bool]]:
+        """Get the queued jobs and fail the interrupted ones, after a restart.
+
+        A job that was running may have been applied in part, it is not run
+        again.
+
+        Returns:
+            list: The (id, kind, payload, secret) of the queued jobs, oldest first.
+        """
+        self._execute("UPDATE jobs SET status = 'failed', error = 'Interrupted by a restart of the backend', "
+                      "payload = NULL, finished = ? WHERE status = 'running'", (time.time(),))
+        rows = self._execute("SELECT id, kind, payload, secret FROM jobs WHERE status = 'queued' ORDER BY created")
+        return [(row["id"], row["kind"], json.loads(row["payload"] or "{}"), bool(row["secret"])) for row in rows]
+
+    def prune(self, before: float) -> None:
+        """Delete the jobs finished before a time."""
+        self._execute("DELETE FROM jobs WHERE finished IS NOT NULL AND finished < ?", (before,))
+
+    def checkpoint(self) -> None:
+        """Copy the WAL into the database and truncate it, so no erased payload is left in it."""
+        self._execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+
+class JobQueue:
+    """A bounded pool of workers running the jobs of the store.
+
+    A submitted job is recorded as queued and answered with its id right
+    away; ``concurrency`` workers run the jobs in order of submission. The
+    workers start with the first submission or with start(), which also
+    requeues the jobs left queued by a previous run.
+
+    Functions (Methods):
+        - __init__: Initialize the JobQueue class.
+        - register: Set the handler of a kind of job.
+        - start: Start the workers and requeue the pending jobs.
+        - submit: Queue a job.
+        - get: Get the status of a job.
+        - stop: Stop the workers.
+    """
+
+    def __init__(self, store: JobStore, concurrency: int = 2, queue_size: int = 1000,
+                 retention: float = 7 * 86400):
+        """Initialize JobQueue class.
+
+        Args:
+            store (JobStore): Where the jobs are recorded.
+            concurrency (int): Number of jobs run at the same time (default is 2).
+            queue_size (int): Maximum number of queued jobs (default is 1000).
+            retention (float): Seconds a finished job is kept (default is 7 days).
+        """
+        self.store: JobStore = store
+        self.concurrency: int = concurrency
+        self.queue_size: int = queue_size
+        self.retention: float = retention
+        self._handlers: Dict[str, Handler] = {}
+        # Job id -> the secrets of its payload, only ever kept in memory
+        self._secrets: Dict[str, Dict[str, Any]] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._workers: List[asyncio.Task] = []
+
+    def register(self, kind: str, handler: Handler) -> None:
+        """Set the handler of a kind of job.
+
+        Args:
+            kind (str): The kind of job.
+            handler (callable): Coroutine function (payload, progress) -> JSON serializable result.
+        """
+        self._handlers[kind] = handler
+
+    def _recover(self) -> List[Tuple[str, str, Dict[str, Any]]]:
+        self.store.prune(time.time() - self.retention)
+        pending = []
+        for job_id, kind, payload, secret in self.store.recover():
+            if secret and job_id not in self._secrets:
+                # Its secrets were lost with the previous run
+                self.store.update(job_id, status="failed", payload=None, finished=time.time(),
+                                  error="Interrupted by a restart of the backend, its passwords were only kept in memory")
+            else:
+                pending.append((job_id, kind, payload))
+        return pending
+
+    async def start(self) -> None:
+        """Start the workers and requeue the pending jobs."""
+        if self._queue is not None:
+            return
+
+        pending = await asyncio.to_thread(self._recover)
+        # Started by another caller in the meantime
+        if self._queue is not None:
+            return
+
+        self._queue = asyncio.Queue()
+        for job in pending:
+            self._queue.put_nowait(job)
+        self._workers = [asyncio.create_task(self._work()) for _ in range(self.concurrency)]
+
+    async def submit(self, kind: str, payload: Dict[str, Any], secrets: Optional[Dict[str, Any]] = None) -> str:
+        """Queue a job.
+
+        Args:
+            kind (str): The kind of job, with a registered handler.
+            payload (dict): The JSON serializable arguments of the handler.
+            secrets (dict, optional): More arguments, merged in the payload but
+                                      never written to the database (passwords).
+
+        Returns:
+            str: The id of the job.
+
+        Raises:
+            ExecutorBusy: When the queue is full.
+        """
+        if kind not in self._handlers:
+            raise ValueError(f"Unknown kind of job: {kind}")
+
+        await self.start()
+        if self._queue.qsize() >= self.queue_size:
+            raise ExecutorBusy("Too many queued jobs", status_code=429, retry_after=10)
+
+        job_id = uuid.uuid4().hex
+        await asyncio.to_thread(self.store.create, job_id, kind, payload, bool(secrets))
+        if secrets:
+            self._secrets[job_id] = secrets
+        self._queue.put_nowait((job_id, kind, payload))
+        return job_id
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Get the status of a job.
+
+        Returns:
+            dict: The job (see JobStore.get), None if unknown.
+        """
+        job = await asyncio.to_thread(self.store.get, job_id)
+        if job is not None and job["status"] == "queued" and self._queue is not None:
+            job["queued"] = self._queue.qsize()
+        return job
+
+    async def _run(self, job_id: str, kind: str, payload: Dict[str, Any]) -> None:
+        last_report = 0.0
+        payload = {**payload, **self._secrets.pop(job_id, {})}
+
+        async def progress(done: int, total: int) -> None:
+            nonlocal last_report
+            # At most two writes per second, whatever the pace of the job
+            if time.monotonic() - last_report >= 0.5 or done >= total:
+                last_report = time.monotonic()
+                await asyncio.to_thread(self.store.update, job_id, done=done, total=total)
+
+        await asyncio.to_thread(self.store.update, job_id, status="running", started=time.time())
+        try:
+            result = await self._handlers[kind](payload, progress)
+            status = "succeeded" if not (isinstance(result, dict) and result.get("status", 200) not in (0, 200)) \
+                else "failed"
+            await asyncio.to_thread(self.store.update, job_id, status=status, result=json.dumps(result),
+                                    payload=None, finished=time.time())
+        except Exception as e:
+            status = "failed"
+            await asyncio.to_thread(self.store.update, job_id, status=status, error=str(e) or type(e).__name__,
+                                    payload=None, finished=time.time())
+        jobs_finished.inc(kind, status)
+        await asyncio.to_thread(self.store.checkpoint)
+
+    async def _work(self) -> None:
+        while True:
+            job_id, kind, payload = await self._queue.get()
+            try:
+                await self._run(job_id, kind, payload)
+            except Exception:
+                # The store failed: the job stays as recorded, the worker goes on
+                pass
+            finally:
+                self._queue.task_done()
+
+    async def stop(self) -> None:
+        """Stop the workers, the queued jobs are run again by the next start."""
+        for worker in self._workers:
+            worker.cancel()
+        for worker in self._workers:
+            try:
+                await worker
+            except asyncio.CancelledError:
+                pass
+        self._workers = []
+        self._queue = None
+
+
+jobs: JobQueue = JobQueue(
+    JobStore(os.environ.get("SYSMANAGE_JOBS_DB", "/var/lib/sysmanage/jobs.sqlite3")),
+    concurrency=int(os.environ.get("SYSMANAGE_JOBS_CONCURRENCY", 2)),
+    retention=float(os.environ.get("SYSMANAGE_JOBS_RETENTION", 7 * 86400)),
+)
@@ -1,5 +1,21 @@
-from .system import execute
-from typing import List, Dict, Any
+import asyncio
+import weakref
+from .system import execute, ExecutorBusy
+from .accounts import accounts, parse_group
+from .backends import account_backend
+from .nss import user_exists, user_groups
+from typing import List, Optional
+
+# One lock per group, held from the read of its member list to the rewrite
+_group_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+
+def _group_lock(groupname: str) -> asyncio.Lock:
+    lock = _group_locks.get(groupname)
+    if lock is None:
+        lock = _group_locks[groupname] = asyncio.Lock()
+    return lock
+
 
 class Member:
     """Utility class for managing group members.
@@ -10,6 +26,10 @@ class Member:
         - add_member_to_group: Add a user to a group.
         - remove_member_from_group: Remove a user from a group.
         - get_group_members: Get all members of a group.
+        - get_user_groups: Get all groups of a user.
+        - set_group_members: Replace the member list of a group in one operation.
+        - add_members_to_group: Add many users to a group in one operation.
+        - remove_members_from_group: Remove many users from a group in one operation.
     """
 
     @staticmethod
@@ -24,7 +44,11 @@ class Member:
             dict: A dictionary containing status, message, error, and stdout.
         """
         try:
-            output, error, status = await execute(f"usermod -aG {groupname} {username}")
+            output, error, status = await account_backend.add_member(groupname, username)
+            if status == 0:
+                accounts.update_members(groupname, added=[username])
+            else:
+                accounts.invalidate("group")
             if status == 0:
                 return {
                     "status": 200,
@@ -39,12 +63,15 @@ class Member:
                     "error": error,
                     "stdout": output
                 }
+        except ExecutorBusy:
+            raise
         except Exception as e:
+            # The command may have failed before output and error were set
             return {
                 "status": 501,
                 "message": str(e),
-                "error": error,
-                "stdout": output
+                "error": str(e),
+                "stdout": ""
             }
 
     @staticmethod
@@ -59,7 +86,11 @@ class Member:
             dict: A dictionary containing status, message, error, and stdout.
         """
         try:
-            output, error, status = await execute(f"gpasswd -d {username} {groupname}")
+            output, error, status = await account_backend.remove_member(groupname, username)
+            if status == 0:
+                accounts.update_members(groupname, removed=[username])
+            else:
+                accounts.invalidate("group")
             if status == 0:
                 return {
                     "status": 200,
@@ -74,23 +105,195 @@ class Member:
                     "error": error,
                     "stdout": output
                 }
+        except ExecutorBusy:
+            raise
         except Exception as e:
+            # The command may have failed before output and error were set
             return {
                 "status": 501,
                 "message": str(e),
-                "error": error,
-                "stdout": output
+                "error": str(e),
+                "stdout": ""
             }
     
     @staticmethod
     async def get_group_members(groupname: str) -> List[str]:
         """Get all members of a group."""
         try:
-            output, error, status = await execute(f"getent group {groupname}")
-            if status == 0:
-                parts = output.split(":")
-                if len(parts) >= 4:
-                    return parts[3].split(",")
+            entry = await accounts.group(groupname)
+
+            if entry is None:
+                # Not a local group, ask NSS (LDAP, SSSD, ...)
+                output, error, status = await execute(f"getent group {groupname}")
+                if status != 0:
+                    return []
+                entry = parse_group(output).get(groupname)
+                if entry is None:
+                    return []
+
+            return entry.members
+        except ExecutorBusy:
+            raise
+        except Exception:
             return []
+
+    @staticmethod
+    async def get_user_groups(username: str) -> Optional[List[str]]:
+        """Get all groups of a user, primary group first.
+
+        Args:
+            username (str): The name of the user.
+
+        Returns:
+            list: The names of the groups, None if the user does not exist.
+        """
+        if await accounts.user(username) is not None:
+            return (await accounts.memberships()).groups_of(username)
+
+        # Not a local account, ask NSS (LDAP, SSSD, ...)
+        return await asyncio.to_thread(user_groups, username)
+
+    @staticmethod
+    async def set_group_members(groupname: str, usernames: List[str]) -> dict:
+        """Replace the member list of a group in one operation.
+
+        The group file is rewritten once, whatever the number of users.
+
+        Args:
+            groupname (str): The name of the group.
+            usernames (list): The complete list of members.
+
+        Returns:
+            dict: A dictionary containing status, message, error, and stdout.
+        """
+        output, error, status = await account_backend.set_members(groupname, usernames)
+        if status == 0:
+            accounts.set_members(groupname, usernames)
+        else:
+            accounts.invalidate("group")
+
+        if status == 0:
+            return {
+                "status": 200,
+                "message": f"The members of the group {groupname} were successfully updated.",
+                "error": error,
+                "stdout": output
+            }
+        else:
+            return {
+                "status": 500,
+                "message": f"Failed to update the members of the group {groupname}.",
+                "error": error,
+                "stdout": output
+            }
+
+    @staticmethod
+    async def _change_group_members(groupname: str, added: List[str], removed: List[str]) -> dict:
+        """Apply the additions and removals to the current member list of a group."""
+        output, error, status = await account_backend.change_members(groupname, added, removed)
+        if status == 0:
+            accounts.update_members(groupname, added=added, removed=removed)
+        else:
+            accounts.invalidate("group")
+        return {"status": 200 if status == 0 else 500, "error": error, "stdout": output}
+
+    @staticmethod
+    async def _user_exists(username: str) -> bool:
+        if await accounts.user(username) is not None:
+            return True
+        # Not a local account, ask NSS (LDAP, SSSD, ...)
+        return await asyncio.to_thread(user_exists, username)
+
+    @staticmethod
+    async def add_members_to_group(groupname: str, usernames: List[str]) -> dict:
+        """Add many users to a group in one operation.
+
+        The users to add are checked first and applied with a single rewrite
+        of the group file. Unknown users are reported as failed and left out,
+        so they can not make the whole operation fail. The changes of a group
+        are serialized, from the read of its members to the rewrite.
+
+        Args:
+            groupname (str): The name of the group.
+            usernames (list): The names of the users to add.
+
+        Returns:
+            dict: A dictionary containing status, success_users, failed_users, error, and stdout.
+        """
+        try:
+            async with _group_lock(groupname):
+                members = await Member.get_group_members(groupname)
+                success_users: List[str] = []
+                failed_users: List[str] = []
+
+                for username in usernames:
+                    if username in members or username in success_users:
+                        success_users.append(username)
+                    elif await Member._user_exists(username):
+                        success_users.append(username)
+                    else:
+                        failed_users.append(username)
+
+                added = [username for username in dict.fromkeys(success_users) if username not in members]
+                if not added:
+                    result = {"status": 200, "error": "", "stdout": ""}
+                else:
+                    result = await Member._change_group_members(groupname, added, [])
+
+            if result["status"] != 200:
+                failed_users = list(usernames)
+                success_users = []
+
+            return {
+                "status": 200 if not failed_users else 500,
+                "success_users": success_users,
+                "failed_users": failed_users,
+                "error": result["error"],
+                "stdout": result["stdout"]
+            }
+        except ExecutorBusy:
+            raise
         except Exception as e:
-            return []
+            return {"status": 501, "message": str(e), "success_users": [], "failed_users": list(usernames)}
+
+    @staticmethod
+    async def remove_members_from_group(groupname: str, usernames: List[str]) -> dict:
+        """Remove many users from a group in one operation.
+
+        The removals are applied with a single rewrite of the group file.
+        Users that are not members are reported as failed. The changes of a
+        group are serialized, from the read of its members to the rewrite.
+
+        Args:
+            groupname (str): The name of the group.
+            usernames (list): The names of the users to remove.
+
+        Returns:
+            dict: A dictionary containing status, success_users, failed_users, error, and stdout.
+        """
+        try:
+            async with _group_lock(groupname):
+                members = await Member.get_group_members(groupname)
+                success_users = [username for username in usernames if username in members]
+                failed_users = [username for username in usernames if username not in members]
+
+                if not success_users:
+                    result = {"status": 200, "error": "", "stdout": ""}
+                else:
+                    result = await Member._change_group_members(groupname, [], list(dict.fromkeys(success_users)))
+
+            if result["status"] != 200:
+                failed_users = list(usernames)
+                success_users = []
+
+            return {
+                "status": 200 if not failed_users else 500,
+                "success_users": success_users,
+                "failed_users": failed_users,
+                "error": result["error"],
+                "stdout": result["stdout"]
+            }
+        except ExecutorBusy:
+            raise
+        except Exception as e:
+            return {"status": 501, "message": str(e), "success_users": [], "failed_users": list(usernames)}
@@ -0,0 +1,257 @@
+####################################################################################
+# Author: Djetic Alexandre
+# Description: This module contains a lightweight metrics registry exposed in
+#              the Prometheus text format
+####################################################################################
+
+import bisect
+import math
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+DEFAULT_BUCKETS: Tuple[float, ...] = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0
+)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """Base of the metrics: a name, a help text and label names.
+
+    Functions (Methods):
+        - __init__: Initialize the Metric class.
+        - render: Get the metric in the Prometheus text format.
+    """
+
+    kind: str = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        """Initialize Metric class.
+
+        Args:
+            name (str): The name of the metric.
+            documentation (str): The help text of the metric.
+            labels (sequence): The label names.
+        """
+        self.name: str = name
+        self.documentation: str = documentation
+        self.labels: Tuple[str, ...] = tuple(labels)
+
+    def _samples(self) -> List[str]:
+        return []
+
+    def render(self) -> str:
+        """Get the metric in the Prometheus text format."""
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class Value(Metric):
+    """A metric holding one value per label values, or reading them from a function.
+
+    Functions (Methods):
+        - inc: Increment the value of some label values.
+        - get: Get the value of some label values.
+        - set_function: Read the values from a function when rendered.
+    """
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._function: Optional[Callable[[], Dict[Tuple[str, ...], float]]] = None
+
+    def inc(self, *values: str, amount: float = 1) -> None:
+        """Increment the value of some label values."""
+        self._values[values] = self._values.get(values, 0) + amount
+
+    def get(self, *values: str) -> float:
+        """Get the value of some label values."""
+        return self._values.get(values, 0)
+
+    def set_function(self, function: Callable[[], Dict[Tuple[str, ...], float]]) -> None:
+        """Read the values from a function when rendered.
+
+        Args:
+            function (callable): Returns label values -> value.
+        """
+        self._function = function
+
+    def _samples(self) -> List[str]:
+        values = self._function() if self._function is not None else self._values
+        return [f"{self.name}{_format_labels(self.labels, labels)} {_format_value(value)}"
+                for labels, value in values.items()]
+
+
+class Counter(Value):
+    """A value that only goes up."""
+
+    kind = "counter"
+
+
+class Gauge(Value):
+    """A value that goes up and down.
+
+    Functions (Methods):
+        - dec: Decrement the gauge of some label values.
+        - set: Set the gauge of some label values.
+    """
+
+    kind = "gauge"
+
+    def dec(self, *values: str, amount: float = 1) -> None:
+        """Decrement the gauge of some label values."""
+        self._values[values] = self._values.get(values, 0) - amount
+
+    def set(self, value: float, *values: str) -> None:
+        """Set the gauge of some label values."""
+        self._values[values] = value
+
+
+class Histogram(Metric):
+    """A distribution of observations in cumulative buckets.
+
+    Functions (Methods):
+        - observe: Record an observation for some label values.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets: Tuple[float, ...] = tuple(sorted(buckets))
+        # label values -> [per bucket counts (+Inf last), sum]
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, *values: str) -> None:
+        """Record an observation for some label values."""
+        series = self._series.get(values)
+        if series is None:
+            series = self._series[values] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def _samples(self) -> List[str]:
+        lines: List[str] = []
+
+        for values, (counts, total) in self._series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                labels = _format_labels(self.labels, values, f'le="{_format_value(bound)}"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labels, values)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+
+        return lines
+
+
+class Registry:
+    """The set of metrics exposed by the backend.
+
+    Updating a metric is a dict lookup and an addition, so the metrics can be
+    left on in production; the text is only built when scraped.
+
+    Functions (Methods):
+        - __init__: Initialize the Registry class.
+        - counter, gauge, histogram: Create and register a metric.
+        - render: Get every metric in the Prometheus text format.
+    """
+
+    def __init__(self):
+        """Initialize Registry class."""
+        self._metrics: Dict[str, Metric] = {}
+
+    def _register(self, metric: Metric) -> Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Duplicate metric: {metric.name}")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labels: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(name, documentation, labels))
+
+    def gauge(self, name: str, documentation: str, labels: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labels))
+
+    def histogram(self, name: str, documentation: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labels, buckets))
+
+    def render(self) -> str:
+        """Get every metric in the Prometheus text format."""
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+
+registry: Registry = Registry()
+
+request_duration: Histogram = registry.histogram(
+    "sysmanage_http_request_duration_seconds",
+    "Time to the first byte of the API responses.",
+    ("method", "route", "status"),
+)
+
+command_spawn_duration: Histogram = registry.histogram(
+    "sysmanage_command_spawn_seconds",
+    "Time to spawn a subprocess.",
+    ("class", "command"),
+)
+
+command_run_duration: Histogram = registry.histogram(
+    "sysmanage_command_run_seconds",
+    "Time from the spawn to the exit of a subprocess.",
+    ("class", "command"),
+)
+
+command_exits: Counter = registry.counter(
+    "sysmanage_command_exits_total",
+    "Subprocesses by exit code, -1 when it could not run or timed out.",
+    ("class", "command", "code"),
+)
+
+command_timeouts: Counter = registry.counter(
+    "sysmanage_command_timeouts_total",
+    "Subprocesses that exceeded their timeout.",
+    ("class", "command"),
+)
+
+commands_in_flight: Gauge = registry.gauge(
+    "sysmanage_commands_in_flight",
+    "Subprocesses currently running.",
+    ("class",),
+)
+
+cache_lookups: Counter = registry.counter(
+    "sysmanage_cache_lookups_total",
+    "Lookups of the in-memory caches, the hit ratio is hit / (hit + miss).",
+    ("cache", "result"),
+)
+
+jobs_finished: Counter = registry.counter(
+    "sysmanage_jobs_finished_total",
+    "Background jobs by kind and final status.",
+    ("kind", "status"),
+)
+
+home_files_copied: Counter = registry.counter(
+    "sysmanage_home_files_copied_total",
+    "Skeleton files copied in the new home directories, by copy method.",
+    ("method",),
+)
@@ -0,0 +1,212 @@
+####################################################################################
+# Author: Djetic Alexandre
+# Description: This module enumerates the users and groups through NSS, so the
+#              directory accounts (LDAP, SSSD, systemd-homed) are listed too
+#
+# The enumeration uses the pwd/grp modules, that is the nsswitch.conf of the
+# host. SSSD only enumerates when `enumerate = true` is set in its domain.
+# To try it without a directory, run the backend under nss_wrapper:
+#
+#   LD_PRELOAD=libnss_wrapper.so NSS_WRAPPER_PASSWD=/tmp/passwd \
+#   NSS_WRAPPER_GROUP=/tmp/group SYSMANAGE_ACCOUNT_SOURCE=nss python app.py
+####################################################################################
+
+import asyncio
+import grp
+import os
+import pwd
+import sys
+import time
+import zlib
+from array import array
+from typing import Callable, Dict, Any, List, Optional, Tuple
+from .records import UserRecord, GroupRecord, names
+from .metrics import cache_lookups
+
+
+def enumerate_users() -> Tuple[Dict[str, UserRecord], int]:
+    """Enumerate the users of every NSS source.
+
+    Returns:
+        tuple: username -> user record, and a checksum of the entries.
+    """
+    users: Dict[str, UserRecord] = {}
+    checksum = 0
+    intern = sys.intern
+
+    for entry in pwd.getpwall():
+        # The first source listing a name wins, as for getent
+        if entry.pw_name in users:
+            continue
+        users[entry.pw_name] = UserRecord(
+            entry.pw_name, entry.pw_uid, entry.pw_gid, entry.pw_gecos, entry.pw_dir, intern(entry.pw_shell)
+        )
+        checksum = zlib.crc32(":".join(map(str, entry)).encode(), checksum)
+
+    return users, checksum
+
+
+def enumerate_groups() -> Tuple[Dict[str, GroupRecord], int]:
+    """Enumerate the groups of every NSS source.
+
+    Returns:
+        tuple: group name -> group record, and a checksum of the entries.
+    """
+    groups: Dict[str, GroupRecord] = {}
+    checksum = 0
+    intern = sys.intern
+    name_id = names.id
+
+    for entry in grp.getgrall():
+        if entry.gr_name in groups:
+            continue
+        groups[entry.gr_name] = GroupRecord(
+            entry.gr_name, intern(entry.gr_passwd or ""), entry.gr_gid,
+            array("I", [name_id(member) for member in entry.gr_mem])
+        )
+        checksum = zlib.crc32(f"{entry.gr_name}:{entry.gr_gid}:{','.join(entry.gr_mem)}".encode(), checksum)
+
+    return groups, checksum
+
+
+def user_exists(username: str) -> bool:
+    """Check a user through NSS (LDAP, SSSD, ...), as `getent passwd` does."""
+    try:
+        pwd.getpwnam(username)
+    except KeyError:
+        return False
+    return True
+
+
+def user_groups(username: str) -> Optional[List[str]]:
+    """Get the groups of a user through NSS, primary group first, as `id -Gn` does.
+
+    Returns:
+        list: The names of the groups (the gid when it has no name), None if the user does not exist.
+    """
+    try:
+        entry = pwd.getpwnam(username)
+    except KeyError:
+        return None
+
+    groups: List[str] = []
+    for gid in dict.fromkeys([entry.pw_gid] + os.getgrouplist(username, entry.pw_gid)):
+        try:
+            groups.append(grp.getgrgid(gid).gr_name)
+        except KeyError:
+            groups.append(str(gid))
+    return groups
+
+
+class NssSnapshot:
+    """An NSS enumeration kept in memory for a while.
+
+    Enumerating a directory is slow, so a snapshot is reused for ``ttl``
+    seconds. Once it expired the stale snapshot is still served while a new
+    one is taken in a worker thread; only the first load and the loads
+    following an invalidation wait for the enumeration.
+
+    It is interchangeable with an AccountFile in the account database.
+
+    Functions (Methods):
+        - __init__: Initialize the NssSnapshot class.
+        - load: Get the entries, enumerating again if the snapshot is missing.
+        - adopt: Refuse in-place updates, the snapshot is taken again instead.
+        - invalidate: Force the next load to enumerate again.
+    """
+
+    def __init__(self, enumerate: Callable[[], Tuple[Dict[str, Any], int]], ttl: float = 60.0,
+                 name: str = "nss"):
+        """Initialize NssSnapshot class.
+
+        Args:
+            enumerate (callable): Function returning the entries and their checksum.
+            ttl (float): Lifetime of a snapshot in seconds (default is 60 seconds).
+            name (str): The name of the snapshot in the metrics (default is nss).
+        """
+        self._enumerate = enumerate
+        self._name: str = name
+        self._ttl: float = ttl
+        self._entries: Dict[str, Any] = {}
+        self._signature: Optional[Tuple[int, int, int]] = None
+        # Signature of the entries held, kept across invalidations
+        self._last: Optional[Tuple[int, int, int]] = None
+        self._taken: float = 0.0
+        self._refresh: Optional[asyncio.Task] = None
+        self.generation: int = 0
+        self._epoch: int = 0
+        self._lock: asyncio.Lock = asyncio.Lock()
+
+    async def _take(self) -> None:
+        """Take a new snapshot, the lock must be held."""
+        epoch = self._epoch
+        previous = self._last
+        entries, checksum = await asyncio.to_thread(self._enumerate)
+        self._taken = time.monotonic()
+
+        if previous is not None and previous[0] == checksum and previous[2] == len(entries):
+            # Nothing changed: keep the entries, the generation and the validators
+            signature = previous
+        else:
+            self._entries = entries
+            self.generation += 1
+            # Same shape as a file signature: the "mtime" is the time of the snapshot
+            signature = self._last = (checksum, time.time_ns(), len(entries))
+
+        # An invalidation during the enumeration may not be covered by it
+        if epoch == self._epoch:
+            self._signature = signature
+
+    async def _refresh_in_background(self) -> None:
+        try:
+            async with self._lock:
+                await self._take()
+        except Exception:
+            # Keep serving the stale snapshot, retried after the next ttl
+            pass
+
+    async def load(self) -> Dict[str, Any]:
+        """Get the entries, enumerating again if the snapshot is missing.
+
+        An expired snapshot is returned as is while it is refreshed in the
+        background.
+
+        Returns:
+            dict: The entries of the snapshot.
+        """
+        if self._signature is None:
+            async with self._lock:
+                if self._signature is None:
+                    cache_lookups.inc(self._name, "miss")
+                    await self._take()
+                    return self._entries
+        cache_lookups.inc(self._name, "hit")
+
+        if time.monotonic() - self._taken > self._ttl and (self._refresh is None or self._refresh.done()):
+            self._taken = time.monotonic()
+            self._refresh = asyncio.create_task(self._refresh_in_background())
+
+        return self._entries
+
+    @property
+    def cached(self) -> Dict[str, Any]:
+        """The entries of the last snapshot."""
+        return self._entries
+
+    @property
+    def signature(self) -> Optional[Tuple[int, int, int]]:
+        """The (checksum, time, size) of the last snapshot."""
+        return self._signature
+
+    def adopt(self) -> bool:
+        """Refuse in-place updates, the change may not even be visible through NSS yet.
+
+        Returns:
+            bool: Always False.
+        """
+        return False
+
+    def invalidate(self) -> None:
+        """Force the next load to enumerate again."""
+        self._epoch += 1
+        self._signature = None
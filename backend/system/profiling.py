@@ -0,0 +1,127 @@
+####################################################################################
+# Author: Djetic Alexandre
+# Description: This module profiles a single request of the backend, with
+#              pyinstrument when it is installed, cProfile otherwise
+####################################################################################
+
+import cProfile
+import html
+import io
+import pstats
+from typing import List, Optional
+
+try:
+    from pyinstrument import Profiler as _Pyinstrument
+    from pyinstrument.renderers import HTMLRenderer
+except ImportError:
+    _Pyinstrument = None
+
+FORMATS: dict = {"html": "text/html; charset=utf-8", "collapsed": "text/plain; charset=utf-8",
+                 "text": "text/plain; charset=utf-8"}
+EXTENSIONS: dict = {"html": "html", "collapsed": "folded", "text": "txt"}
+
+
+def _frame_name(function: str, path: str, line: Optional[int]) -> str:
+    # ";" separates the frames of a collapsed stack
+    return f"{function} ({path}:{line})".replace(";", ":") if line else function.replace(";", ":")
+
+
+class RequestProfiler:
+    """Profile of the handling of one request.
+
+    pyinstrument samples the call stack of the request task only and records
+    the time spent awaiting (subprocesses, threads) as "[await]" frames, so
+    spawn, waiting and serialization time show up side by side. Without it,
+    cProfile traces every call of the event loop thread while the request is
+    profiled.
+
+    Functions (Methods):
+        - __init__: Initialize the RequestProfiler class.
+        - start: Start profiling.
+        - stop: Stop profiling.
+        - render: Get the profile as HTML, collapsed stacks or text.
+    """
+
+    def __init__(self, interval: float = 0.0005):
+        """Initialize RequestProfiler class.
+
+        Args:
+            interval (float): Sampling interval of pyinstrument in seconds (default is 0.5 ms).
+        """
+        self.engine: str = "pyinstrument" if _Pyinstrument is not None else "cProfile"
+        if _Pyinstrument is not None:
+            self._profiler = _Pyinstrument(interval=interval, async_mode="enabled")
+        else:
+            self._profiler = cProfile.Profile()
+
+    def start(self) -> None:
+        """Start profiling."""
+        if self.engine == "pyinstrument":
+            self._profiler.start()
+        else:
+            self._profiler.enable()
+
+    def stop(self) -> None:
+        """Stop profiling."""
+        if self.engine == "pyinstrument":
+            self._profiler.stop()
+        else:
+            self._profiler.disable()
+
+    def _collapsed_pyinstrument(self) -> str:
+        lines: List[str] = []
+        root = self._profiler.last_session.root_frame() if self._profiler.last_session else None
+
+        def walk(frame, stack: str) -> None:
+            stack = f"{stack};{_frame_name(frame.function, frame.file_path_short, frame.line_no)}" \
+                if stack else _frame_name(frame.function, frame.file_path_short, frame.line_no)
+            # Samples are reported in microseconds
+            own = round(frame.total_self_time * 1e6)
+            if own > 0:
+                lines.append(f"{stack} {own}")
+            for child in frame.children:
+                walk(child, stack)
+
+        if root is not None:
+            walk(root, "")
+        return "\n".join(lines) + "\n"
+
+    def _collapsed_cprofile(self) -> str:
+        # cProfile keeps the caller -> callee edges only, not whole stacks
+        lines: List[str] = []
+        stats = pstats.Stats(self._profiler).stats
+
+        for (path, line, function), (_, _, own, _, callers) in stats.items():
+            callee = _frame_name(function, path, line)
+            if not callers:
+                lines.append(f"{callee} {round(own * 1e6)}")
+            for (caller_path, caller_line, caller_function), edge in callers.items():
+                # The own time of the callee when called from this caller
+                lines.append(f"{_frame_name(caller_function, caller_path, caller_line)};{callee} {round(edge[2] * 1e6)}")
+
+        return "\n".join(line for line in lines if not line.endswith(" 0")) + "\n"
+
+    def _text(self) -> str:
+        if self.engine == "pyinstrument":
+            return self._profiler.output_text(unicode=True, show_all=False)
+
+        output = io.StringIO()
+        pstats.Stats(self._profiler, stream=output).sort_stats("cumulative").print_stats(60)
+        return output.getvalue()
+
+    def render(self, format: str) -> str:
+        """Get the profile as HTML, collapsed stacks or text.
+
+        Args:
+            format (str): "html", "collapsed" (for flamegraph.pl or speedscope) or "text".
+
+        Returns:
+            str: The rendered profile.
+        """
+        if format == "collapsed":
+            return self._collapsed_pyinstrument() if self.engine == "pyinstrument" else self._collapsed_cprofile()
+        if format == "html":
+            if self.engine == "pyinstrument":
+                return self._profiler.output(HTMLRenderer())
+            return f"<html><body><pre>{html.escape(self._text())}</pre></body></html>"
+        return self._text()
@@ -0,0 +1,130 @@
+####################################################################################
+# Author: Djetic Alexandre
+# Description: This module contains the helpers shared by the paginated and
+#              filtered listings of users and groups
+####################################################################################
+
+import base64
+import json
+from typing import List, Optional, Sequence, Tuple
+
+# Accounts below this id are system accounts, as in the default login.defs
+HUMAN_ID_MIN: int = 1000
+# nobody / nogroup
+OVERFLOW_ID: int = 65534
+
+
+def encode_cursor(position: int, name: str) -> str:
+    """Build the opaque cursor resuming a listing after an entry.
+
+    Args:
+        position (int): The position of the next entry.
+        name (str): The name of the last entry returned.
+
+    Returns:
+        str: The cursor.
+    """
+    return base64.urlsafe_b64encode(json.dumps([position, name]).encode()).decode()
+
+
+def next_cursor(names: List[str], position: int, limit: Optional[int], count: int) -> Optional[str]:
+    """Build the cursor of the next page of a listing.
+
+    Args:
+        names (list): The ordered names of the listing.
+        position (int): The position following the last entry returned.
+        limit (int, optional): The page size, None if the listing is not paginated.
+        count (int): The number of entries returned.
+
+    Returns:
+        str: The cursor, None on the last page.
+    """
+    if limit is None or count < limit or position >= len(names):
+        return None
+    return encode_cursor(position, names[position - 1])
+
+
+def decode_cursor(cursor: str) -> Tuple[int, str]:
+    """Decode a cursor built by encode_cursor.
+
+    Raises:
+        ValueError: When the cursor is malformed.
+    """
+    try:
+        position, name = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return int(position), str(name)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+def resume_position(names: List[str], cursor: str) -> int:
+    """Find where a listing resumes.
+
+    The cursor remembers the position and the name of the last entry, so the
+    listing resumes after that name even if entries were added or removed
+    before it in the meantime.
+
+    Args:
+        names (list): The ordered names of the listing.
+        cursor (str): The cursor, empty for the first page.
+
+    Returns:
+        int: The position of the first entry to return.
+
+    Raises:
+        ValueError: When the cursor is malformed.
+    """
+    if not cursor:
+        return 0
+
+    position, name = decode_cursor(cursor)
+
+    if 0 < position <= len(names) and names[position - 1] == name:
+        return position
+
+    try:
+        return names.index(name) + 1
+    except ValueError:
+        return min(max(position, 0), len(names))
+
+
+def parse_fields(fields: str, allowed: Sequence[str], default: Sequence[str]) -> List[str]:
+    """Parse a `fields=` projection.
+
+    Args:
+        fields (str): Comma separated list of fields, empty for the default ones.
+        allowed (sequence): The fields that can be requested.
+        default (sequence): The fields returned when none is requested.
+
+    Returns:
+        list: The requested fields.
+
+    Raises:
+        ValueError: When an unknown field is requested.
+    """
+    if not fields:
+        return list(default)
+
+    selected = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = [field for field in selected if field not in allowed]
+
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+
+    return selected
+
+
+def in_range(value: Optional[int], low: Optional[int], high: Optional[int]) -> bool:
+    """Check an id against optional inclusive bounds."""
+    if low is None and high is None:
+        return True
+    if value is None:
+        return False
+    return (low is None or value >= low) and (high is None or value <= high)
+
+
+def id_kind(value: Optional[int]) -> str:
+    """Classify an uid/gid as "system" or "human"."""
+    if value is None or value < HUMAN_ID_MIN or value == OVERFLOW_ID:
+        return "system"
+    return "human"
@@ -0,0 +1,117 @@
+####################################################################################
+# Author: Djetic Alexandre
+# Description: This module contains the compact in-memory records of the
+#              account database
+####################################################################################
+
+import sys
+from array import array
+from dataclasses import dataclass
+from typing import Dict, Iterable, List
+
+import orjson
+
+
+class NameTable:
+    """Interned account names referenced by integer ids.
+
+    Ids are stable for the life of the process, so the member lists of the
+    groups can be stored as arrays of ids. Names are never removed: the table
+    only grows with the number of distinct names ever seen.
+
+    Functions (Methods):
+        - id: Get the id of a name, allocating it if needed.
+        - find: Get the id of a name without allocating it.
+        - names: Get the names of some ids.
+    """
+
+    __slots__ = ("_names", "_ids")
+
+    def __init__(self):
+        self._names: List[str] = []
+        self._ids: Dict[str, int] = {}
+
+    def id(self, name: str) -> int:
+        """Get the id of a name, allocating it if needed."""
+        ident = self._ids.get(name)
+        if ident is None:
+            ident = self._ids[name] = len(self._names)
+            self._names.append(sys.intern(name))
+        return ident
+
+    def find(self, name: str) -> int:
+        """Get the id of a name without allocating it, -1 if it was never seen."""
+        return self._ids.get(name, -1)
+
+    def names(self, ids: Iterable[int]) -> List[str]:
+        """Get the names of some ids."""
+        names = self._names
+        return [names[ident] for ident in ids]
+
+
+names: NameTable = NameTable()
+
+
+def to_int(value: str) -> int:
+    """Convert a uid/gid field, -1 if it is not a number."""
+    try:
+        return int(value)
+    except ValueError:
+        return -1
+
+
+@dataclass(slots=True)
+class UserRecord:
+    """A passwd entry."""
+    username: str
+    uid: int
+    gid: int
+    full_name: str
+    home_dir: str
+    shell: str
+
+
+@dataclass(slots=True)
+class GroupRecord:
+    """A group entry, its members are stored as ids of the name table."""
+    name: str
+    passwd: str
+    gid: int
+    member_ids: array
+
+    @property
+    def members(self) -> List[str]:
+        """The names of the members."""
+        return names.names(self.member_ids)
+
+    @members.setter
+    def members(self, members: List[str]) -> None:
+        self.member_ids = array("I", [names.id(member) for member in members])
+
+
+@dataclass(slots=True)
+class ShadowRecord:
+    """The password ageing metadata of a shadow entry, never the hash."""
+    has_password: bool
+    locked: bool
+    last_change: str
+    min_days: str
+    max_days: str
+    warn_days: str
+    inactive_days: str
+    expire: str
+
+
+def _default(obj):
+    if isinstance(obj, array):
+        return obj.tolist()
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+def dumps(obj) -> bytes:
+    """Serialize to JSON with orjson, records included.
+
+    Records are dataclasses: orjson serializes their slots directly without
+    building an intermediate dict.
+    """
+    return orjson.dumps(obj, default=_default)
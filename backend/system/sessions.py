@@ -0,0 +1,295 @@
+####################################################################################
+# Author: Djetic Alexandre
+# Description: This module indexes the login sessions of the users of the system
+#              from utmp, wtmp and the logind session files
+####################################################################################
+
+import asyncio
+import hashlib
+import mmap
+import os
+import struct
+import time
+from typing import Dict, Any, List, Optional, Tuple
+from .metrics import cache_lookups
+
+# struct utmp of glibc on Linux, 384 bytes
+UTMP_RECORD: struct.Struct = struct.Struct("<h2xi32s4s32s256shhiii16s20x")
+USER_PROCESS: int = 7
+
+
+def _text(raw: bytes) -> str:
+    """Decode a NUL padded utmp field."""
+    return raw.split(b"\0", 1)[0].decode("utf-8", errors="replace")
+
+
+def read_utmp(path: str, offset: int = 0) -> Tuple[List[Tuple[str, str, str, int, int]], int]:
+    """Read the user process records of a utmp/wtmp file.
+
+    The file is memory mapped and only the complete records after ``offset``
+    are decoded, so an append-only wtmp can be followed incrementally.
+
+    Args:
+        path (str): The path of the file.
+        offset (int): The byte offset to start from (default is 0).
+
+    Returns:
+        tuple: (user, tty, host, pid, login time) records and the offset following the last record.
+    """
+    records: List[Tuple[str, str, str, int, int]] = []
+
+    try:
+        file = open(path, "rb")
+    except OSError:
+        return records, offset
+
+    with file:
+        size = os.fstat(file.fileno()).st_size
+        end = offset + (size - offset) // UTMP_RECORD.size * UTMP_RECORD.size
+        if end <= offset:
+            return records, offset
+
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            view = memoryview(mapped)
+            try:
+                for ut_type, pid, line, _, user, host, _, _, _, sec, _, _ in UTMP_RECORD.iter_unpack(view[offset:end]):
+                    if ut_type == USER_PROCESS and user[0]:
+                        records.append((_text(user), _text(line), _text(host), pid, sec))
+            finally:
+                view.release()
+
+    return records, end
+
+
+def read_logind(directory: str) -> List[Dict[str, str]]:
+    """Read the session files of systemd-logind.
+
+    Args:
+        directory (str): The logind sessions directory.
+
+    Returns:
+        list: The key/value content of every user session file.
+    """
+    sessions: List[Dict[str, str]] = []
+
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return sessions
+
+    for name in names:
+        if name.endswith(".ref"):
+            continue
+        try:
+            with open(os.path.join(directory, name)) as file:
+                fields = dict(line.rstrip("\n").split("=", 1) for line in file if "=" in line)
+        except OSError:
+            continue
+
+        # Background (cron) and greeter sessions are not logins
+        if fields.get("USER") and fields.get("CLASS", "user").startswith("user") and fields.get("STATE") != "closing":
+            sessions.append(fields)
+
+    return sessions
+
+
+class LoginIndex:
+    """Index of the login sessions of the system users.
+
+    The active sessions come from utmp, completed by the logind sessions that
+    have no utmp entry (graphical sessions for instance). The last login of
+    every user comes from wtmp, which is followed incrementally: only the
+    records appended since the previous refresh are decoded.
+
+    The sources are only read again when their inode, mtime or size changed,
+    or every ``ttl`` seconds to drop the sessions of crashed processes.
+
+    Functions (Methods):
+        - __init__: Initialize the LoginIndex class.
+        - snapshot: Get the username -> sessions map of the last refresh.
+        - refresh: Rebuild the snapshot without blocking the event loop.
+        - fingerprint: Get a digest of the set of logged in users.
+        - get: Get the sessions of a single user, as of the last refresh.
+        - last_login: Get the last login of a single user, as of the last refresh.
+        - is_login: Check if a user has an active session.
+
+    Only refresh reads the sources, in a thread and under a lock; the other
+    accessors read what the last refresh left.
+    """
+
+    def __init__(self, utmp: str = "/run/utmp", wtmp: str = "/var/log/wtmp",
+                 logind: str = "/run/systemd/sessions", ttl: float = 30.0):
+        """Initialize LoginIndex class.
+
+        Args:
+            utmp (str): The utmp file (default is /run/utmp).
+            wtmp (str): The wtmp file (default is /var/log/wtmp).
+            logind (str): The logind sessions directory (default is /run/systemd/sessions).
+            ttl (float): Maximum lifetime of a snapshot in seconds (default is 30 seconds).
+        """
+        self.utmp: str = utmp
+        self.wtmp: str = wtmp
+        self.logind: str = logind
+        self._ttl: float = ttl
+        self._index: Optional[Dict[str, Dict[str, Any]]] = None
+        self._signature: Optional[tuple] = None
+        self._taken: float = 0.0
+        self._last_logins: Dict[str, Dict[str, Any]] = {}
+        self._wtmp_position: Tuple[int, int] = (0, 0)
+        self._lock: asyncio.Lock = asyncio.Lock()
+
+    @staticmethod
+    def _stat(path: str) -> Optional[Tuple[int, int, int]]:
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return st.st_ino, st.st_mtime_ns, st.st_size
+
+    def _current_signature(self) -> tuple:
+        return self._stat(self.utmp), self._stat(self.wtmp), self._stat(self.logind)
+
+    def _expired(self) -> bool:
+        return self._index is None or time.monotonic() - self._taken > self._ttl or \
+            self._current_signature() != self._signature
+
+    def _follow_wtmp(self) -> None:
+        """Decode the wtmp records appended since the last call."""
+        stat = self._stat(self.wtmp)
+        if stat is None:
+            return
+
+        inode, offset = self._wtmp_position
+        # Rotated or truncated: start over, the known last logins are kept
+        if inode != stat[0] or stat[2] < offset:
+            offset = 0
+
+        records, offset = read_utmp(self.wtmp, offset)
+        for user, tty, host, pid, login_time in records:
+            self._last_logins[user] = {"time": login_time, "tty": tty, "host": host}
+
+        self._wtmp_position = (stat[0], offset)
+
+    @staticmethod
+    def _alive(pid: int) -> bool:
+        # utmp keeps the entries of sessions whose process crashed
+        return pid <= 0 or not os.path.isdir("/proc/self") or os.path.exists(f"/proc/{pid}")
+
+    def _scan(self) -> Dict[str, Dict[str, Any]]:
+        """Read the sources and group the active sessions by user.
+
+        Returns:
+            dict: username -> {"sessions", "ttys", "hosts", "first_seen"}.
+        """
+        self._follow_wtmp()
+
+        index: Dict[str, Dict[str, Any]] = {}
+
+        def add(user: str, tty: str, host: str, pid: int, started: Optional[int], source: str) -> None:
+            entry = index.get(user)
+            if entry is None:
+                entry = index[user] = {"sessions": [], "ttys": [], "hosts": [], "first_seen": None}
+
+            entry["sessions"].append({"tty": tty, "host": host, "pid": pid, "started": started, "source": source})
+            if tty and tty not in entry["ttys"]:
+                entry["ttys"].append(tty)
+            if host and host not in entry["hosts"]:
+                entry["hosts"].append(host)
+            if started and (entry["first_seen"] is None or started < entry["first_seen"]):
+                entry["first_seen"] = started
+
+        records, _ = read_utmp(self.utmp)
+        for user, tty, host, pid, login_time in records:
+            if self._alive(pid):
+                add(user, tty, host, pid, login_time, "utmp")
+
+        for session in read_logind(self.logind):
+            user, tty = session["USER"], session.get("TTY", "")
+            if tty and user in index and tty in index[user]["ttys"]:
+                continue
+            leader = int(session.get("LEADER", 0) or 0)
+            realtime = int(session.get("REALTIME", 0) or 0)
+            add(user, tty, session.get("REMOTE_HOST", ""), leader, realtime // 1_000_000 or None, "logind")
+
+        return index
+
+    def _rebuild(self) -> Dict[str, Dict[str, Any]]:
+        signature = self._current_signature()
+        index = self._scan()
+        self._signature = signature
+        self._taken = time.monotonic()
+        self._index = index
+        return index
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        """Get the username -> sessions map of the last refresh.
+
+        Returns:
+            dict: The cached snapshot, empty before the first refresh.
+        """
+        return self._index or {}
+
+    async def refresh(self) -> Dict[str, Dict[str, Any]]:
+        """Get the current snapshot, reading the sources in a thread if needed.
+
+        Concurrent callers share a single read.
+
+        Returns:
+            dict: The username -> sessions map.
+        """
+        async with self._lock:
+            if self._expired():
+                cache_lookups.inc("sessions", "miss")
+                await asyncio.to_thread(self._rebuild)
+            else:
+                cache_lookups.inc("sessions", "hit")
+        return self._index
+
+    async def fingerprint(self) -> str:
+        """Get a digest of the set of logged in users.
+
+        Returns:
+            str: A digest that changes whenever a user logs in or out.
+        """
+        sessions = await self.refresh()
+        return hashlib.sha1("\n".join(sorted(sessions)).encode()).hexdigest()
+
+    def get(self, username: str) -> Optional[Dict[str, Any]]:
+        """Get the sessions of a single user, as of the last refresh.
+
+        Args:
+            username (str): The username to look up.
+
+        Returns:
+            dict: The sessions of the user or None if they are not logged in.
+        """
+        return self.snapshot().get(username)
+
+    def last_login(self, username: str) -> Optional[Dict[str, Any]]:
+        """Get the last login of a single user, as of the last refresh.
+
+        Args:
+            username (str): The username to look up.
+
+        Returns:
+            dict: The time, tty and host of the last login or None if unknown.
+        """
+        return self._last_logins.get(username)
+
+    async def is_login(self, username: str) -> bool:
+        """Check if a user has an active session.
+
+        Args:
+            username (str): The username to check.
+
+        Returns:
+            bool: True if the user is logged in, False otherwise.
+        """
+        return username in await self.refresh()
+
+
+login_index: LoginIndex = LoginIndex(
+    utmp=os.environ.get("SYSMANAGE_UTMP", "/run/utmp"),
+    wtmp=os.environ.get("SYSMANAGE_WTMP", "/var/log/wtmp"),
+    logind=os.environ.get("SYSMANAGE_LOGIND_SESSIONS", "/run/systemd/sessions"),
+)
@@ -6,33 +6,330 @@
 
 import subprocess
 import asyncio
+import heapq
+import itertools
+import os
+import signal
 import sys
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, Any, List, Optional, Tuple
+from .metrics import (registry, command_spawn_duration, command_run_duration, command_exits,
+                      command_timeouts, commands_in_flight)
 
 
-async def execute(cmd: str, timeout: int = 15) -> tuple:
+# Commands grouped by the resource they contend on. Every shadow-utils writer
+# takes the same lckpwdf lock, so they share the "accounts" class.
+COMMAND_CLASSES: Dict[str, str] = {
+    "cat": "read",
+    "getent": "read",
+    "id": "read",
+    "useradd": "accounts",
+    "userdel": "accounts",
+    "usermod": "accounts",
+    "groupadd": "accounts",
+    "groupdel": "accounts",
+    "gpasswd": "accounts",
+    "passwd": "accounts",
+    "chpasswd": "accounts",
+    "newusers": "accounts",
+    "powershell": "powershell",
+}
+
+# Lower runs first: reads go ahead of writes
+CLASS_PRIORITIES: Dict[str, int] = {"read": 0}
+
+
+class ExecutorBusy(Exception):
+    """Raised when a command can not get an execution slot.
+
+    Attributes:
+        status_code (int): 429 when the queue is full, 503 when the wait timed out.
+        retry_after (int): Suggested delay in seconds before retrying.
+    """
+
+    def __init__(self, message: str, status_code: int, retry_after: int = 1):
+        super().__init__(message)
+        self.status_code: int = status_code
+        self.retry_after: int = retry_after
+
+
+def command_name(cmd: str) -> str:
+    """Get the program run by a shell command.
+
+    Args:
+        cmd (str): The command line.
+
+    Returns:
+        str: The program of the last stage of the pipeline, "" if there is none.
+    """
+    # The last stage of a pipeline is the one doing the work
+    for token in cmd.replace("^", " ").split("|")[-1].split():
+        if token == "sudo" or token.startswith("-"):
+            continue
+        return os.path.basename(token)
+    return ""
+
+
+def command_class(cmd: str) -> str:
+    """Get the class of a shell command.
+
+    Args:
+        cmd (str): The command line.
+
+    Returns:
+        str: The class of the command ("read", "accounts", ...) or "other".
+    """
+    return COMMAND_CLASSES.get(command_name(cmd), "other")
+
+
+class CommandExecutor:
+    """Bounded executor for the subprocesses spawned by the backend.
+
+    At most ``max_concurrency`` commands run at once, and each command class
+    has its own limit on top of that. Commands that can not run right away
+    wait in a priority queue (reads before writes, FIFO otherwise). When the
+    queue is full, or a command waited longer than ``queue_timeout``, an
+    ExecutorBusy error is raised so the API can answer 429/503.
+
+    Functions (Methods):
+        - __init__: Initialize the CommandExecutor class.
+        - slot: Async context manager holding an execution slot.
+        - stats: Get the queue and wait time metrics.
+    """
+
+    def __init__(self, max_concurrency: int = 8, class_limits: Optional[Dict[str, int]] = None,
+                 max_queue: int = 256, queue_timeout: float = 30.0):
+        """Initialize CommandExecutor class.
+
+        Args:
+            max_concurrency (int): Maximum number of running commands (default is 8).
+            class_limits (dict): Maximum number of running commands per class.
+            max_queue (int): Maximum number of waiting commands (default is 256).
+            queue_timeout (float): Maximum wait for a slot in seconds (default is 30 seconds).
+        """
+        self.max_concurrency: int = max_concurrency
+        self.class_limits: Dict[str, int] = class_limits or {}
+        self.max_queue: int = max_queue
+        self.queue_timeout: float = queue_timeout
+
+        self._queue: List[Tuple[int, int, str, asyncio.Future]] = []
+        self._sequence = itertools.count()
+        self._running: int = 0
+        self._running_per_class: Dict[str, int] = {}
+
+        self._waited: int = 0
+        self._wait_total: float = 0.0
+        self._wait_max: float = 0.0
+        self._rejected: int = 0
+        self._timed_out: int = 0
+
+    def _has_room(self, cls: str) -> bool:
+        limit = self.class_limits.get(cls)
+        return self._running < self.max_concurrency and \
+            (limit is None or self._running_per_class.get(cls, 0) < limit)
+
+    def _take(self, cls: str) -> None:
+        self._running += 1
+        self._running_per_class[cls] = self._running_per_class.get(cls, 0) + 1
+
+    def _release(self, cls: str) -> None:
+        self._running -= 1
+        self._running_per_class[cls] -= 1
+        self._wake()
+
+    def _wake(self) -> None:
+        """Hand the free slots to the waiters, in priority order."""
+        for entry in sorted(self._queue):
+            if self._running >= self.max_concurrency:
+                break
+            cls, future = entry[2], entry[3]
+            if not future.done() and self._has_room(cls):
+                self._take(cls)
+                future.set_result(None)
+                self._queue.remove(entry)
+        heapq.heapify(self._queue)
+
+    async def _acquire(self, cls: str) -> None:
+        if len(self._queue) >= self.max_queue:
+            self._rejected += 1
+            raise ExecutorBusy("Too many commands waiting for execution", 429)
+
+        future = asyncio.get_running_loop().create_future()
+        entry = (CLASS_PRIORITIES.get(cls, 1), next(self._sequence), cls, future)
+        heapq.heappush(self._queue, entry)
+        self._wake()
+
+        if future.done():
+            return
+
+        start = time.monotonic()
+
+        try:
+            await asyncio.wait_for(future, timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._queue.remove(entry)
+            heapq.heapify(self._queue)
+            self._timed_out += 1
+            raise ExecutorBusy("Timed out waiting for an execution slot", 503, int(self.queue_timeout))
+        except asyncio.CancelledError:
+            if entry in self._queue:
+                self._queue.remove(entry)
+                heapq.heapify(self._queue)
+            raise
+        finally:
+            waited = time.monotonic() - start
+            self._waited += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+
+    @asynccontextmanager
+    async def slot(self, cmd: str):
+        """Hold an execution slot for a command.
+
+        Args:
+            cmd (str): The command line, used to find its class.
+
+        Raises:
+            ExecutorBusy: When no slot could be obtained.
+        """
+        cls = command_class(cmd)
+        await self._acquire(cls)
+        try:
+            yield
+        finally:
+            self._release(cls)
+
+    def stats(self) -> Dict[str, Any]:
+        """Get the queue and wait time metrics.
+
+        Returns:
+            dict: The executor metrics.
+        """
+        return {
+            "running": self._running,
+            "running_per_class": dict(self._running_per_class),
+            "queue_depth": len(self._queue),
+            "max_concurrency": self.max_concurrency,
+            "class_limits": dict(self.class_limits),
+            "max_queue": self.max_queue,
+            "waited": self._waited,
+            "wait_time_avg": self._wait_total / self._waited if self._waited else 0.0,
+            "wait_time_max": self._wait_max,
+            "rejected": self._rejected,
+            "timed_out": self._timed_out,
+        }
+
+
+executor: CommandExecutor = CommandExecutor(
+    max_concurrency=int(os.environ.get("SYSMANAGE_MAX_PROCS", 8)),
+    class_limits={
+        "accounts": int(os.environ.get("SYSMANAGE_MAX_ACCOUNT_WRITERS", 1)),
+        "powershell": int(os.environ.get("SYSMANAGE_MAX_POWERSHELL", 4)),
+    },
+    max_queue=int(os.environ.get("SYSMANAGE_MAX_QUEUE", 256)),
+    queue_timeout=float(os.environ.get("SYSMANAGE_QUEUE_TIMEOUT", 30)),
+)
+
+registry.gauge("sysmanage_executor_queue_depth", "Commands waiting for an execution slot.").set_function(
+    lambda: {(): executor.stats()["queue_depth"]}
+)
+registry.counter("sysmanage_executor_rejected_total", "Commands rejected because the queue was full.").set_function(
+    lambda: {(): executor.stats()["rejected"]}
+)
+registry.counter("sysmanage_executor_timed_out_total", "Commands that waited too long for a slot.").set_function(
+    lambda: {(): executor.stats()["timed_out"]}
+)
+
+
+async def execute(cmd: str, timeout: int = 15, input: Optional[str] = None) -> tuple:
     """
     Execute a command asynchronously and return its output, error, and status.
 
+    The command first waits for a slot of the shared executor, the timeout
+    only applies once it runs.
+
     Args:
         cmd (str): The command to execute.
         timeout (int): Timeout in seconds (default is 15 seconds).
+        input (str, optional): Data written to the standard input of the command.
 
     Returns:
         tuple: A tuple containing the stdout, stderr, and status code of the command.
+
+    Raises:
+        ExecutorBusy: When the executor queue is full or the wait timed out.
     """
+    async with executor.slot(cmd):
+        return await _execute(cmd, timeout, input)
+
+
+async def _execute(cmd: str, timeout: int, input: Optional[str] = None) -> tuple:
+    name = command_name(cmd)
+    labels = (command_class(cmd), name if name in COMMAND_CLASSES else "other")
+    return await _run(labels, lambda: asyncio.create_subprocess_shell(cmd.replace("^", " "),
+        stdin=subprocess.PIPE if input is not None else None,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        # Its own process group, so a timeout kills the shell and what it started
+        start_new_session=sys.platform != "win32"
+    ), timeout, input.encode() if input is not None else None)
+
+
+async def _kill(process: asyncio.subprocess.Process) -> None:
+    """Kill a command that timed out, with its children, and reap it."""
     try:
-        process = await asyncio.create_subprocess_shell(cmd.replace("^", " "), 
-            stdout=subprocess.PIPE, 
-            stderr=subprocess.PIPE
-        )
-        stdout, stderr = await asyncio.wait_for(process.communicate(), timeout=timeout)
-        return stdout.decode().strip(), stderr.decode().strip(), process.returncode
+        if sys.platform != "win32" and os.getpgid(process.pid) == process.pid:
+            os.killpg(process.pid, signal.SIGKILL)
+        else:
+            process.kill()
+    except ProcessLookupError:
+        pass
+    await process.wait()
+
+
+async def _run(labels: Tuple[str, str], spawn, timeout: int, input: Optional[bytes] = None) -> tuple:
+    """Spawn a subprocess and wait for it, recording its metrics.
+
+    Args:
+        labels (tuple): The class and the program of the command.
+        spawn (callable): Returns the coroutine creating the subprocess.
+        timeout (int): Timeout in seconds.
+        input (bytes, optional): Data written to the standard input of the command.
+
+    Returns:
+        tuple: A tuple containing the stdout, stderr, and status code of the command.
+    """
+    code = -1
+    commands_in_flight.inc(labels[0])
+    start = time.perf_counter()
+
+    try:
+        process = await spawn()
+        spawned = time.perf_counter()
+        command_spawn_duration.observe(spawned - start, *labels)
+
+        try:
+            stdout, stderr = await asyncio.wait_for(process.communicate(input), timeout=timeout)
+        finally:
+            command_run_duration.observe(time.perf_counter() - spawned, *labels)
+
+        code = process.returncode
+        return stdout.decode().strip(), stderr.decode().strip(), code
     except asyncio.TimeoutError:
+        command_timeouts.inc(*labels)
+        # The slot is only released once the command is gone: it may hold
+        # the account lock (useradd, usermod...) the next writer waits for
+        await _kill(process)
         return "", "Command execution timed out", -1
     except subprocess.CalledProcessError as e:
+        code = e.returncode
         return "", str(e), e.returncode
     except Exception as e:
         return "", str(e), -1
+    finally:
+        commands_in_flight.dec(labels[0])
+        command_exits.inc(*labels, str(code))
 
 
 async def exec_powershell(cmd: str, timeout: int = 15) -> tuple:
@@ -45,21 +342,20 @@ async def exec_powershell(cmd: str, timeout: int = 15) -> tuple:
 
     Returns:
         tuple: A tuple containing the stdout, stderr, and status code of the command.
+
+    Raises:
+        ExecutorBusy: When the executor queue is full or the wait timed out.
     """
-    try:
-        process = await asyncio.create_subprocess_shell(
-            f"powershell -Command \"{cmd}\"",
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE
-        )
-        stdout, stderr = await asyncio.wait_for(process.communicate(), timeout=timeout)
-        return stdout.strip().decode(), stderr.strip().decode(), process.returncode
-    except asyncio.TimeoutError:
-        return "", "Command execution timed out", -1
-    except subprocess.CalledProcessError as e:
-        return "", str(e), e.returncode
-    except OSError as e:
-        return "", str(e), -1
+    async with executor.slot("powershell"):
+        return await _exec_powershell(cmd, timeout)
+
+
+async def _exec_powershell(cmd: str, timeout: int) -> tuple:
+    return await _run(("powershell", "powershell"), lambda: asyncio.create_subprocess_shell(
+        f"powershell -Command \"{cmd}\"",
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE
+    ), timeout)
 
 
 def get_os() -> str:
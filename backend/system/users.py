@@ -3,10 +3,19 @@
 # Description: This is a class to manage User of an os_name
 ####################################################################################
 
-import psutil
-from typing import Dict, Any
-from .system import execute, get_os
+from typing import Dict, Any, Iterator, List, Tuple, Optional
+from .system import execute, ExecutorBusy
 from .system_property import SystemProperty
+from .sessions import login_index
+from .accounts import accounts, parse_passwd
+from .query import resume_position, next_cursor, parse_fields, in_range, id_kind
+from .records import UserRecord
+from .backends import account_backend
+
+USER_FIELDS = ("username", "uid", "gid", "full_name", "home_dir", "shell", "login", "groups")
+DEFAULT_USER_FIELDS = ("username", "uid", "gid", "full_name", "home_dir", "shell", "login")
+# Projections of exactly these fields return the passwd records themselves
+RECORD_FIELDS = tuple(UserRecord.__slots__)
 
 class Users(SystemProperty):
     """Module for managing system users.
@@ -23,7 +32,11 @@ class Users(SystemProperty):
     Functions (Methods):
         - __init__: Initialize Users class.
         - _get_all_linux: Retrieve information about all users on a Linux system.
-        - _parse_passwd_output: Parse the output of the /etc/passwd file from a Linux system.
+        - _format_users: Build the users listing from the parsed passwd entries.
+        - select: Filter and project the users lazily, one user at a time.
+        - query: Paginated, filtered and projected listing of the users.
+        - add_users: Create many users in a single operation of the account backend.
+        - assign_passwords: Assign passwords to many users in a single operation of the account backend.
     """
 
     def __init__(self, os_name: str):
@@ -48,30 +61,35 @@ class Users(SystemProperty):
             dict: A dictionary containing information about the user.
         """
         try:
-            output, error, status = await execute(f"getent passwd {username}")
+            entry = await accounts.user(username)
 
-            if status == 0:
-                parts = output.split(":")
-                if len(parts) >= 6:
-                    uid = parts[2]
-                    gid = parts[3]
-                    full_name = parts[4].split(",")[0]
-                    home_dir = parts[5]
-                    shell = parts[6].strip()
-
-                    return {
-                        "username": username,
-                        "uid": uid,
-                        "gid": gid,
-                        "full_name": full_name,
-                        "home_dir": home_dir,
-                        "shell": shell,
-                        "login": Users.is_login(username)
-                    }
-                else:
+            if entry is None:
+                # Not a local account, ask NSS (LDAP, SSSD, ...)
+                output, error, status = await execute(f"getent passwd {username}")
+                if status != 0:
+                    return {"status": 500, "message": error}
+
+                entry = parse_passwd(output).get(username)
+                if entry is None:
                     return {"status": 404, "message": "User not found"}
-            else:
-                return {"status": 500, "message": error}
+
+            sessions = await login_index.refresh()
+
+            return {
+                "username": username,
+                "uid": entry.uid,
+                "gid": entry.gid,
+                "full_name": entry.full_name.split(",")[0],
+                "home_dir": entry.home_dir,
+                "shell": entry.shell.strip(),
+                "login": username in sessions,
+                "session": sessions.get(username),
+                "last_login": login_index.last_login(username),
+                "groups": (await accounts.memberships()).groups_of(username),
+                "password": await accounts.password_info(username)
+            }
+        except ExecutorBusy:
+            raise
         except Exception as e:
             return {"status": 500, "message": str(e)}
 
@@ -82,48 +100,37 @@ class Users(SystemProperty):
             dict: A dictionary containing information about all users.
         """
         try:
-            output, error, status = await execute("cat /etc/passwd")
-            if status == 0:
-                data = {"status": 200, "users": self._parse_passwd_output(output)}
-            else:
-                data = {"status": 500, "message": error}
-            return data
+            entries = await accounts.users()
+            sessions = await login_index.refresh()
+            return {"status": 200, "users": self._format_users(entries, sessions)}
+        except ExecutorBusy:
+            raise
         except Exception as e:
             return {"status": "NOK", "message": str(e)}
 
-    def _parse_passwd_output(self, output: str) -> dict:
-        """Parse the output of the /etc/passwd file from a Linux system.
+    @staticmethod
+    def _format_users(entries: Dict[str, UserRecord], sessions: Dict[str, Any]) -> dict:
+        """Build the users listing from the parsed passwd entries.
 
         Args:
-            output (str): The contents of the /etc/passwd file.
+            entries (dict): The parsed passwd entries.
+            sessions (dict): The login index snapshot used to fill the login flag.
 
         Returns:
-            dict: A dictionary containing parsed user information.
+            dict: A dictionary containing user information.
         """
-        users = {}
-
-        for line in output.splitlines():
-            parts = line.split(':')
-
-            if len(parts) >= 7:
-                username = parts[0]
-                uid = parts[2]
-                gid = parts[3]
-                full_name = parts[4]
-                home_dir = parts[5]
-                shell = parts[6]
-
-                users[username] = {
-                    "username": username,
-                    "uid": uid,
-                    "gid": gid,
-                    "full_name": full_name,
-                    "home_dir": home_dir,
-                    "shell": shell,
-                    "login": Users.is_login(username)
-                }
-
-        return users
+        return {
+            username: {
+                "username": username,
+                "uid": entry.uid,
+                "gid": entry.gid,
+                "full_name": entry.full_name,
+                "home_dir": entry.home_dir,
+                "shell": entry.shell,
+                "login": username in sessions
+            }
+            for username, entry in entries.items()
+        }
 
     async def add_user(self, username: str, full_name: str, homedir: str, shell: str) -> dict:
         """Add a new user to the system.
@@ -139,8 +146,8 @@ class Users(SystemProperty):
             dict: A dictionary with status and message.
         """
         try:
-            command = f"useradd -m -s {shell} -c {full_name} -d {homedir} {username}"
-            output, error, status = await execute(command)
+            output, error, status = await account_backend.add_user(username, full_name, homedir, shell)
+            accounts.invalidate()
             if status == 0:
                 return {
                     "status": 200,
@@ -155,9 +162,158 @@ class Users(SystemProperty):
                     "stdout": output,
                     "error": error
                 }
+        except ExecutorBusy:
+            raise
         except Exception as e:
             return {"status": 501, "message": str(e)}
 
+    async def select(self, limit: Optional[int] = None, cursor: str = "", fields: str = "",
+                     uid_min: Optional[int] = None, uid_max: Optional[int] = None, shell: str = "",
+                     kind: str = "", member_of: str = "",
+                     logged_in: Optional[bool] = None) -> Tuple[List[str], Iterator[Tuple[int, str, Any]]]:
+        """Filter and project the users lazily, one user at a time.
+
+        The login state and the group membership are only computed when they
+        are requested as a field or used as a filter.
+
+        Args:
+            limit (int, optional): Maximum number of users to return, all if None.
+            cursor (str): Cursor returned by the previous page, empty for the first one.
+            fields (str): Comma separated fields to return, the legacy ones if empty.
+            uid_min (int, optional): Minimum uid.
+            uid_max (int, optional): Maximum uid.
+            shell (str): Only the users with this shell.
+            kind (str): "system" or "human" accounts only.
+            member_of (str): Only the members of this group (primary or supplementary).
+            logged_in (bool, optional): Only the users logged in (True) or not (False).
+
+        Returns:
+            tuple: The ordered usernames and an iterator of (next position, username, user).
+
+        Raises:
+            ValueError: When a parameter is invalid.
+        """
+        selected = parse_fields(fields, USER_FIELDS, DEFAULT_USER_FIELDS)
+
+        if limit is not None and limit < 1:
+            raise ValueError("The limit must be positive")
+        if kind not in ("", "system", "human"):
+            raise ValueError("The kind must be system or human")
+
+        entries = await accounts.users()
+        names = list(entries)
+        position = resume_position(names, cursor)
+
+        sessions = await login_index.refresh() if "login" in selected or logged_in is not None else {}
+
+        memberships = await accounts.memberships() if "groups" in selected or member_of else None
+        members = set(memberships.users_of(member_of)) if member_of else set()
+
+        record_only = tuple(selected) == RECORD_FIELDS
+
+        def rows(position: int) -> Iterator[Tuple[int, str, Any]]:
+            count = 0
+
+            while position < len(names) and (limit is None or count < limit):
+                username = names[position]
+                entry = entries[username]
+                position += 1
+
+                uid = entry.uid if entry.uid >= 0 else None
+                if not in_range(uid, uid_min, uid_max):
+                    continue
+                if shell and entry.shell != shell:
+                    continue
+                if kind and id_kind(uid) != kind:
+                    continue
+                if member_of and username not in members:
+                    continue
+                if logged_in is not None and (username in sessions) != logged_in:
+                    continue
+
+                count += 1
+
+                if record_only:
+                    # The record is serialized as is, no intermediate dict
+                    yield position, username, entry
+                    continue
+
+                user: Dict[str, Any] = {}
+                for field in selected:
+                    if field == "login":
+                        user["login"] = username in sessions
+                    elif field == "groups":
+                        user["groups"] = memberships.groups_of(username)
+                    else:
+                        user[field] = getattr(entry, field)
+                yield position, username, user
+
+        return names, rows(position)
+
+    async def query(self, limit: Optional[int] = None, cursor: str = "", fields: str = "",
+                    uid_min: Optional[int] = None, uid_max: Optional[int] = None, shell: str = "",
+                    kind: str = "", member_of: str = "", logged_in: Optional[bool] = None) -> dict:
+        """Paginated, filtered and projected listing of the users.
+
+        Args:
+            limit (int, optional): Maximum number of users to return, all if None.
+            cursor (str): Cursor returned by the previous page, empty for the first one.
+            fields (str): Comma separated fields to return, the legacy ones if empty.
+            uid_min (int, optional): Minimum uid.
+            uid_max (int, optional): Maximum uid.
+            shell (str): Only the users with this shell.
+            kind (str): "system" or "human" accounts only.
+            member_of (str): Only the members of this group (primary or supplementary).
+            logged_in (bool, optional): Only the users logged in (True) or not (False).
+
+        Returns:
+            dict: status, users and next_cursor (None on the last page).
+
+        Raises:
+            ValueError: When a parameter is invalid.
+        """
+        names, rows = await self.select(limit, cursor, fields, uid_min, uid_max, shell, kind, member_of, logged_in)
+
+        users: Dict[str, Any] = {}
+        position = len(names)
+
+        for position, username, user in rows:
+            users[username] = user
+
+        return {
+            "status": 200,
+            "users": users,
+            "next_cursor": next_cursor(names, position, limit, len(users))
+        }
+
+    async def add_users(self, rows: List[Dict[str, str]]) -> List[Dict[str, Any]]:
+        """Create many users in a single operation of the account backend.
+
+        Users without a password are left locked, the same state `useradd`
+        leaves them in.
+
+        Args:
+            rows (list): Dictionaries with the username, full_name, homedir, shell and passwd keys.
+
+        Returns:
+            list: One dictionary with username, status and message per row, in order.
+        """
+        failed, notes = await account_backend.add_users(rows)
+        accounts.invalidate()
+
+        results: List[Dict[str, Any]] = []
+        for i, row in enumerate(rows):
+            if i in failed:
+                results.append({"username": row["username"], "status": 500, "message": failed[i]})
+            else:
+                results.append({"username": row["username"], "status": 200,
+                                "message": f"Utilisateur {row['username']} créé avec succès !"})
+
+        for position, note in notes.items():
+            results[position]["message"] += f" ({note})"
+
+        return results
+
     async def del_user(self, username: str) -> dict:
         """Delete a user from the system.
 
@@ -168,8 +324,8 @@ class Users(SystemProperty):
             dict: A dictionary with status and message.
         """
         try:
-            command = f"userdel {username}"
-            output, error, status = await execute(command)
+            output, error, status = await account_backend.del_user(username)
+            accounts.invalidate()
             if status == 0:
                 return {
                     "status": 200,
@@ -184,11 +340,13 @@ class Users(SystemProperty):
                     "stdout": output,
                     "error": error
                 }
+        except ExecutorBusy:
+            raise
         except Exception as e:
             return {"status": 501, "message": str(e)}
 
     @staticmethod
-    def is_login(username: str) -> bool:
+    async def is_login(username: str) -> bool:
         """
         Check if a user is logged in.
 
@@ -198,16 +356,41 @@ class Users(SystemProperty):
         Returns:
             bool: True if the user is logged in, False otherwise.
         """
-        all_processes = psutil.process_iter(attrs=['username'])
+        return await login_index.is_login(username)
+
+    @staticmethod
+    async def assign_passwords(passwords: List[Tuple[str, str]]) -> List[Dict[str, Any]]:
+        """
+        Assign passwords to many users in a single operation of the account backend.
+
+        The passwords never appear on a command line.
+
+        Args:
+            passwords (list): (username, password) pairs.
+
+        Returns:
+            list: One dictionary with username, status and message per pair, in order.
+        """
+        results: List[Dict[str, Any]] = []
+        pairs: List[Tuple[str, str]] = []
+        positions: List[int] = []
+
+        for username, passwd in passwords:
+            if not username or ":" in username or "\n" in username or "\n" in passwd:
+                results.append({"username": username, "status": 400, "message": "Invalid username or password"})
+            else:
+                results.append({"username": username, "status": 200, "message": "Le mot de passe a été modifié avec succès"})
+                positions.append(len(results) - 1)
+                pairs.append((username, passwd))
 
-        for process in all_processes:
-            try:
-                if process.info['username'] == username:
-                    return True
-            except (psutil.NoSuchProcess, psutil.AccessDenied):
-                return False
+        if pairs:
+            failed = await account_backend.set_passwords(pairs)
+            accounts.invalidate("shadow")
 
-        return False
+            for position, error in failed.items():
+                results[positions[position]].update(status=500, message=error)
+
+        return results
 
     @staticmethod
     async def assign_password(username: str, passwd: str) -> dict:
@@ -222,22 +405,23 @@ class Users(SystemProperty):
             dict: A dictionary with status and message.
         """
         try:
-            command = f"echo '{passwd}' | sudo passwd --stdin {username}"
-            output, error, status = await execute(command)
-            if status == 0:
+            result = (await Users.assign_passwords([(username, passwd)]))[0]
+            if result["status"] == 200:
                 return {
                     "status": 200,
                     "message": "Le mot de passe a été modifié avec succès",
-                    "stdout": output,
-                    "error": error
+                    "stdout": "",
+                    "error": ""
                 }
             else:
                 return {
-                    "status": 500,
+                    "status": result["status"],
                     "message": "Le mot de passe n'a pas été modifié avec succès !",
-                    "stdout": output,
-                    "error": error
+                    "stdout": "",
+                    "error": result["message"]
                 }
+        except ExecutorBusy:
+            raise
         except Exception as e:
             return {"status": 501, "message": str(e)}
 
@@ -257,17 +441,11 @@ class Users(SystemProperty):
             dict: A dictionary with status and message.
         """
         try:
-            command = f"usermod -c '{full_name}'"
             if passwd:
                 await Users.assign_password(username, passwd)
-            if homedir:
-                command += f" -d '{homedir}'"
-            if shell:
-                command += f" -s '{shell}'"
-            command += f" {username}"
 
-            # Execute the command
-            output, error, status = await execute(command)
+            output, error, status = await account_backend.modify_user(username, full_name, homedir, shell)
+            accounts.invalidate("passwd")
 
             # Check if the command was successful
             if status == 0:
@@ -284,6 +462,8 @@ class Users(SystemProperty):
                     "stdout": output,
                     "error": error
                 }
+        except ExecutorBusy:
+            raise
         except Exception as e:
             return {"status": 501, "message": str(e)}
 
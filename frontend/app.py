@@ -1,9 +1,16 @@
-from flask import Flask, render_template, redirect, request, flash, url_for
-import requests
+from flask import Flask, Response, render_template, redirect, request, flash, url_for, stream_with_context
+from backend_client import backend, backend_async, BackendUnavailable
+import os
+import threading
+import time
 
 app = Flask(__name__)
 app.secret_key = 'azerty123'
-base_url = "http://localhost:13500/api"
+
+
+@app.errorhandler(BackendUnavailable)
+def backend_unavailable(error):
+    return f"Backend unavailable: {error}", 503
 
 #########################
 ###    Utilisateurs   ###
@@ -11,20 +18,18 @@ base_url = "http://localhost:13500/api"
 
 @app.route('/')
 def index():
-    response_users = requests.get(f"{base_url}/users")
+    status, users_data = backend.get_listing("/users")
     
-    if response_users.status_code == 200:
-        users_data = response_users.json()
+    if status == 200:
         return render_template("users.html", users=users_data)
     else:
         return "Failed to fetch users"
 
 @app.route('/users')
 def users():
-    response_users = requests.get(f"{base_url}/users")
+    status, users_data = backend.get_listing("/users")
     
-    if response_users.status_code == 200:
-        users_data = response_users.json()
+    if status == 200:
         return render_template("users.html", users=users_data)
     else:
         return "Failed to fetch users"
@@ -32,11 +37,13 @@ def users():
 
 @app.route('/user/<string:username>')
 def user(username):
-    response = requests.get(f"{base_url}/user/{username}")
+    (status, user_data), (groups_status, groups_data) = backend_async.get_json(
+        f"/user/{username}", f"/user/{username}/groups"
+    )
 
-    if response.status_code == 200:
-        user_data = response.json()
-        return render_template("user.html", user=user_data)
+    if status == 200:
+        groups_data = groups_data if groups_status == 200 else {"groups": []}
+        return render_template("user.html", user=user_data, groups=groups_data)
     else:
         return f"Failed to fetch information for user {username}"
 
@@ -56,7 +63,7 @@ def add_user():
             flash('All fields are required', 'error')
             return redirect('/add_user')
 
-        response = requests.post(f"{base_url}/user/add", json=
+        response = backend.post("/user/add", json=
                                  {"fullname": full_name,
                                   "username": username,
                                   "homedir": homedir,
@@ -84,7 +91,7 @@ def delete_user_request():
             flash('Username is required', 'error')
             return redirect('/users')
 
-        response = requests.delete(f"{base_url}/user/{username}")
+        response = backend.delete(f"/user/{username}")
 
         if response.status_code == 200:
             flash('User deleted successfully', 'success')
@@ -117,7 +124,7 @@ def update_user():
         }
 
         # Send update request to the backend API
-        response = requests.put(f"{base_url}/user/{username}", json=user_data)
+        response = backend.put(f"/user/{username}", json=user_data)
 
         print(response.json())
 
@@ -137,11 +144,13 @@ def update_user():
 
 @app.route('/groups')
 def groups():
-    response_groups = requests.get(f"{base_url}/groups")
+    (status, groups_data), (users_status, users_data) = backend_async.get_json(
+        "/groups", "/users?fields=login"
+    )
     
-    if response_groups.status_code == 200:
-        groups_data = response_groups.json()
-        return render_template("groups.html", groups=groups_data)
+    if status == 200:
+        users_data = users_data if users_status == 200 else {"users": {}}
+        return render_template("groups.html", groups=groups_data, users=users_data)
     else:
         return "Failed to fetch groups"
 
@@ -156,7 +165,7 @@ def add_member_to_group():
             flash("Group name and user are required", "error")
             return redirect(url_for('groups'))
 
-        response = requests.post(f"{base_url}/member/add", json={"groupname": groupname, "users": [user]})
+        response = backend.post("/member/add", json={"groupname": groupname, "users": [user]})
 
         if response.status_code == 200:
             flash("Member added successfully", "success")
@@ -179,7 +188,7 @@ def delete_member_from_group():
             flash("Group name and user are required", "error")
             return redirect(url_for('groups'))
 
-        response = requests.delete(f"{base_url}/member/del", json={"groupname": groupname, "users": [user]})
+        response = backend.delete("/member/del", json={"groupname": groupname, "users": [user]})
 
         if response.status_code == 200:
             flash("Member deleted successfully", "success")
@@ -203,7 +212,7 @@ def add_group():
             flash("Group name is required", "error")
             return redirect(url_for('add_group'))
 
-        response = requests.post(f"{base_url}/group/add", json={"groupname": groupname})
+        response = backend.post("/group/add", json={"groupname": groupname})
 
         if response.status_code == 200:
             flash("Group added successfully", "success")
@@ -224,7 +233,7 @@ def delete_group():
             flash("Group name is required", "error")
             return redirect(url_for('groups'))
 
-        response = requests.delete(f"{base_url}/group/del?groupname={groupname}")
+        response = backend.delete(f"/group/del?groupname={groupname}")
 
         if response.status_code == 200:
             flash("Group deleted successfully", "success")
@@ -235,10 +244,64 @@ def delete_group():
     else:
         return "Method Not Allowed", 405
 
+#########################
+###      Events       ###
+#########################
+
+# Every relayed stream holds a worker thread: at most this many per worker, each
+# closed after EVENTS_MAX_AGE seconds (the browser reconnects with Last-Event-ID)
+EVENTS_MAX_STREAMS = int(os.environ.get("SYSMANAGE_EVENTS_MAX_STREAMS", 2))
+EVENTS_MAX_AGE = float(os.environ.get("SYSMANAGE_EVENTS_MAX_AGE", 300))
+event_streams = threading.BoundedSemaphore(EVENTS_MAX_STREAMS)
+
+
+@app.route('/events')
+def events():
+    """Relay the server-sent events of the backend to the browser."""
+    if not event_streams.acquire(blocking=False):
+        # EventSource gives up on an error status, an empty stream makes it retry later
+        return Response("retry: 30000\n\n", mimetype="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+    try:
+        response = _relay_events()
+    except BaseException:
+        event_streams.release()
+        raise
+    # Called by the server once the response is done, even if it was never iterated
+    response.call_on_close(event_streams.release)
+    return response
+
+
+def _relay_events():
+    headers = {}
+    if request.headers.get("Last-Event-ID"):
+        headers["Last-Event-ID"] = request.headers["Last-Event-ID"]
+
+    # The backend sends a keep-alive every 15 seconds
+    upstream = backend.get("/events", headers=headers, stream=True, timeout=(backend.timeout[0], 60))
+
+    if upstream.status_code != 200:
+        upstream.close()
+        return Response("Failed to subscribe to the events", status=upstream.status_code)
+
+    def relay():
+        deadline = time.monotonic() + EVENTS_MAX_AGE
+        try:
+            for chunk in upstream.iter_content(chunk_size=None):
+                yield chunk
+                if time.monotonic() > deadline:
+                    break
+        finally:
+            upstream.close()
+
+    response = Response(stream_with_context(relay()), mimetype="text/event-stream",
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    response.call_on_close(upstream.close)
+    return response
+
 #########################
 ###      Main         ###
 #########################
 
 if __name__ == '__main__':
     app.run(debug=True)
-
@@ -0,0 +1,361 @@
+####################################################################################
+# Author: Djetic Alexandre
+# Description: This module contains the shared HTTP client used by the front end
+#              to talk to the backend API
+####################################################################################
+
+import asyncio
+import os
+import threading
+import time
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import MaxRetryError
+from urllib3.util.retry import Retry
+
+
+class BackendUnavailable(Exception):
+    """Raised when the backend can not be reached or the circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """Stop calling a failing backend for a while.
+
+    After ``failure_threshold`` consecutive failures the circuit opens and every
+    call fails immediately for ``reset_timeout`` seconds. Then a single trial
+    call is let through: success closes the circuit, failure opens it again.
+
+    Functions (Methods):
+        - __init__: Initialize the CircuitBreaker class.
+        - allow: Check if a call may be attempted.
+        - success: Record a successful call.
+        - failure: Record a failed call.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        """Initialize CircuitBreaker class.
+
+        Args:
+            failure_threshold (int): Consecutive failures opening the circuit (default is 5).
+            reset_timeout (float): Seconds before a trial call is allowed (default is 30 seconds).
+        """
+        self.failure_threshold: int = failure_threshold
+        self.reset_timeout: float = reset_timeout
+        self._failures: int = 0
+        self._opened_at: float = 0.0
+        self._trial: bool = False
+        self._lock: threading.Lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """Check if a call may be attempted."""
+        with self._lock:
+            if self._failures < self.failure_threshold:
+                return True
+            if not self._trial and time.monotonic() - self._opened_at >= self.reset_timeout:
+                self._trial = True
+                return True
+            return False
+
+    def success(self) -> None:
+        """Record a successful call."""
+        with self._lock:
+            self._failures = 0
+            self._trial = False
+
+    def failure(self) -> None:
+        """Record a failed call."""
+        with self._lock:
+            self._failures += 1
+            self._trial = False
+            if self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+
+
+class DeadlineRetry(Retry):
+    """Retry policy that gives up once the deadline of the current call has passed.
+
+    The HTTP adapter shares one policy between the threads, so the deadline
+    of the call in flight is kept per thread by BackendClient.request.
+    """
+
+    call_deadline: threading.local = threading.local()
+
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None):
+        retry = super().increment(method, url, response, error, _pool, _stacktrace)
+        deadline = getattr(self.call_deadline, "value", None)
+        if deadline is not None and time.monotonic() + retry.get_backoff_time() >= deadline:
+            raise MaxRetryError(_pool, url, error or "deadline of the call exceeded")
+        return retry
+
+
+class BackendClient:
+    """Pooled keep-alive client of the backend API.
+
+    A single requests.Session is shared by every view, so connections to the
+    backend are reused instead of being opened (and left in TIME_WAIT) for
+    each call. Every call has connect and read timeouts. Connection failures
+    are retried with jittered backoff, as are 429/5xx answers to GET and HEAD
+    only; no retry starts past the deadline of the call. A circuit breaker
+    fails fast while the backend is down.
+
+    Functions (Methods):
+        - __init__: Initialize the BackendClient class.
+        - request: Send a request to the backend.
+        - get, post, put, delete: Shortcuts of request.
+        - get_listing: Fetch a listing, revalidating the local copy with its ETag.
+    """
+
+    def __init__(self, base_url: str, pool_size: int = 16, connect_timeout: float = 2.0,
+                 read_timeout: float = 20.0, retries: int = 3, breaker: CircuitBreaker = None,
+                 deadline: float = 25.0):
+        """Initialize BackendClient class.
+
+        Args:
+            base_url (str): The base url of the API.
+            pool_size (int): Maximum number of kept-alive connections (default is 16).
+            connect_timeout (float): Connect timeout in seconds (default is 2 seconds).
+            read_timeout (float): Read timeout in seconds (default is 20 seconds).
+            retries (int): Retries of the failed connections and of the reads answered 429/5xx (default is 3).
+            breaker (CircuitBreaker, optional): The circuit breaker to use.
+            deadline (float): Seconds after which a call is not retried any more (default is 25 seconds).
+        """
+        self.base_url: str = base_url.rstrip("/")
+        self.timeout: tuple = (connect_timeout, read_timeout)
+        self.breaker: CircuitBreaker = breaker or CircuitBreaker()
+        self.deadline: float = deadline
+
+        # A timed out read may have been applied: it is never retried, and the
+        # answers are only retried for GET/HEAD. Retry-After (30 s on a busy
+        # executor) is not waited for, the backoff stays short.
+        retry = DeadlineRetry(
+            total=retries,
+            connect=retries,
+            read=0,
+            status=retries,
+            backoff_factor=0.2,
+            backoff_jitter=0.2,
+            backoff_max=2.0,
+            status_forcelist=(429, 502, 503, 504),
+            allowed_methods=frozenset({"GET", "HEAD"}),
+            respect_retry_after_header=False,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+
+        self.session: requests.Session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+        # Local copy of the listings: path -> (etag, data)
+        self._listings: dict = {}
+
+    def request(self, method: str, path: str, **kwargs) -> requests.Response:
+        """Send a request to the backend.
+
+        Args:
+            method (str): The HTTP method.
+            path (str): The path, relative to the base url.
+            **kwargs: Passed to requests.Session.request.
+
+        Returns:
+            requests.Response: The response of the backend.
+
+        Raises:
+            BackendUnavailable: When the backend can not be reached or the circuit is open.
+        """
+        if not self.breaker.allow():
+            raise BackendUnavailable("The backend is unavailable")
+
+        kwargs.setdefault("timeout", self.timeout)
+
+        DeadlineRetry.call_deadline.value = time.monotonic() + self.deadline
+        try:
+            response = self.session.request(method, f"{self.base_url}{path}", **kwargs)
+        except requests.RequestException as e:
+            self.breaker.failure()
+            raise BackendUnavailable(str(e))
+        finally:
+            DeadlineRetry.call_deadline.value = None
+
+        if response.status_code >= 500:
+            self.breaker.failure()
+        else:
+            self.breaker.success()
+
+        return response
+
+    def get(self, path: str, **kwargs) -> requests.Response:
+        return self.request("GET", path, **kwargs)
+
+    def post(self, path: str, **kwargs) -> requests.Response:
+        return self.request("POST", path, **kwargs)
+
+    def put(self, path: str, **kwargs) -> requests.Response:
+        return self.request("PUT", path, **kwargs)
+
+    def delete(self, path: str, **kwargs) -> requests.Response:
+        return self.request("DELETE", path, **kwargs)
+
+    def get_listing(self, path: str) -> tuple:
+        """
+        Fetch a listing, revalidating the local copy with its ETag.
+
+        Returns:
+            tuple: The status code and the JSON data (None on failure).
+        """
+        cached = self._listings.get(path)
+        headers = {"If-None-Match": cached[0]} if cached else {}
+        response = self.get(path, headers=headers)
+
+        if response.status_code == 304 and cached:
+            return 200, cached[1]
+
+        if response.status_code != 200:
+            return response.status_code, None
+
+        data = response.json()
+        etag = response.headers.get("ETag")
+        if etag:
+            self._listings[path] = (etag, data)
+
+        return 200, data
+
+
+class AsyncBackendClient:
+    """Concurrent fan-out of backend calls for the composite pages.
+
+    A single httpx.AsyncClient lives on an event loop running in a background
+    thread, so its keep-alive pool is shared by every request and every
+    worker thread. Views stay synchronous (any WSGI server works) and hand a
+    group of calls to the loop, the page then waits for the slowest call
+    instead of the sum of all of them.
+
+    Functions (Methods):
+        - __init__: Initialize the AsyncBackendClient class.
+        - get_json: Fetch several endpoints concurrently.
+        - close: Close the client and stop its event loop.
+    """
+
+    def __init__(self, base_url: str, pool_size: int = 16, connect_timeout: float = 2.0,
+                 read_timeout: float = 20.0, retries: int = 3, breaker: CircuitBreaker = None,
+                 deadline: float = 25.0):
+        """Initialize AsyncBackendClient class.
+
+        Args:
+            base_url (str): The base url of the API.
+            pool_size (int): Maximum number of connections (default is 16).
+            connect_timeout (float): Connect timeout in seconds (default is 2 seconds).
+            read_timeout (float): Read timeout in seconds (default is 20 seconds).
+            retries (int): Retries of the failed connections (default is 3).
+            breaker (CircuitBreaker, optional): The circuit breaker to use.
+            deadline (float): Seconds a group of calls may take in all (default is 25 seconds).
+        """
+        self.base_url: str = base_url.rstrip("/")
+        self.pool_size: int = pool_size
+        self.timeout: httpx.Timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        self.retries: int = retries
+        self.breaker: CircuitBreaker = breaker or CircuitBreaker()
+        self.deadline: float = deadline
+
+        self._loop: asyncio.AbstractEventLoop = None
+        self._client: httpx.AsyncClient = None
+        self._lock: threading.Lock = threading.Lock()
+        # Local copy of the listings: path -> (etag, data), only used on the loop
+        self._listings: dict = {}
+
+    def _start(self) -> asyncio.AbstractEventLoop:
+        # Started lazily so that forking servers create it in each worker
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name="backend-client", daemon=True).start()
+        return self._loop
+
+    async def _fetch(self, path: str) -> tuple:
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size),
+                transport=httpx.AsyncHTTPTransport(retries=self.retries),
+            )
+
+        if not self.breaker.allow():
+            raise BackendUnavailable("The backend is unavailable")
+
+        cached = self._listings.get(path)
+        headers = {"If-None-Match": cached[0]} if cached else {}
+
+        try:
+            response = await self._client.get(path, headers=headers)
+        except httpx.HTTPError as e:
+            self.breaker.failure()
+            raise BackendUnavailable(str(e))
+
+        if response.status_code >= 500:
+            self.breaker.failure()
+        else:
+            self.breaker.success()
+
+        if response.status_code == 304 and cached:
+            return 200, cached[1]
+
+        if response.status_code != 200:
+            return response.status_code, None
+
+        data = response.json()
+        etag = response.headers.get("ETag")
+        if etag:
+            self._listings[path] = (etag, data)
+
+        return 200, data
+
+    async def _gather(self, paths: tuple) -> list:
+        try:
+            return await asyncio.wait_for(asyncio.gather(*(self._fetch(path) for path in paths)), self.deadline)
+        except asyncio.TimeoutError:
+            self.breaker.failure()
+            raise BackendUnavailable(f"The backend did not answer within {self.deadline} seconds")
+
+    def get_json(self, *paths: str) -> list:
+        """
+        Fetch several endpoints concurrently.
+
+        Args:
+            *paths (str): The paths to GET, relative to the base url.
+
+        Returns:
+            list: A (status code, JSON data or None) tuple per path, in order.
+
+        Raises:
+            BackendUnavailable: When the backend can not be reached or the circuit is open.
+        """
+        future = asyncio.run_coroutine_threadsafe(self._gather(paths), self._start())
+        return future.result()
+
+    def close(self) -> None:
+        """Close the client and stop its event loop."""
+        if self._loop is None:
+            return
+        if self._client is not None:
+            asyncio.run_coroutine_threadsafe(self._client.aclose(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+
+backend: BackendClient = BackendClient(
+    os.environ.get("SYSMANAGE_BACKEND_URL", "http://localhost:13500/api"),
+    pool_size=int(os.environ.get("SYSMANAGE_BACKEND_POOL", 16)),
+    connect_timeout=float(os.environ.get("SYSMANAGE_BACKEND_CONNECT_TIMEOUT", 2)),
+    read_timeout=float(os.environ.get("SYSMANAGE_BACKEND_READ_TIMEOUT", 20)),
+    deadline=float(os.environ.get("SYSMANAGE_BACKEND_DEADLINE", 25)),
+)
+
+backend_async: AsyncBackendClient = AsyncBackendClient(
+    backend.base_url,
+    pool_size=int(os.environ.get("SYSMANAGE_BACKEND_POOL", 16)),
+    connect_timeout=float(os.environ.get("SYSMANAGE_BACKEND_CONNECT_TIMEOUT", 2)),
+    read_timeout=float(os.environ.get("SYSMANAGE_BACKEND_READ_TIMEOUT", 20)),
+    breaker=backend.breaker,
+    deadline=backend.deadline,
+)